@@ -3,6 +3,7 @@ import sys
 import subprocess
 import jinja2
 from metadata_extractor import CORDEXMetadataExtractor, obs4MIPSMetadataExtractor
+from ocw.data_source.catalog import Catalog
 
 # These should be modified. TODO: domains can also be made into separate group
 # CORDEX domain
@@ -25,8 +26,15 @@ else:
 
 # Extract metadata from model and obs files, pairing up files with the same
 # variables for separate evaluations
-obs_extractor = obs4MIPSMetadataExtractor(obs_dir)
-models_extractor = CORDEXMetadataExtractor(models_dir)
+# The catalog only re-reads files which were added or modified since the
+# last run.
+if not os.path.exists(workdir):
+    os.makedirs(workdir)
+catalog = Catalog(os.path.join(workdir, 'catalog.db'))
+catalog.scan(obs_dir, models_dir)
+obs_extractor = obs4MIPSMetadataExtractor(obs_dir, catalog=catalog)
+models_extractor = CORDEXMetadataExtractor(models_dir, catalog=catalog)
+catalog.close()
 groups = obs_extractor.group(models_extractor, 'variable')
 
 # Configuration file template, to be rendered repeatedly for each evaluation
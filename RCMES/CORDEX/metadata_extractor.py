@@ -3,7 +3,7 @@ import os
 
 
 class MetadataExtractor(object):
-    def __init__(self, *paths):
+    def __init__(self, *paths, **kwargs):
         """Extracts metadata from data filenames.
 
         Instances of MetadataExtractor are used to extract metadata from
@@ -27,10 +27,20 @@ class MetadataExtractor(object):
         based on common field name as follows:
         >>> extractor.group(extractor2, 'variable')
 
+        The filenames are listed from the directories on every instantiation.
+        To list them from an ocw.data_source.catalog.Catalog of the
+        directories instead, pass it as the catalog keyword argument:
+        >>> catalog = Catalog('/path/to/catalog.db')
+        >>> catalog.scan('/path/to/data')
+        >>> extractor = MetadataExtractor('/path/to/data', catalog=catalog)
+
         This class should only be used as a starting point. We recommend using
         the included obs4MIPSMetadataExtractor and CORDEXMetadataExtractor
         subclasses or creating your own subclass for your usecase.
         """
+        self.catalog = kwargs.pop('catalog', None)
+        if kwargs:
+            raise TypeError("Unexpected arguments: {}".format(list(kwargs)))
         self.paths = paths
 
     @property
@@ -72,9 +82,12 @@ class MetadataExtractor(object):
         """
         List of files (or regular expressions) for each dataset.
         """
-        files = []
-        for path in self.paths:
-            files.extend(glob.glob(os.path.join(path, '*.nc')))
+        if self.catalog is not None:
+            files = self.catalog.list_files(*self.paths)
+        else:
+            files = []
+            for path in self.paths:
+                files.extend(glob.glob(os.path.join(path, '*.nc')))
         return list(set(self.get_pattern(fname) for fname in files))
 
     @property
@@ -118,7 +118,7 @@ multiplying_factor[0] = fact
 names = [dataset.name for dataset in datasets]
 for i, dataset in enumerate(datasets):
     res = dataset.temporal_resolution()
-    if res == 'daily' or res == 'monthly':
+    if res in ['hourly', 'daily', 'monthly', 'yearly']:
         datasets[i] = dsp.normalize_dataset_datetimes(dataset, res)
         if multiplying_factor[i] != 1:
             datasets[i].values *= multiplying_factor[i]
@@ -251,6 +251,9 @@ print('Writing a netcdf file: ',workdir+config['output_netcdf_filename'])
 if not os.path.exists(workdir):
     os.system("mkdir -p "+workdir)
 
+# Store the targets in one (model, time, y, x) variable instead of one
+# variable per target
+model_axis = config.get('output_netcdf_model_axis', False)
 if config['use_subregions']:
     dsp.write_netcdf_multiple_datasets_with_subregions(
         reference_dataset, reference_name, target_datasets, target_names,
@@ -259,12 +262,14 @@ if config['use_subregions']:
         ref_subregion_mean=reference_subregion_mean,
         ref_subregion_std=reference_subregion_std,
         model_subregion_mean=target_subregion_mean,
-        model_subregion_std=target_subregion_std)
+        model_subregion_std=target_subregion_std,
+        model_axis=model_axis)
 else:
     dsp.write_netcdf_multiple_datasets_with_subregions(
                                 reference_dataset, reference_name, target_datasets,
                                 target_names,
-                                path=workdir+config['output_netcdf_filename'])
+                                path=workdir+config['output_netcdf_filename'],
+                                model_axis=model_axis)
 
 """ Step 7: Calculate metrics and draw plots """
 nmetrics = config['number_of_metrics_and_plots']
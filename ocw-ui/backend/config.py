@@ -24,3 +24,7 @@ WORK_DIR = '/tmp/ocw/'
 # Any directory under this will be visible to the frontend when loading
 # a local model file.
 PATH_LEADER = '/usr/local/ocw'
+
+# SQLite catalog in which the metadata of local files is cached, so that a
+# file is only opened again after it has been modified.
+CATALOG_PATH = WORK_DIR + 'catalog.db'
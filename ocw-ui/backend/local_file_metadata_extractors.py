@@ -17,16 +17,37 @@
 
 ''' Helpers for local model/observation file metadata extraction. '''
 
+import os
 import sys
-import netCDF4
 import json
 
 from bottle import Bottle, request, route, response
 
-import ocw.utils
+from config import CATALOG_PATH
+from ocw.data_source.catalog import Catalog
 
 lfme_app = Bottle()
 
+def _get_file_metadata(file_path):
+    ''' Get the cached metadata of a file, indexing the file first if it is
+    new or has been modified since it was last indexed.
+
+    :param file_path: Path to the NetCDF file.
+    :type file_path: string:
+
+    :returns: The metadata of the file, see
+        :meth:`ocw.data_source.catalog.Catalog.get_file`.
+    '''
+    catalog_dir = os.path.dirname(CATALOG_PATH)
+    if catalog_dir and not os.path.exists(catalog_dir):
+        os.makedirs(catalog_dir)
+
+    catalog = Catalog(CATALOG_PATH)
+    try:
+        return catalog.index_file(file_path)
+    finally:
+        catalog.close()
+
 @lfme_app.route('/list_latlon/<file_path:path>')
 def list_latlon(file_path):
     ''' Retrieve lat/lon information from given file.
@@ -61,57 +82,16 @@ def list_latlon(file_path):
             'variables': List of all variables present in the NetCDF file
         }
     '''
-    in_file = netCDF4.Dataset(file_path, mode='r')
-
-    var_names = set([key.encode().lower() for key in in_file.variables.keys()])
-    var_names_list = list(var_names)
-
-    lat_name_guesses = set(['latitude','lat','lats','latitudes'])
-    lon_name_guesses = set(['longitude','lon','lons','longitudes'])
-
-    # Attempt to determine the lat name
-    found_lat_name = False
-
-    # Find the intersection (if there is one) of the var names with the lat guesses
-    lat_guesses = list(var_names & lat_name_guesses)
-
-    if len(lat_guesses) >= 1:
-        found_lat_name = True
-        lat_name = var_names_list[var_names_list.index(lat_guesses[0])]
-
-        lats = in_file.variables[lat_name][:]
-
-        # Change 0 - 360 degree values to be -180 to 180
-        lats[lats > 180] = lats[lats > 180] - 360
-
-        lat_min = float(lats.min())
-        lat_max = float(lats.max())
+    metadata = _get_file_metadata(file_path)
+    var_names_list = [name.lower() for name in metadata['variables']]
 
-    # Attempt to determine the lon name
-    found_lon_name = False
-
-    # Find the intersection (if there is one) of the var names with the lon guesses
-    lon_guesses = list(var_names & lon_name_guesses)
-
-    if len(lon_guesses) >= 1:
-        found_lon_name = True
-        lon_name = var_names_list[var_names_list.index(lon_guesses[0])]
-
-        lons = in_file.variables[lon_name][:]
-
-        # Change 0 - 360 degree values to be -180 to 180
-        lons[lons > 180] = lons[lons > 180] - 360
-
-        lon_min = float(lons.min())
-        lon_max = float(lons.max())
-
-    in_file.close()
-
-    success = found_lat_name and found_lon_name
+    success = (metadata['lat_name'] is not None and
+               metadata['lon_name'] is not None and
+               metadata['error'] is None)
     if success:
-        values = [success, lat_name, lon_name, lat_min, lat_max, lon_min, lon_max]
-        value_names = ['success', 'lat_name', 'lon_name', 'lat_min', 'lat_max', 'lon_min', 'lon_max']
-        output = dict(zip(value_names, values))
+        value_names = ['lat_name', 'lon_name', 'lat_min', 'lat_max', 'lon_min', 'lon_max']
+        output = dict((name, metadata[name]) for name in value_names)
+        output['success'] = success
     else:
         output = {'success': success, 'variables': var_names_list}
 
@@ -150,29 +130,15 @@ def list_time(file_path):
             "variables": List of all variable names in the file
         } 
     '''
-    in_file = netCDF4.Dataset(file_path, mode='r')
-
-    var_names = set([key.encode().lower() for key in in_file.variables.keys()])
-    var_names_list = list(var_names)
-
-    time_name_guesses = set(['time', 'times', 't', 'date', 'dates', 'julian'])
-
-    # Find the intersection (if there is one) of the var names with the lat guesses
-    time_guesses = list(var_names & time_name_guesses)
-
-    if len(time_guesses) >= 1:
-        # Convert time data to datetime objects
-        time_var_name = time_guesses[0]
-        times = ocw.utils.decode_time_values(in_file, time_var_name)
-
-        start_time = str(min(times))
-        end_time = str(max(times))
+    metadata = _get_file_metadata(file_path)
+    var_names_list = [name.lower() for name in metadata['variables']]
 
+    if metadata['start_time'] is not None:
         output = {
             'success': True,
-            'time_name': time_var_name,
-            'start_time': start_time,
-            'end_time': end_time
+            'time_name': metadata['time_name'],
+            'start_time': metadata['start_time'],
+            'end_time': metadata['end_time']
         }
     else:
         output = {'success': False, 'variables': var_names_list}
@@ -210,16 +176,18 @@ def list_vars(file_path):
         }
     '''
     try:
-        in_file = netCDF4.Dataset(file_path, mode='r')
-    except RuntimeError:
+        metadata = _get_file_metadata(file_path)
+    except ValueError:
         output = {'success': False}
     else:
-        output = {'success': True, 'variables': in_file.variables.keys()}
-        in_file.close()
-    finally:
-        if request.query.callback:
-            return "%s(%s)" % (request.query.callback, json.dumps(output))
-        return output
+        if metadata['error'] is None:
+            output = {'success': True, 'variables': list(metadata['variables'])}
+        else:
+            output = {'success': False}
+
+    if request.query.callback:
+        return "%s(%s)" % (request.query.callback, json.dumps(output))
+    return output
 
 @lfme_app.hook('after_request')
 def enable_cors():
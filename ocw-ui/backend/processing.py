@@ -18,7 +18,6 @@
 ''' Provides endpoints for running an OCW evaluation. '''
 
 from datetime import timedelta, datetime
-import inspect
 import sys
 import os
 import json
@@ -468,16 +467,10 @@ def _get_valid_metric_options():
 
     :returns: A dictionary of metric (name, object) pairs
     '''
-    invalid_metrics = ['ABCMeta', 'Metric', 'UnaryMetric', 'BinaryMetric']
-
     # Consider all Unary Metrics invalid. At the moment, the UI cannot handle
     # running Unary Metrics.
-    unary_metrics = [cls.__name__ for cls in metrics.UnaryMetric.__subclasses__()]
-    invalid_metrics += unary_metrics
-
-    return {name:obj
-            for name, obj in inspect.getmembers(metrics)
-            if inspect.isclass(obj) and name not in invalid_metrics}
+    return {cls.__name__: cls
+            for cls in metrics.built_in_metrics(metrics.BinaryMetric)}
 
 def _generate_evaluation_plots(evaluation, lat_bins, lon_bins, eval_time_stamp):
     ''' Generate the Evaluation's plots
@@ -0,0 +1,76 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+'''
+Package wide settings of the Open Climate Workbench.
+
+Functions:
+    set_dtype - Set the floating point type used to store processed values.
+
+    get_dtype - Get the floating point type used to store processed values.
+'''
+
+import numpy
+
+#: Floating point types that values can be stored in.
+VALID_DTYPES = [numpy.dtype('float32'), numpy.dtype('float64')]
+
+_dtype = numpy.dtype('float64')
+
+
+def set_dtype(dtype):
+    '''Set the package wide floating point type of processed values.
+
+    Every array allocated by :mod:`dataset_processor`, :mod:`utils` and
+    :mod:`metrics` to hold dataset values is created with this type, unless
+    the Dataset being processed has its own ``dtype`` setting. Sums and
+    means are still accumulated in double precision where it matters.
+
+    :param dtype: Either 'float32' or 'float64' (the default).
+    :type dtype: :mod:`string` or :class:`numpy.dtype`
+
+    :raises ValueError: If dtype isn't a supported floating point type.
+    '''
+    global _dtype
+    _dtype = _validate_dtype(dtype)
+
+
+def get_dtype(dataset=None):
+    '''Get the floating point type in which processed values are stored.
+
+    :param dataset: (Optional) The Dataset being processed. Its ``dtype``
+        setting takes precedence over the package wide setting.
+    :type dataset: :class:`dataset.Dataset`
+
+    :returns: The floating point type.
+    :rtype: :class:`numpy.dtype`
+    '''
+    dataset_dtype = getattr(dataset, 'dtype', None)
+    if dataset_dtype is not None:
+        return numpy.dtype(dataset_dtype)
+    return _dtype
+
+
+def _validate_dtype(dtype):
+    '''Convert dtype into a numpy.dtype and check that it's supported.'''
+    dtype = numpy.dtype(dtype)
+    if dtype not in VALID_DTYPES:
+        error = "Unsupported dtype {}. Expected one of {}".format(
+            dtype, [str(valid) for valid in VALID_DTYPES])
+        raise ValueError(error)
+    return dtype
@@ -0,0 +1,383 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+'''
+Classes:
+    ResponseCache - Local record/replay cache of remote data source responses.
+
+Functions:
+    enable - Cache the responses of the RCMED, ESGF search and OpenDAP
+        data sources.
+
+    disable - Stop caching responses.
+
+    get_cache - Get the active ResponseCache.
+
+    open_url - Open a url through the active ResponseCache.
+
+    open_response - Open a url through the active ResponseCache for reading
+        in a with block.
+
+    discard_url - Remove the cached response to a url.
+
+    normalize_url - Normalize a url and its query parameters.
+
+Setting the OCW_RESPONSE_CACHE environment variable to a directory enables
+the cache when this module is imported. OCW_RESPONSE_CACHE_MODE can be set
+to 'replay' to run without network access.
+'''
+
+# Needed Python 2/3 urllib compatability
+try:
+    from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+except ImportError:
+    from urllib import urlencode
+    from urlparse import parse_qsl, urlsplit, urlunsplit
+
+import contextlib
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+#: Modes of a ResponseCache. 'record' serves fresh cached responses and
+#: fetches and stores the others. 'replay' only serves cached responses,
+#: however old they are, and never accesses the network.
+MODES = ['record', 'replay']
+
+#: Seconds a response of each kind of request stays fresh. None never expires.
+DEFAULT_TTLS = {
+    'rcmed_metadata': 24 * 3600,
+    'rcmed': 30 * 24 * 3600,
+    'esgf_search': 24 * 3600,
+    'dap': 7 * 24 * 3600,
+}
+
+#: Default size limit of the cached responses in bytes.
+DEFAULT_MAX_SIZE = 10 * 2 ** 30
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    kind TEXT,
+    url TEXT,
+    created REAL,
+    accessed REAL,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+'''
+
+_cache = None
+
+
+class ResponseCache(object):
+    '''Local record/replay cache of remote data source responses.
+
+    Responses are stored as files in a directory, indexed by a SQLite
+    database of their normalized request urls. The least recently used
+    responses are removed when the cached responses exceed max_size bytes.
+
+    >>> cache = ResponseCache('/path/to/cache', ttls={'rcmed': None})
+    >>> response = cache.open(url, 'rcmed', lambda: urlopen(url))
+    '''
+
+    def __init__(self, directory, mode='record', max_size=DEFAULT_MAX_SIZE,
+                 ttls=None):
+        '''Open or create a cache.
+
+        :param directory: The directory of the cached responses. It is
+            created if needed.
+        :type directory: :mod:`string`
+
+        :param mode: (Optional) One of MODES.
+        :type mode: :mod:`string`
+
+        :param max_size: (Optional) The size limit of the cached responses in
+            bytes. The newest response is kept even if it's larger.
+        :type max_size: :class:`int`
+
+        :param ttls: (Optional) Seconds a response of each kind of request
+            stays fresh, overriding DEFAULT_TTLS.
+        :type ttls: :class:`dict`
+
+        :raises ValueError: If mode isn't one of MODES.
+        '''
+        if mode not in MODES:
+            raise ValueError("Invalid cache mode '{}'. Use one of {}."
+                             .format(mode, ', '.join(MODES)))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.mode = mode
+        self.max_size = max_size
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            os.path.join(directory, 'responses.db'), check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        '''Close the database connection.'''
+        self._connection.close()
+
+    def open(self, url, kind, opener, params=None):
+        '''Open the response to a request, from the cache if possible.
+
+        :param url: The url of the request.
+        :type url: :mod:`string`
+
+        :param kind: The kind of request, which sets how long its response
+            stays fresh. See DEFAULT_TTLS.
+        :type kind: :mod:`string`
+
+        :param opener: Function without arguments that sends the request
+            and returns its response as a binary file-like object.
+        :type opener: :func:`function`
+
+        :param params: (Optional) Parameters of the request besides the
+            query parameters of url.
+        :type params: :class:`dict`
+
+        :returns: The response, as a binary file object.
+
+        :raises IOError: If the response isn't cached in replay mode.
+        '''
+        normalized_url = normalize_url(url, params)
+        key = _response_key(normalized_url, kind)
+        path = os.path.join(self.directory, key)
+
+        with self._lock:
+            entry = self._connection.execute(
+                'SELECT created FROM responses WHERE key = ?',
+                (key,)).fetchone()
+        if entry is not None and (self.mode == 'replay' or
+                                  self._is_fresh(kind, entry['created'])):
+            try:
+                response = open(path, 'rb')
+            except IOError:
+                logger.warning('The cached response of %s is missing.',
+                               normalized_url)
+            else:
+                with self._lock, self._connection:
+                    self._connection.execute(
+                        'UPDATE responses SET accessed = ? WHERE key = ?',
+                        (time.time(), key))
+                return response
+
+        if self.mode == 'replay':
+            raise IOError('The response of {} is not cached and the cache is '
+                          'in replay mode.'.format(normalized_url))
+
+        # The response is written to a temporary file first, so that an
+        # interrupted download isn't taken for a cached response.
+        body = opener()
+        temp_file = tempfile.NamedTemporaryFile(dir=self.directory,
+                                                delete=False)
+        try:
+            with temp_file, contextlib.closing(body):
+                shutil.copyfileobj(body, temp_file, 1 << 20)
+            size = os.path.getsize(temp_file.name)
+            os.rename(temp_file.name, path)
+        except BaseException:
+            os.remove(temp_file.name)
+            raise
+
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                (key, kind, normalized_url, now, now, size))
+            self._evict(key)
+
+        return open(path, 'rb')
+
+    def discard(self, url, kind, params=None):
+        '''Remove the cached response to a request, if any.
+
+        Responses are never removed in replay mode.
+
+        :param url: The url of the request.
+        :type url: :mod:`string`
+
+        :param kind: The kind of request.
+        :type kind: :mod:`string`
+
+        :param params: (Optional) Parameters of the request besides the
+            query parameters of url.
+        :type params: :class:`dict`
+        '''
+        if self.mode == 'replay':
+            return
+        key = _response_key(normalize_url(url, params), kind)
+        with self._lock, self._connection:
+            self._remove(key)
+
+    def size(self):
+        '''The size of the cached responses in bytes.'''
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def clear(self, kind=None):
+        '''Remove the cached responses, or those of one kind of request.'''
+        with self._lock, self._connection:
+            if kind is None:
+                rows = self._connection.execute('SELECT key FROM responses')
+            else:
+                rows = self._connection.execute(
+                    'SELECT key FROM responses WHERE kind = ?', (kind,))
+            for row in rows.fetchall():
+                self._remove(row['key'])
+
+    def _is_fresh(self, kind, created):
+        ttl = self.ttls.get(kind)
+        return ttl is None or time.time() - created <= ttl
+
+    def _evict(self, keep_key):
+        '''Remove least recently used responses, other than keep_key, until
+        the cache fits in max_size.'''
+        total = self._connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        rows = self._connection.execute(
+            'SELECT key, size FROM responses WHERE key != ? '
+            'ORDER BY accessed', (keep_key,)).fetchall()
+        for row in rows:
+            if total <= self.max_size:
+                break
+            self._remove(row['key'])
+            total -= row['size']
+
+    def _remove(self, key):
+        self._connection.execute('DELETE FROM responses WHERE key = ?',
+                                 (key,))
+        try:
+            os.remove(os.path.join(self.directory, key))
+        except OSError:
+            pass
+
+
+def enable(directory, mode='record', max_size=DEFAULT_MAX_SIZE, ttls=None):
+    '''Cache the responses of the RCMED, ESGF search and OpenDAP data sources.
+
+    See :class:`ResponseCache` for the parameters.
+
+    :returns: The active cache.
+    :rtype: :class:`ResponseCache`
+    '''
+    global _cache
+    disable()
+    _cache = ResponseCache(directory, mode=mode, max_size=max_size,
+                           ttls=ttls)
+    return _cache
+
+
+def disable():
+    '''Stop caching responses.'''
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = None
+
+
+def get_cache():
+    '''Get the active ResponseCache, or None if caching is disabled.'''
+    return _cache
+
+
+def open_url(url, kind, opener, params=None):
+    '''Open the response to a request through the active cache.
+
+    See :meth:`ResponseCache.open` for the parameters. Without an active
+    cache opener is called directly.
+    '''
+    if _cache is None:
+        return opener()
+    return _cache.open(url, kind, opener, params=params)
+
+
+@contextlib.contextmanager
+def open_response(url, kind, opener, params=None):
+    '''Open a url through the active cache for reading in a with block.
+
+    The response is closed at the end of the block. If the block raises,
+    for example because the response is truncated or malformed, the
+    response is discarded from the cache so that a retry requests it again.
+
+    >>> with open_response(url, 'rcmed', lambda: urlopen(url)) as response:
+    ...     rows = parse(response)
+
+    See :meth:`ResponseCache.open` for the parameters.
+    '''
+    response = open_url(url, kind, opener, params=params)
+    try:
+        with contextlib.closing(response):
+            yield response
+    except Exception:
+        discard_url(url, kind, params=params)
+        raise
+
+
+def discard_url(url, kind, params=None):
+    '''Remove the cached response to a url from the active cache, if any.
+
+    See :meth:`ResponseCache.discard` for the parameters.
+    '''
+    if _cache is not None:
+        _cache.discard(url, kind, params=params)
+
+
+def normalize_url(url, params=None):
+    '''Normalize a url and its query parameters.
+
+    The scheme and host are lower cased, the fragment is removed and the
+    query parameters, including params, are sorted so that equivalent
+    requests have the same url.
+
+    :param url: The url to normalize.
+    :type url: :mod:`string`
+
+    :param params: (Optional) Parameters added to the query of url.
+    :type params: :class:`dict`
+
+    :returns: The normalized url.
+    :rtype: :mod:`string`
+    '''
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query)
+    query.extend((str(key), str(value))
+                 for key, value in (params or {}).items())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(),
+                       parts.path, urlencode(sorted(query)), ''))
+
+
+def _response_key(normalized_url, kind):
+    return hashlib.sha1((kind + ' ' + normalized_url).encode('utf-8')) \
+        .hexdigest()
+
+
+if os.environ.get('OCW_RESPONSE_CACHE'):
+    enable(os.environ['OCW_RESPONSE_CACHE'],
+           mode=os.environ.get('OCW_RESPONSE_CACHE_MODE', 'record'))
@@ -0,0 +1,501 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+'''
+Classes:
+    Catalog - Persistent SQLite index of the metadata of local netCDF files.
+
+Functions:
+    load_dataset - Load the files of a variable found in a Catalog.
+'''
+
+import fnmatch
+import glob
+import logging
+import os
+import sqlite3
+
+import netCDF4
+import numpy
+
+from ocw.dataset import TimeIndex
+import ocw.data_source.local as local
+import ocw.utils as utils
+
+logger = logging.getLogger(__name__)
+
+LAT_NAMES = ['lat', 'lats', 'latitude', 'latitudes', 'rlat', 'xlat']
+LON_NAMES = ['lon', 'lons', 'longitude', 'longitudes', 'rlon', 'xlong']
+TIME_NAMES = ['time', 'times', 't', 'date', 'dates', 'julian']
+
+# Times are stored in this format so that they sort as strings
+_TIME_FORMAT = '{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT,
+    mtime REAL,
+    size INTEGER,
+    lat_name TEXT,
+    lon_name TEXT,
+    time_name TEXT,
+    lat_min REAL,
+    lat_max REAL,
+    lon_min REAL,
+    lon_max REAL,
+    lat_resolution REAL,
+    lon_resolution REAL,
+    start_time TEXT,
+    end_time TEXT,
+    calendar TEXT,
+    time_resolution TEXT,
+    num_times INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+CREATE TABLE IF NOT EXISTS variables (
+    path TEXT,
+    name TEXT,
+    units TEXT,
+    ndim INTEGER,
+    coordinate INTEGER,
+    PRIMARY KEY (path, name)
+);
+CREATE INDEX IF NOT EXISTS variables_name ON variables (name);
+'''
+
+_FILE_COLUMNS = ['path', 'directory', 'mtime', 'size', 'lat_name',
+                 'lon_name', 'time_name', 'lat_min', 'lat_max', 'lon_min',
+                 'lon_max', 'lat_resolution', 'lon_resolution', 'start_time',
+                 'end_time', 'calendar', 'time_resolution', 'num_times',
+                 'error']
+
+
+class Catalog(object):
+    '''Persistent SQLite index of the metadata of local netCDF files.
+
+    Each file is opened once to record its variables, the names and extents
+    of its lat, lon and time variables, its calendar and its resolutions.
+    Later scans only stat the files and re-open those whose modification time
+    or size changed, so listing thousands of files becomes a database query.
+
+    >>> catalog = Catalog('/path/to/catalog.db')
+    >>> catalog.scan('/path/to/CORDEX/AFR-44/*')
+    >>> catalog.query(variable='pr', start_time=datetime(1990, 1, 1))
+    '''
+
+    def __init__(self, db_path):
+        '''Open or create a catalog.
+
+        :param db_path: Path of the SQLite database file. ':memory:' creates
+            a temporary catalog.
+        :type db_path: :mod:`string`
+        '''
+        self.db_path = db_path
+        self._connection = sqlite3.connect(db_path)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        '''Close the database connection.'''
+        self._connection.close()
+
+    def scan(self, *paths, **kwargs):
+        '''Index the files of one or more directories.
+
+        Only new files and files whose modification time or size changed
+        are opened. Files which were removed from the directories are
+        removed from the catalog.
+
+        :param paths: Directories to scan. Glob patterns are expanded.
+        :type paths: :mod:`string`
+
+        :param pattern: (Optional) Shell pattern of the file names to index.
+            Defaults to '*.nc'.
+        :type pattern: :mod:`string`
+
+        :param recursive: (Optional) Also scan the subdirectories.
+        :type recursive: :class:`bool`
+
+        :returns: The number of files that were (re)indexed.
+        :rtype: :class:`int`
+        '''
+        pattern = kwargs.pop('pattern', '*.nc')
+        recursive = kwargs.pop('recursive', False)
+        if kwargs:
+            raise TypeError('Unexpected arguments: {}'.format(list(kwargs)))
+
+        directories = set()
+        for path in paths:
+            directories.update(os.path.abspath(match)
+                               for match in glob.glob(path)
+                               if os.path.isdir(match))
+        if recursive:
+            for directory in list(directories):
+                for root, _, _ in os.walk(directory):
+                    directories.add(root)
+
+        num_indexed = 0
+        for directory in sorted(directories):
+            file_paths = [os.path.join(directory, name)
+                          for name in os.listdir(directory)
+                          if fnmatch.fnmatch(name, pattern)]
+            file_paths = [path for path in file_paths if os.path.isfile(path)]
+            known = dict((row['path'], (row['mtime'], row['size']))
+                         for row in self._connection.execute(
+                             'SELECT path, mtime, size FROM files '
+                             'WHERE directory = ?', (directory,)))
+
+            for path in file_paths:
+                if self._index_file(path, known.get(path)):
+                    num_indexed += 1
+
+            removed = set(known) - set(file_paths)
+            self._remove(removed)
+        self._connection.commit()
+        return num_indexed
+
+    def index_file(self, path):
+        '''Index a single file if it is new or has changed and return its
+        metadata.
+
+        :param path: Path of the netCDF file.
+        :type path: :mod:`string`
+
+        :returns: The metadata of the file, see :meth:`get_file`.
+        :rtype: :class:`dict`
+
+        :raises ValueError: If the file doesn't exist.
+        '''
+        path = os.path.abspath(path)
+        if not os.path.isfile(path):
+            raise ValueError("File '{}' does not exist.".format(path))
+        row = self._connection.execute(
+            'SELECT mtime, size FROM files WHERE path = ?', (path,)).fetchone()
+        known = (row['mtime'], row['size']) if row else None
+        if self._index_file(path, known):
+            self._connection.commit()
+        return self.get_file(path)
+
+    def get_file(self, path):
+        '''Get the recorded metadata of a file.
+
+        :param path: Path of the netCDF file.
+        :type path: :mod:`string`
+
+        :returns: The columns of the files table and a 'variables' dictionary
+            mapping each variable name to its units and number of
+            dimensions, or None if the file isn't in the catalog.
+        :rtype: :class:`dict`
+        '''
+        path = os.path.abspath(path)
+        row = self._connection.execute(
+            'SELECT * FROM files WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return None
+
+        metadata = dict(zip(row.keys(), tuple(row)))
+        metadata['variables'] = dict(
+            (var['name'], {'units': var['units'], 'ndim': var['ndim'],
+                           'coordinate': bool(var['coordinate'])})
+            for var in self._connection.execute(
+                'SELECT * FROM variables WHERE path = ? ORDER BY rowid',
+                (path,)))
+        return metadata
+
+    def query(self, variable=None, directory=None, lat_min=None, lat_max=None,
+              lon_min=None, lon_max=None, start_time=None, end_time=None):
+        '''Find the indexed files that match all of the given criteria.
+
+        :param variable: (Optional) Name of a (non coordinate) variable the
+            files must contain.
+        :type variable: :mod:`string`
+
+        :param directory: (Optional) Directory the files must be in.
+        :type directory: :mod:`string`
+
+        :param lat_min: (Optional) Files must have latitudes north of this.
+        :type lat_min: :class:`float`
+
+        :param lat_max: (Optional) Files must have latitudes south of this.
+        :type lat_max: :class:`float`
+
+        :param lon_min: (Optional) Files must have longitudes east of this.
+        :type lon_min: :class:`float`
+
+        :param lon_max: (Optional) Files must have longitudes west of this.
+        :type lon_max: :class:`float`
+
+        :param start_time: (Optional) Files must have times after this.
+        :type start_time: :class:`datetime.datetime`
+
+        :param end_time: (Optional) Files must have times before this.
+        :type end_time: :class:`datetime.datetime`
+
+        :returns: The metadata of the matching files sorted by path, see
+            :meth:`get_file`.
+        :rtype: :class:`list` of :class:`dict`
+        '''
+        conditions = ['error IS NULL']
+        parameters = []
+        if variable is not None:
+            conditions.append('path IN (SELECT path FROM variables '
+                              'WHERE name = ? AND coordinate = 0)')
+            parameters.append(variable)
+        if directory is not None:
+            conditions.append('directory = ?')
+            parameters.append(os.path.abspath(directory))
+        for column, operator, value in [('lat_max', '>=', lat_min),
+                                        ('lat_min', '<=', lat_max),
+                                        ('lon_max', '>=', lon_min),
+                                        ('lon_min', '<=', lon_max),
+                                        ('end_time', '>=', start_time),
+                                        ('start_time', '<=', end_time)]:
+            if value is not None:
+                conditions.append('{} {} ?'.format(column, operator))
+                if column.endswith('_time'):
+                    value = _format_time(value)
+                parameters.append(value)
+
+        rows = self._connection.execute(
+            'SELECT path FROM files WHERE {} ORDER BY path'.format(
+                ' AND '.join(conditions)), parameters)
+        return [self.get_file(row['path']) for row in rows.fetchall()]
+
+    def list_files(self, *paths, **kwargs):
+        '''List the indexed files of one or more directories without
+        touching the file system.
+
+        :param paths: Directories of the files. Shell patterns are matched
+            against the indexed directories, where '*' also matches '/'.
+        :type paths: :mod:`string`
+
+        :param pattern: (Optional) Shell pattern of the file names. Defaults
+            to '*.nc'.
+        :type pattern: :mod:`string`
+
+        :returns: The sorted paths of the files.
+        :rtype: :class:`list` of :mod:`string`
+        '''
+        pattern = kwargs.pop('pattern', '*.nc')
+        if kwargs:
+            raise TypeError('Unexpected arguments: {}'.format(list(kwargs)))
+
+        paths = [os.path.abspath(path) for path in paths]
+        directories = [row['directory'] for row in self._connection.execute(
+            'SELECT DISTINCT directory FROM files')]
+        directories = [directory for directory in directories
+                       if any(fnmatch.fnmatch(directory, path)
+                              for path in paths)]
+
+        files = []
+        for directory in directories:
+            files.extend(row['path'] for row in self._connection.execute(
+                'SELECT path FROM files WHERE directory = ?', (directory,))
+                if fnmatch.fnmatch(os.path.basename(row['path']), pattern))
+        return sorted(files)
+
+    def variables(self):
+        '''Get the names of all the (non coordinate) variables in the
+        catalog.
+
+        :returns: The sorted variable names.
+        :rtype: :class:`list` of :mod:`string`
+        '''
+        return [row['name'] for row in self._connection.execute(
+            'SELECT DISTINCT name FROM variables WHERE coordinate = 0 '
+            'ORDER BY name')]
+
+    def _index_file(self, path, known):
+        '''(Re)index a file unless its (mtime, size) matches known.
+
+        :returns: True if the file was opened and indexed.
+        '''
+        stat = os.stat(path)
+        if known is not None and tuple(known) == (stat.st_mtime,
+                                                  stat.st_size):
+            return False
+
+        metadata = {'path': path,
+                    'directory': os.path.dirname(path),
+                    'mtime': stat.st_mtime,
+                    'size': stat.st_size}
+        variables = []
+        try:
+            netcdf = netCDF4.Dataset(path, mode='r')
+        except (IOError, OSError, RuntimeError) as error:
+            metadata['error'] = str(error)
+        else:
+            try:
+                variables = _extract_metadata(netcdf, metadata)
+            finally:
+                netcdf.close()
+
+        self._remove([path])
+        self._connection.execute(
+            'INSERT INTO files ({}) VALUES ({})'.format(
+                ', '.join(_FILE_COLUMNS), ', '.join('?' * len(_FILE_COLUMNS))),
+            [metadata.get(column) for column in _FILE_COLUMNS])
+        self._connection.executemany(
+            'INSERT INTO variables (path, name, units, ndim, coordinate) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(path,) + variable for variable in variables])
+        return True
+
+    def _remove(self, paths):
+        '''Remove files from the catalog.'''
+        for path in paths:
+            self._connection.execute('DELETE FROM files WHERE path = ?',
+                                     (path,))
+            self._connection.execute('DELETE FROM variables WHERE path = ?',
+                                     (path,))
+
+
+def load_dataset(catalog_path, variable_name, directory=None, name='',
+                 **query):
+    ''' Load a variable from the local files found in a catalog.
+
+    The files are expected to be the time slices of a single dataset. The
+    lat, lon and time variable names recorded in the catalog are used.
+
+    :param catalog_path: Path of the SQLite catalog.
+    :type catalog_path: :mod:`string`
+
+    :param variable_name: The variable name to load.
+    :type variable_name: :mod:`string`
+
+    :param directory: (Optional) Only load files from this directory. It is
+        scanned before the catalog is queried.
+    :type directory: :mod:`string`
+
+    :param name: (Optional) A name for the loaded dataset.
+    :type name: :mod:`string`
+
+    :param query: (Optional) Further criteria of :meth:`Catalog.query`, such
+        as lat_min or start_time.
+
+    :returns: An OCW Dataset object with the requested variable's data.
+    :rtype: :class:`dataset.Dataset`
+
+    :raises ValueError: If no file in the catalog matches.
+    '''
+    catalog = Catalog(catalog_path)
+    try:
+        if directory is not None:
+            catalog.scan(directory)
+        files = catalog.query(variable=variable_name, directory=directory,
+                              **query)
+    finally:
+        catalog.close()
+
+    if not files:
+        raise ValueError("No file in the catalog '{}' contains the variable "
+                         "'{}'.".format(catalog_path, variable_name))
+
+    kwargs = dict(lat_name=files[0]['lat_name'],
+                  lon_name=files[0]['lon_name'],
+                  time_name=files[0]['time_name'],
+                  name=name)
+    if len(files) == 1:
+        return local.load_file(files[0]['path'], variable_name, **kwargs)
+    return local.load_dataset_from_multiple_netcdf_files(
+        variable_name, file_list=[meta['path'] for meta in files], **kwargs)
+
+
+def _find_variable(netcdf, guesses):
+    ''' Find the name of a variable from a list of lower case guesses. '''
+    names = dict((name.lower(), name) for name in netcdf.variables)
+    for guess in guesses:
+        if guess in names:
+            return names[guess]
+    return None
+
+
+def _extract_metadata(netcdf, metadata):
+    ''' Fill metadata with the coordinate information of a netCDF file.
+
+    Extents which can't be determined are left out and logged.
+
+    :returns: A (name, units, ndim, coordinate) tuple for each variable.
+    '''
+    lat_name = _find_variable(netcdf, LAT_NAMES)
+    lon_name = _find_variable(netcdf, LON_NAMES)
+    time_name = _find_variable(netcdf, TIME_NAMES)
+    metadata.update(lat_name=lat_name, lon_name=lon_name,
+                    time_name=time_name)
+
+    try:
+        _extract_extents(netcdf, metadata)
+    except Exception as error:
+        logger.warning("Unable to determine the extents of '%s': %s",
+                       metadata['path'], error)
+
+    coordinates = set([lat_name, lon_name, time_name])
+    coordinates.update(netcdf.dimensions)
+    return [(name, getattr(variable, 'units', None), variable.ndim,
+             int(name in coordinates))
+            for name, variable in netcdf.variables.items()]
+
+
+def _extract_extents(netcdf, metadata):
+    ''' Fill metadata with the extents and resolutions of the lat, lon and
+    time variables named in it. '''
+    lat_name = metadata['lat_name']
+    lon_name = metadata['lon_name']
+    time_name = metadata['time_name']
+    if lat_name and lon_name:
+        lats = numpy.asarray(netcdf.variables[lat_name][:], dtype=float)
+        lons = numpy.asarray(netcdf.variables[lon_name][:], dtype=float)
+        # Change 0 - 360 degree values to be -180 to 180
+        lons[lons > 180] = lons[lons > 180] - 360
+        metadata.update(lat_min=float(lats.min()), lat_max=float(lats.max()),
+                        lon_min=float(lons.min()), lon_max=float(lons.max()))
+        if lats.ndim == 1 and numpy.unique(lats).size > 1:
+            metadata['lat_resolution'] = float(numpy.diff(
+                numpy.unique(lats))[0])
+        if lons.ndim == 1 and numpy.unique(lons).size > 1:
+            metadata['lon_resolution'] = float(numpy.diff(
+                numpy.unique(lons))[0])
+        if lats.ndim == 2 and min(lats.shape) > 1:
+            metadata['lat_resolution'] = float(lats[1, 1] - lats[0, 0])
+            metadata['lon_resolution'] = float(lons[1, 1] - lons[0, 0])
+
+    if time_name and netcdf.variables[time_name].size:
+        time_index = TimeIndex(utils.decode_time_values(netcdf, time_name))
+        metadata.update(
+            calendar=time_index.calendar,
+            num_times=len(time_index),
+            start_time=_format_time_fields(time_index,
+                                           time_index.start_index()),
+            end_time=_format_time_fields(time_index, time_index.end_index()))
+        if len(time_index) > 1:
+            metadata['time_resolution'] = time_index.temporal_resolution()
+
+
+def _format_time(time):
+    ''' Format a datetime like object with _TIME_FORMAT. '''
+    return _TIME_FORMAT.format(
+        time.year, time.month, time.day, getattr(time, 'hour', 0),
+        getattr(time, 'minute', 0), getattr(time, 'second', 0))
+
+
+def _format_time_fields(time_index, index):
+    ''' Format the time at index of a TimeIndex like _format_time. '''
+    return _TIME_FORMAT.format(
+        *[int(getattr(time_index, field)[index])
+          for field in ['year', 'month', 'day', 'hour', 'minute', 'second']])
@@ -15,15 +15,27 @@
 # specific language governing permissions and limitations
 # under the License.
 
+import io
+from multiprocessing.pool import ThreadPool
+
+from netCDF4 import num2date
 from pydap.client import open_url
-from netcdftime import utime
 import numpy as np
-from ocw.dataset import Dataset
+import numpy.ma as ma
+import ocw.data_source.cache as cache
+import ocw.utils as utils
+from ocw.dataset import Dataset, TimeIndex
+
+# Requests for more values than this are split into chunks of times.
+MAX_REQUEST_VALUES = 2 ** 24
 
 
-def load(url, variable, name=''):
+def load(url, variable, name='', bounds=None, time_chunk=None, nworkers=4):
     '''Load a Dataset from an OpenDAP URL
 
+    Only the values within bounds are requested from the server. Large
+    requests are split into chunks of times, which are fetched concurrently.
+
     :param url: The OpenDAP URL for the dataset of interest.
     :type url: :mod:`string`
 
@@ -33,10 +45,63 @@ def load(url, variable, name=''):
     :param name: (Optional) A name for the loaded dataset.
     :type name: :mod:`string`
 
+    :param bounds: (Optional) The rectangular spatial and temporal bounds of
+        the values to load. Longitudes aren't wrapped around.
+    :type bounds: :class:`dataset.Bounds`
+
+    :param time_chunk: (Optional) The number of times requested at once.
+        Defaults to as many as fit in MAX_REQUEST_VALUES values.
+    :type time_chunk: :class:`int`
+
+    :param nworkers: (Optional) The number of requests sent at once.
+    :type nworkers: :class:`int`
+
     :returns: A :class:`dataset.Dataset` containing the dataset pointed to by
         the OpenDAP URL.
 
     :raises: ServerError
+    :raises ValueError: If no values are within bounds.
+    '''
+    params = {'variable': variable}
+    if bounds is not None:
+        params.update(lat_min=bounds.lat_min, lat_max=bounds.lat_max,
+                      lon_min=bounds.lon_min, lon_max=bounds.lon_max,
+                      start=bounds.start, end=bounds.end)
+    if cache.get_cache() is None:
+        arrays = _fetch_arrays(url, variable, bounds, time_chunk, nworkers)
+    else:
+        # The arrays are only serialized to be cached.
+        with cache.open_response(
+                url, 'dap',
+                lambda: _save_arrays(_fetch_arrays(url, variable, bounds,
+                                                   time_chunk, nworkers)),
+                params=params) as response:
+            # The arrays are read before the response is closed.
+            arrays = dict(np.load(response))
+
+    times = _decode_times(arrays['times'], str(arrays['time_units']),
+                          str(arrays['calendar']))
+    values = arrays['values']
+    if 'mask' in arrays:
+        values = ma.array(values, mask=arrays['mask'])
+
+    origin = {
+        'source': 'dap',
+        'url': url
+    }
+
+    return Dataset(arrays['lats'], arrays['lons'], times, values, variable,
+                   name=name, origin=origin)
+
+
+def _fetch_arrays(url, variable, bounds=None, time_chunk=None, nworkers=4):
+    '''Fetch the coordinates and values of an OpenDAP variable.
+
+    :returns: The raw times, their units and calendar, the lats, the lons,
+        the values and their mask if any, by name.
+    :rtype: :class:`dict` of :class:`numpy.ndarray`
+
+    :raises ValueError: If no values are within bounds.
     '''
     # Grab the dataset information and pull the appropriate variable
     d = open_url(url)
@@ -47,33 +112,128 @@ def load(url, variable, name=''):
     # but conventions aren't always followed and all dimensions aren't always present so
     # see if we can make some educated deductions before defaulting to just pulling the first three
     # columns.
-    temp_dimensions = map(lambda x: x.lower(), dataset.dimensions)
+    temp_dimensions = [dimension.lower() for dimension in dataset.dimensions]
 
     dataset_dimensions = dataset.dimensions
-    time = dataset_dimensions[temp_dimensions.index(
-        'time') if 'time' in temp_dimensions else 0]
-    lat = dataset_dimensions[temp_dimensions.index(
-        'lat') if 'lat' in temp_dimensions else 1]
-    lon = dataset_dimensions[temp_dimensions.index(
-        'lon') if 'lon' in temp_dimensions else 2]
-
-    # Time is given to us in some units since an epoch. We need to convert
-    # these values to datetime objects. Note that we use the main object's
-    # time object and not the dataset specific reference to it. We need to
-    # grab the 'units' from it and it fails on the dataset specific object.
-    times = np.array(convert_times_to_datetime(d[time]))
-
-    lats = np.array(dataset[lat][:])
-    lons = np.array(dataset[lon][:])
-    values = np.array(dataset[:])
+    time_axis = temp_dimensions.index(
+        'time') if 'time' in temp_dimensions else 0
+    lat_axis = temp_dimensions.index('lat') if 'lat' in temp_dimensions else 1
+    lon_axis = temp_dimensions.index('lon') if 'lon' in temp_dimensions else 2
 
-    origin = {
-        'source': 'dap',
-        'url': url
+    # Time is given to us in some units since an epoch. Note that we use the
+    # main object's time object and not the dataset specific reference to it.
+    # We need to grab the 'units' from it and it fails on the dataset specific
+    # object.
+    time = d[dataset_dimensions[time_axis]]
+    time_values = np.array(time[:])
+    time_units = time.units
+    calendar = getattr(time, 'calendar', 'standard')
+    lats = np.array(_coordinate(d, dataset, dataset_dimensions[lat_axis])[:])
+    lons = np.array(_coordinate(d, dataset, dataset_dimensions[lon_axis])[:])
+
+    # Resolve the index ranges of the bounds
+    time_range = slice(0, len(time_values))
+    lat_range = slice(0, len(lats))
+    lon_range = slice(0, len(lons))
+    if bounds is not None:
+        if bounds.lat_min is not None:
+            lat_range = _index_range(
+                (lats >= bounds.lat_min) & (lats <= bounds.lat_max), 'lat')
+            lon_range = _index_range(
+                (lons >= bounds.lon_min) & (lons <= bounds.lon_max), 'lon')
+        if bounds.start or bounds.end:
+            time_index = TimeIndex(
+                _decode_times(time_values, time_units, calendar))
+            in_bounds = np.ones(len(time_values), dtype=bool)
+            if bounds.start:
+                in_bounds &= (time_index.offsets >=
+                              time_index.offset_of(bounds.start))
+            if bounds.end:
+                in_bounds &= (time_index.offsets <=
+                              time_index.offset_of(bounds.end))
+            time_range = _index_range(in_bounds, 'time')
+
+    # Request the hyperslab in chunks of times
+    ranges = {time_axis: time_range, lat_axis: lat_range, lon_axis: lon_range}
+    array = getattr(dataset, 'array', dataset)
+    shape = [ranges[axis].stop - ranges[axis].start if axis in ranges
+             else length for axis, length in enumerate(array.shape)]
+    if time_chunk is None:
+        values_per_time = int(np.prod(shape)) // max(shape[time_axis], 1)
+        time_chunk = max(MAX_REQUEST_VALUES // max(values_per_time, 1), 1)
+    chunks = [(start, min(start + time_chunk, time_range.stop))
+              for start in range(time_range.start, time_range.stop,
+                                 time_chunk)]
+
+    values = None
+    mask = None
+
+    def fetch(chunk):
+        hyperslab = [ranges.get(axis, slice(None))
+                     for axis in range(len(shape))]
+        hyperslab[time_axis] = slice(*chunk)
+        return chunk, np.ma.asarray(array[tuple(hyperslab)])
+
+    pool = ThreadPool(max(min(nworkers, len(chunks)), 1))
+    try:
+        for (start, stop), chunk_values in pool.imap_unordered(fetch, chunks):
+            if values is None:
+                values = np.empty(shape, dtype=chunk_values.dtype)
+            target = [slice(None)] * len(shape)
+            target[time_axis] = slice(start - time_range.start,
+                                      stop - time_range.start)
+            values[tuple(target)] = ma.getdata(chunk_values)
+            if ma.is_masked(chunk_values):
+                if mask is None:
+                    mask = np.zeros(shape, dtype=bool)
+                mask[tuple(target)] = ma.getmaskarray(chunk_values)
+    finally:
+        pool.close()
+        pool.join()
+
+    arrays = {
+        'times': time_values[time_range],
+        'time_units': np.array(time_units),
+        'calendar': np.array(calendar),
+        'lats': lats[lat_range],
+        'lons': lons[lon_range],
+        'values': values,
     }
+    if mask is not None:
+        arrays['mask'] = mask
+
+    return arrays
 
-    return Dataset(lats, lons, times, values, variable,
-                   name=name, origin=origin)
+
+def _save_arrays(arrays):
+    '''Save arrays in numpy's npz format, as cached by :mod:`cache`.
+
+    :rtype: :class:`io.BytesIO`
+    '''
+    output = io.BytesIO()
+    np.savez(output, **arrays)
+    output.seek(0)
+
+    return output
+
+
+def _coordinate(d, dataset, name):
+    '''Find a coordinate variable of the dataset or of the variable.'''
+    try:
+        return d[name]
+    except KeyError:
+        return dataset[name]
+
+
+def _index_range(in_bounds, name):
+    '''Get the slice from the first to the last True value of in_bounds.
+
+    :raises ValueError: If no value is True.
+    '''
+    index = np.where(in_bounds)[0]
+    if not index.size:
+        raise ValueError('No {} values are within the bounds.'.format(name))
+    return slice(int(index[0]), int(index[-1]) + 1)
 
 
 def convert_times_to_datetime(time):
@@ -85,11 +245,17 @@ def convert_times_to_datetime(time):
     :param time: The time object's values to convert
     :type time: pydap.model.BaseType
 
-    :returns: list of converted time values as datetime objects
+    :returns: array of converted time values as datetime objects
     '''
-    units = time.units
-    # parse the time units string into a useful object.
-    # NOTE: This assumes a 'standard' calendar. It's possible (likely?) that
-    #   users will want to customize this in the future.
-    parsed_time = utime(units)
-    return [parsed_time.num2date(x) for x in time[:]]
+    return _decode_times(np.array(time[:]), time.units,
+                         getattr(time, 'calendar', 'standard'))
+
+
+def _decode_times(values, units, calendar='standard'):
+    '''Convert time values in the given units to datetime objects at once.'''
+    time_format = utils._strip_time_zone(units)
+    time_fields = utils.decode_time_fields(values, time_format, calendar)
+    if time_fields is None:
+        return np.asarray(num2date(values, units=time_format,
+                                   calendar=calendar))
+    return utils.time_fields_to_datetimes(time_fields)
@@ -25,15 +25,17 @@ the library will not download them. The solution is to use the WGET script from
 a test dataset to get the credentials. The data source should work as expected then.
 
 """
+import io
 import os
 import sys
 
 import requests
 from bs4 import BeautifulSoup
 
+import ocw.data_source.cache as cache
 import ocw.data_source.local as local
 from ocw.esgf.constants import DEFAULT_ESGF_SEARCH
-from ocw.esgf.download import download
+from ocw.esgf.download import download_files
 from ocw.esgf.logon import logon
 
 if sys.version_info[0] >= 3:
@@ -52,7 +54,8 @@ def load_dataset(dataset_id,
                  search_url=DEFAULT_ESGF_SEARCH,
                  elevation_index=0,
                  name='',
-                 save_path='/tmp'):
+                 save_path='/tmp',
+                 nworkers=4):
     """ Load an ESGF dataset.
 
     :param dataset_id: The ESGF ID of the dataset to load.
@@ -79,8 +82,13 @@ def load_dataset(dataset_id,
     :type name: :mod:`string`
 
     :param save_path: (Optional) Path to where downloaded files should be saved.
+        Files that are already there and match their checksum aren't
+        downloaded again.
     :type save_path: :mod:`string`
 
+    :param nworkers: (Optional) The number of files downloaded at once.
+    :type nworkers: :class:`int`
+
     :returns: A :class:`list` of :class:`dataset.Dataset` contained the
         requested dataset. If the dataset is stored in multiple files each will
         be loaded into a separate :class:`dataset.Dataset`.
@@ -91,13 +99,16 @@ def load_dataset(dataset_id,
     download_data = \
         _get_file_download_data(url=search_url, dataset_id=dataset_id, variable=variable_name)
 
-    datasets = []
-
-    for url, var in download_data:
-        _download_files([url], esgf_username, esgf_password, download_directory=save_path)
+    file_save_paths = _download_files(
+        [url for url, _, _, _ in download_data], esgf_username,
+        esgf_password, download_directory=save_path,
+        checksums=[(checksum, checksum_type)
+                   for _, _, checksum, checksum_type in download_data],
+        nworkers=nworkers)
 
-        file_save_path = os.path.join(save_path, url.split('/')[-1])
+    datasets = []
 
+    for file_save_path, (_, var, _, _) in zip(file_save_paths, download_data):
         datasets.append(local.load_file(file_save_path, var, name=name,
                                         elevation_index=elevation_index))
 
@@ -114,12 +125,19 @@ def load_dataset(dataset_id,
 
 
 def _get_file_download_data(dataset_id, variable, url=DEFAULT_ESGF_SEARCH):
-    """"""
+    """Find the files of a dataset variable with the ESGF search service.
+
+    :returns: A :class:`list` of (url, variable, checksum, checksum type)
+        tuples, one per file. The checksum and its type are None if the
+        search service doesn't provide them.
+    """
     url += '?type=File&dataset_id={}&variable={}'
     url = url.format(dataset_id, variable)
 
-    raw_data = requests.get(url)
-    xml = BeautifulSoup(raw_data.content, "html.parser")
+    with cache.open_response(
+            url, 'esgf_search',
+            lambda: io.BytesIO(requests.get(url).content)) as raw_data:
+        xml = BeautifulSoup(raw_data.read(), "html.parser")
 
     dont_have_results = not bool(xml.response.result['numfound'])
 
@@ -127,25 +145,44 @@ def _get_file_download_data(dataset_id, variable, url=DEFAULT_ESGF_SEARCH):
         err = "esgf.load_dataset: No files found for specified dataset."
         raise ValueError(err)
 
-    # Split out URLs for dataset download along with variable names for each
-    # of those files.
-    url_groups = xml.response.result.findAll('arr', {'name': 'url'})
-    variable_groups = xml.response.result.findAll('arr', {'name': 'variable'})
+    # Split out URLs for dataset download along with variable names and
+    # checksums for each of those files.
+    download_data = []
+    for doc in xml.response.result.find_all('doc'):
+        url = _first_string(doc, 'url').split('|')[0]
+        variable = _first_string(doc, 'variable')
+        checksum = _first_string(doc, 'checksum')
+        checksum_type = _first_string(doc, 'checksum_type') or 'SHA256'
+        download_data.append((url, variable, checksum, checksum_type))
+
+    return download_data
+
 
-    urls = [group.findAll('str')[0].string.split('|')[0]
-            for group in url_groups]
-    variables = [group.findAll('str')[0].string
-                 for group in variable_groups]
+def _first_string(doc, name):
+    """The first string of a search result field, or None."""
+    group = doc.find('arr', {'name': name})
+    if group is None or group.find('str') is None:
+        return None
+    return group.find('str').string
 
-    return zip(urls, variables)
 
+def _download_files(file_urls, username, password, download_directory='/tmp',
+                    checksums=None, nworkers=4):
+    """Log on to ESGF and download files concurrently.
 
-def _download_files(file_urls, username, password, download_directory='/tmp'):
-    """"""
+    :param checksums: (Optional) A (checksum, checksum type) tuple for each
+        url. Present files that match their checksum are not downloaded.
+
+    :returns: The local paths of the files.
+    """
     try:
         logon(username, password)
     except HTTPError:
         raise ValueError('esgf._download_files: Invalid login credentials')
 
-    for url in file_urls:
-        download(url, toDirectory=download_directory)
+    if checksums is None:
+        checksums = [(None, 'SHA256')] * len(file_urls)
+    files = [(url, checksum, checksum_type)
+             for url, (checksum, checksum_type) in zip(file_urls, checksums)]
+    return download_files(files, toDirectory=download_directory,
+                          nworkers=nworkers)
@@ -19,6 +19,8 @@ import calendar
 from datetime import timedelta, datetime
 from time import strptime
 from glob import glob
+from multiprocessing.pool import ThreadPool
+import logging
 import re
 import string
 import os
@@ -35,6 +37,8 @@ LAT_NAMES = [b'lat', b'lats', b'latitude', b'latitudes',b'rlat']
 LON_NAMES = [b'lon', b'lons', b'longitude', b'longitudes',b'rlon']
 TIME_NAMES = [b'time', b'times', b'date', b'dates', b'julian']
 
+logger = logging.getLogger(__name__)
+
 
 def _get_netcdf_variable_name(valid_var_names, netcdf, netcdf_var):
     ''' Determine if one of a set of variable names are in a NetCDF Dataset.
@@ -384,6 +388,12 @@ def load_WRF_2d_files_RAIN(file_path=None,
         fields such as precipitation and surface variables into a Dataset. \
     The dataset can be spatially subset.
 
+    Each file is expected to hold a day of hourly values of the accumulated
+    RAINC and RAINNC. The runs are assumed to be yearly cycles, so the
+    hourly rates are calculated separately for each year and the first day
+    of each year is dropped as spin-up. The files are read one after the
+    other, since the netCDF C library isn't thread safe.
+
     :param file_path: Directory to the NetCDF file to load.
     :type file_path: :mod:`string`
 
@@ -397,7 +407,7 @@ def load_WRF_2d_files_RAIN(file_path=None,
         the NetCDF file.
     :rtype: :class:`dataset.Dataset`
 
-    :raises ValueError:
+    :raises ValueError: If the cycles don't all have the same length.
     '''
 
     if not filelist:
@@ -411,46 +421,53 @@ def load_WRF_2d_files_RAIN(file_path=None,
     file_object_first = netCDF4.Dataset(WRF_files[0])
     lats = file_object_first.variables['XLAT'][0, :]
     lons = file_object_first.variables['XLONG'][0, :]
+    nt_file, ny, nx = file_object_first.variables['RAINC'].shape
+    file_object_first.close()
 
     times = []
-    nfile = len(WRF_files)
-    for ifile, file in enumerate(WRF_files):
-        print('Reading file ' + str(ifile + 1) + '/' + str(nfile), file)
-        file_object = netCDF4.Dataset(file)
+    for file in WRF_files:
         time_struct_parsed = strptime(file[-19:], "%Y-%m-%d_%H:%M:%S")
-        for ihour in range(24):
+        for ihour in range(nt_file):
             times.append(
                 datetime(*time_struct_parsed[:6]) + timedelta(hours=ihour))
-        temp_value = file_object.variables['RAINC'][:] + file_object.variables['RAINNC'][:]
-        if isinstance(temp_value, numpy.ndarray):
-            temp_value = ma.array(temp_value,
-                          mask=numpy.zeros(temp_value.shape))
-        if ifile == 0:
-            values0 = temp_value
-        else:
-            values0 = ma.concatenate((values0, temp_value))
-        file_object.close()
     times = numpy.array(times)
+
+    nt = len(WRF_files) * nt_file
+    values0 = numpy.empty([nt, ny, nx])
+    mask0 = numpy.empty([nt, ny, nx], dtype=bool)
+
+    for ifile, file in enumerate(WRF_files):
+        logger.debug('Reading file %d/%d %s', ifile + 1, len(WRF_files), file)
+        file_object = netCDF4.Dataset(file)
+        temp_value = (file_object.variables['RAINC'][:] +
+                      file_object.variables['RAINNC'][:])
+        file_object.close()
+        time_slice = slice(ifile * nt_file, (ifile + 1) * nt_file)
+        values0[time_slice] = ma.filled(temp_value, 0.)
+        mask0[time_slice] = ma.getmaskarray(temp_value)
+
     years = numpy.array([d.year for d in times])
     ncycle = numpy.unique(years).size
-    print('ncycle=', ncycle)
-    nt, ny, nx = values0.shape
-    values = numpy.zeros([nt - ncycle * 24, ny, nx])
-    values = ma.array(values, mask=numpy.zeros(values.shape))
-    times2 = []
-    nt2 = nt / ncycle
-    # remove the first day in each year
-    nt3 = nt2 - 24
-    t_index = 0
-    for icycle in numpy.arange(ncycle):
-        for it in numpy.arange(nt3) + 24:
-            values[t_index, :] = values0[icycle * nt2 + it, :] - \
-                values0[icycle * nt2 + it - 1, :]
-            times2.append(times[icycle * nt2 + it])
-            t_index = t_index + 1
+    logger.debug('ncycle=%d', ncycle)
+    if nt % ncycle:
+        raise ValueError('The {} times can not be split into {} cycles of '
+                         'equal length.'.format(nt, ncycle))
+    nt2 = nt // ncycle
+
+    # De-accumulate every cycle at once and remove the first day, the first
+    # file, in each year. The rate at time it of a cycle is the difference
+    # between the accumulations at it and it - 1, so the differences start
+    # at the second time.
+    values0 = values0.reshape(ncycle, nt2, ny, nx)
+    mask0 = mask0.reshape(ncycle, nt2, ny, nx)
+    values = numpy.diff(values0, axis=1)[:, nt_file - 1:]
+    mask = (mask0[:, 1:] | mask0[:, :-1])[:, nt_file - 1:]
+    values = ma.array(values.reshape(-1, ny, nx),
+                      mask=mask.reshape(-1, ny, nx))
+    times2 = times.reshape(ncycle, nt2)[:, nt_file:].ravel()
+
     variable_name = 'PREC'
     variable_unit = 'mm/hr'
-    times2 = numpy.array(times2)
     return Dataset(lats, lons, times2, values, variable_name, units=variable_unit, name=name)
 
 
@@ -483,8 +500,9 @@ def load_dataset_from_multiple_netcdf_files(variable_name, variable_unit=None,
     :param name: (Optional) A name for the loaded dataset.
     :type name: :mod:`string`
 
-    :param file_list: A text file including a list of filenames
-    :type file_list: :mod:`string`
+    :param file_list: A text file including a list of filenames, or the
+        list of filenames itself
+    :type file_list: :mod:`string` or :class:`list`
 
     :param file_path: Directory to the NetCDF file to load.
     :type file_path: :mod:`string`
@@ -512,6 +530,8 @@ def load_dataset_from_multiple_netcdf_files(variable_name, variable_unit=None,
         filename_pattern = [''] if not filename_pattern else filename_pattern
         for pattern in filename_pattern:
             nc_files.extend(glob(file_path + pattern))
+    elif isinstance(file_list, list):
+        nc_files = list(file_list)
     else:
         nc_files = [line.rstrip('\n') for line in open(file_list)]
 
@@ -613,7 +633,9 @@ def load_GPM_IMERG_files(file_path=None,
                          filename_pattern=None,
                          filelist=None,
                          variable_name='precipitationCal',
-                         name='GPM_IMERG'):
+                         name='GPM_IMERG',
+                         spatial_window=None,
+                         nworkers=4):
     ''' Load multiple GPM Level 3 IMEGE files containing calibrated \
         precipitation and generate an OCW Dataset obejct.
 
@@ -632,46 +654,59 @@ def load_GPM_IMERG_files(file_path=None,
     :param name: (Optional) A name for the loaded dataset.
     :type name: :mod:`string`
 
+    :param spatial_window: (Optional) The (min_lat, max_lat, min_lon,
+        max_lon) of the region to load. Only the grid window covering the
+        region is read from each file.
+    :type spatial_window: :func:`tuple` of :class:`float`
+
+    :param nworkers: (Optional) The number of files read concurrently.
+    :type nworkers: :class:`int`
+
     :returns: An OCW Dataset object with the requested variable's data from \
         the HDF file.
     :rtype: :class:`dataset.Dataset`
 
-    :raises ValueError:
+    :raises ValueError: If the spatial window doesn't contain any grid point.
     '''
 
-    if not filelist:
-        GPM_files = []
-        for pattern in filename_pattern:
-            GPM_files.extend(glob(file_path + pattern))
-    else:
-        GPM_files = [line.rstrip('\n') for line in open(filelist)]
+    GPM_files = _get_GPM_files(file_path, filename_pattern, filelist)
 
-    GPM_files.sort()
-
-    file_object_first = h5py.File(GPM_files[0])
+    file_object_first = h5py.File(GPM_files[0], 'r')
     lats = file_object_first['Grid']['lat'][:]
     lons = file_object_first['Grid']['lon'][:]
+    dtype = file_object_first['Grid'][variable_name].dtype
+    file_object_first.close()
+
+    y_slice, x_slice = slice(None), slice(None)
+    if spatial_window:
+        min_lat, max_lat, min_lon, max_lon = spatial_window
+        y_slice = slice(numpy.searchsorted(lats, min_lat, side='left'),
+                        numpy.searchsorted(lats, max_lat, side='right'))
+        x_slice = slice(numpy.searchsorted(lons, min_lon, side='left'),
+                        numpy.searchsorted(lons, max_lon, side='right'))
+        lats, lons = lats[y_slice], lons[x_slice]
+        if lats.size == 0 or lons.size == 0:
+            raise ValueError('The spatial window {} does not contain any grid '
+                             'point.'.format(spatial_window))
 
     lons, lats = numpy.meshgrid(lons, lats)
 
     variable_unit = "mm/hr"
 
     times = []
-    nfile = len(GPM_files)
-    for ifile, file in enumerate(GPM_files):
-        print('Reading file ' + str(ifile + 1) + '/' + str(nfile), file)
-        file_object = h5py.File(file)
+    for file in GPM_files:
         time_struct_parsed = strptime(file[-39:-23], "%Y%m%d-S%H%M%S")
         times.append(datetime(*time_struct_parsed[:6]))
-        values0 = ma.transpose(ma.masked_less(
-            file_object['Grid'][variable_name][:], 0.))
-        values0 = ma.expand_dims(values0, axis=0)
-        if ifile == 0:
-            values = values0
-        else:
-            values = ma.concatenate((values, values0))
-        file_object.close()
     times = numpy.array(times)
+
+    values = numpy.empty((len(GPM_files),) + lats.shape, dtype=dtype)
+
+    def read_file(ifile):
+        values[ifile] = _read_GPM_window(GPM_files[ifile], variable_name,
+                                         y_slice, x_slice)
+
+    _map_in_parallel(read_file, range(len(GPM_files)), nworkers)
+    values = ma.masked_less(values, 0.)
     return Dataset(lats, lons, times, values, variable_name, units=variable_unit, name=name)
 
 def load_GPM_IMERG_files_with_spatial_filter(file_path=None,
@@ -682,7 +717,8 @@ def load_GPM_IMERG_files_with_spatial_filter(file_path=None,
                          mask_variable_name='mask',
                          user_mask_values=[10],
                          longitude_name='lon',
-                         latitude_name='lat'):
+                         latitude_name='lat',
+                         nworkers=4):
     ''' Load multiple GPM Level 3 IMEGE files containing calibrated \
         precipitation and generate a two-dimensional array \
         for the masked grid points.
@@ -706,12 +742,56 @@ def load_GPM_IMERG_files_with_spatial_filter(file_path=None,
     :type name: :mod:`string`
     :param user_mask_values: grid points where mask_variable == user_mask_value will be extracted.
     :type user_mask_values: list of strings
+    :param nworkers: (Optional) The number of files read concurrently.
+    :type nworkers: :class:`int`
     :returns: A two-dimensional array with the requested variable's MASKED data from \
         the HDF file.
     :rtype: :class:`dataset.Dataset`
-    :raises ValueError:
+    :raises ValueError: If user_mask_file isn't given.
     '''
 
+    if not user_mask_file:
+        raise ValueError('A user_mask_file is required.')
+
+    GPM_files = _get_GPM_files(file_path, filename_pattern, filelist)
+
+    file_object_first = h5py.File(GPM_files[0], 'r')
+    lats = file_object_first['Grid']['lat'][:]
+    lons = file_object_first['Grid']['lon'][:]
+    dtype = file_object_first['Grid'][variable_name].dtype
+    file_object_first.close()
+
+    lons, lats = numpy.meshgrid(lons, lats)
+
+    # The masked points are found once and only the window bounding them is
+    # read from each file.
+    file_object = netCDF4.Dataset(user_mask_file)
+    mask_variable = file_object.variables[mask_variable_name][:]
+    mask_longitude = file_object.variables[longitude_name][:]
+    mask_latitude = file_object.variables[latitude_name][:]
+    file_object.close()
+    spatial_mask = utils.regrid_spatial_mask(lons,lats,
+                                             mask_longitude, mask_latitude,
+                                             mask_variable,
+                                             user_mask_values)
+    y_index, x_index = numpy.where(spatial_mask == 0)
+    y_slice = slice(y_index.min(), y_index.max() + 1)
+    x_slice = slice(x_index.min(), x_index.max() + 1)
+    y_index = y_index - y_slice.start
+    x_index = x_index - x_slice.start
+
+    values = numpy.empty((len(GPM_files), y_index.size), dtype=dtype)
+
+    def read_file(ifile):
+        values[ifile] = _read_GPM_window(GPM_files[ifile], variable_name,
+                                         y_slice, x_slice)[y_index, x_index]
+
+    _map_in_parallel(read_file, range(len(GPM_files)), nworkers)
+    return ma.masked_less(values, 0.)
+
+
+def _get_GPM_files(file_path, filename_pattern, filelist):
+    ''' Get the sorted list of GPM files to load. '''
     if not filelist:
         GPM_files = []
         for pattern in filename_pattern:
@@ -720,34 +800,36 @@ def load_GPM_IMERG_files_with_spatial_filter(file_path=None,
         GPM_files = [line.rstrip('\n') for line in open(filelist)]
 
     GPM_files.sort()
+    return GPM_files
 
-    file_object_first = h5py.File(GPM_files[0])
-    lats = file_object_first['Grid']['lat'][:]
-    lons = file_object_first['Grid']['lon'][:]
 
-    lons, lats = numpy.meshgrid(lons, lats)
+def _read_GPM_window(file, variable_name, y_slice, x_slice):
+    ''' Read a window of a GPM variable stored with shape (lon, lat).
 
-    nfile = len(GPM_files)
-    for ifile, file in enumerate(GPM_files):
-        if ifile == 0 and user_mask_file:
-            file_object = netCDF4.Dataset(user_mask_file)
-            mask_variable = file_object.variables[mask_variable_name][:]
-            mask_longitude = file_object.variables[longitude_name][:]
-            mask_latitude = file_object.variables[latitude_name][:]
-            spatial_mask = utils.regrid_spatial_mask(lons,lats,
-                                                     mask_longitude, mask_latitude,
-                                                     mask_variable,
-                                                     user_mask_values)
-            y_index, x_index = numpy.where(spatial_mask == 0)
-        print('Reading file ' + str(ifile + 1) + '/' + str(nfile), file)
-        file_object = h5py.File(file)
-        values0 = ma.transpose(ma.masked_less(
-            file_object['Grid'][variable_name][:], 0.))
-        values_masked = values0[y_index, x_index]
-        values_masked = ma.expand_dims(values_masked, axis=0)
-        if ifile == 0:
-            values = values_masked
-        else:
-            values = ma.concatenate((values, values_masked))
+    :returns: The window with shape (lat, lon).
+    :rtype: :class:`numpy.ndarray`
+    '''
+    logger.debug('Reading file %s', file)
+    file_object = h5py.File(file, 'r')
+    try:
+        return numpy.transpose(
+            file_object['Grid'][variable_name][x_slice, y_slice])
+    finally:
         file_object.close()
-    return values
+
+
+def _map_in_parallel(function, items, nworkers):
+    ''' Call function on each item using a pool of nworkers threads.
+
+    :returns: The list of results in the order of items.
+    '''
+    items = list(items)
+    if not nworkers or nworkers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    pool = ThreadPool(min(nworkers, len(items)))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+        pool.join()
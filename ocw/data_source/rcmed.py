@@ -23,23 +23,162 @@ Classes:
 '''
 # Needed Python 2/3 urllib compatability
 try:
-    from urllib.parse import urlencode
-    from urllib.request import urlopen
+    import http.client as httplib
+    from urllib.parse import urlencode, urljoin, urlsplit
+    from urllib.request import urlopen as _urlopen
 except ImportError:
+    import httplib
     from urllib import urlencode
-    from urllib2 import urlopen
+    from urllib2 import urlopen as _urlopen
+    from urlparse import urljoin, urlsplit
 
 import re
 import json
+import logging
+import socket
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import numpy.ma as ma
 from datetime import datetime
 import calendar
 from ocw.dataset import Dataset
+import ocw.data_source.cache as cache
+
+logger = logging.getLogger(__name__)
 
 
 URL = 'http://rcmes.jpl.nasa.gov/query-api/query.php?'
 
+# Number of bytes of a query response that are parsed at once.
+READ_SIZE = 1 << 20
+
+# Columns of the rows of a query response: lat, lon, vertical, time, value.
+_NUM_COLUMNS = 5
+
+# Seconds to wait for RCMED to respond.
+TIMEOUT = 300
+
+# Number of times a failed query is retried, and the seconds to wait before
+# the first retry. The wait doubles after each failure.
+RETRIES = 3
+RETRY_BACKOFF = 2.
+
+# Large queries are split into windows of whole years. RCMED may not return
+# every row of very large queries, so the number of years in a window is
+# chosen to keep the number of rows of each query around WINDOW_ROWS. The
+# windows span at most MAX_WINDOW_GROWTH times the years of the first one.
+WINDOW_ROWS = 2000000
+MAX_WINDOW_GROWTH = 2
+
+# The HTTP connections of each thread, by scheme and host.
+_connections = threading.local()
+
+
+def _pooled_urlopen(url, redirects=5):
+    '''Open url, reusing the calling thread's connection to its host.
+
+    HTTP(S) connections are kept alive between requests, so consecutive
+    queries from the same thread don't need a new connection each. Other
+    URLs are opened with :func:`urllib.request.urlopen`. A connection is
+    only reused once its response has been read to the end, and is closed
+    if the response is closed before that.
+
+    :param url: The url to open.
+    :type url: String
+    :param redirects: The number of redirections that are followed.
+    :type redirects: Integer
+
+    :returns: The response, with a read method.
+
+    :raises IOError: If the server responds with an error status.
+    '''
+
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        return _urlopen(url)
+
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    if not hasattr(_connections, 'pool'):
+        _connections.pool = {}
+    key = (parts.scheme, parts.netloc)
+
+    # A kept alive connection may have been closed by the server, so a
+    # failure on a reused connection is retried once on a new one.
+    for reuse in [True, False]:
+        connection = _connections.pool.pop(key, None) if reuse else None
+        if connection is None:
+            reuse = False
+            if parts.scheme == 'https':
+                connection = httplib.HTTPSConnection(parts.netloc,
+                                                     timeout=TIMEOUT)
+            else:
+                connection = httplib.HTTPConnection(parts.netloc,
+                                                    timeout=TIMEOUT)
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            break
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if not reuse:
+                raise
+
+    location = response.getheader('Location')
+    if response.status in (301, 302, 303, 307, 308) and location:
+        response.read()
+        _connections.pool[key] = connection
+        if redirects < 1:
+            raise IOError('{} was redirected too many times.'.format(url))
+        return _pooled_urlopen(urljoin(url, location), redirects - 1)
+    if response.status >= 400:
+        response.read()
+        connection.close()
+        raise IOError('{} returned HTTP status {} {}.'.format(
+            url, response.status, response.reason))
+
+    return _PooledResponse(response, connection, key)
+
+
+class _PooledResponse(object):
+    '''A response that returns its connection to the calling thread's pool
+    once it has been read to the end.'''
+
+    def __init__(self, response, connection, key):
+        self._response = response
+        self._connection = connection
+        self._key = key
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def read(self, *args):
+        data = self._response.read(*args)
+        if self._response.isclosed():
+            self._release()
+        return data
+
+    def close(self):
+        if self._connection is not None:
+            if self._response.isclosed():
+                self._release()
+            else:
+                # The rest of the body is still on the connection.
+                self._connection.close()
+                self._connection = None
+        self._response.close()
+
+    def _release(self):
+        if self._connection is not None:
+            _connections.pool[self._key] = self._connection
+            self._connection = None
+
+
+urlopen = _pooled_urlopen
+
 
 def get_parameters_metadata():
     '''Get the metadata of all parameter from RCMED.
@@ -50,9 +189,10 @@ def get_parameters_metadata():
 
     param_info_list = []
     url = URL + "&param_info=yes"
-    string = urlopen(url)
-    data_string = string.read().decode('utf-8')
-    json_format_data = json.loads(data_string)
+    with cache.open_response(url, 'rcmed_metadata',
+                             lambda: urlopen(url)) as string:
+        data_string = string.read().decode('utf-8')
+        json_format_data = json.loads(data_string)
     fields_name = json_format_data['fields_name']
     data = json_format_data['data']
     for row in data:
@@ -83,18 +223,26 @@ def _make_mask_array(values, parameter_id, parameters_metadata):
             missing_values = each['missingdataflag'].encode()
             break
     missing_values = float(missing_values)
-    values = ma.masked_array(values, mask=(values == missing_values))
+    # Grid points without a row in the response are NaN.
+    values = ma.masked_array(values, mask=(values == missing_values) |
+                             np.isnan(values))
 
     return values
 
 
-def _reshape_values(values, unique_values):
-    '''Reshape values into 4D array.
+def _reshape_values(values, unique_values, coordinates=None):
+    '''Reshape values into 3D array.
 
     :param values: Raw values data
     :type values: numpy array
     :param unique_values: Tuple of unique latitudes, longitudes and times data.
     :type unique_values: Tuple
+    :param coordinates: (Optional) Tuple of the latitude, longitude and time
+        of each value. If given, each value is placed at the grid point of its
+        coordinates so the rows may come in any order, and grid points without
+        a value are NaN. Otherwise the rows must be sorted by time, latitude
+        and longitude and cover the whole grid.
+    :type coordinates: Tuple
 
     :returns: Reshaped values data
     :rtype: Numpy array
@@ -104,9 +252,17 @@ def _reshape_values(values, unique_values):
     lons_len = len(unique_values[1])
     times_len = len(unique_values[2])
 
-    values = values.reshape(times_len, lats_len, lons_len)
+    if coordinates is None:
+        return values.reshape(times_len, lats_len, lons_len)
 
-    return values
+    lat_index = np.searchsorted(unique_values[0], coordinates[0])
+    lon_index = np.searchsorted(unique_values[1], coordinates[1])
+    time_index = np.searchsorted(unique_values[2], coordinates[2])
+    grid = np.full((times_len, lats_len, lons_len), np.nan,
+                   dtype=values.dtype)
+    grid[time_index, lat_index, lon_index] = values
+
+    return grid
 
 
 def _calculate_time(unique_times, time_step):
@@ -121,10 +277,9 @@ def _calculate_time(unique_times, time_step):
     :rtype: Numpy array
     '''
 
-    time_format = "%Y-%m-%d %H:%M:%S"
-    unique_times = np.array(
-        [datetime.strptime(time.decode('utf-8'), time_format)
-                           for time in unique_times])
+    # Times are formatted as "%Y-%m-%d %H:%M:%S", which numpy parses.
+    unique_times = np.asarray(unique_times).astype('U').astype(
+        'datetime64[s]').astype(object)
     # There is no need to sort time.
     # This function may required still in RCMES
     # unique_times.sort()
@@ -157,43 +312,122 @@ def _make_unique(lats, lons, times):
 def _get_data(url):
     '''Reterive data from database.
 
+    The response is read and parsed READ_SIZE bytes at a time into arrays
+    that grow as needed, so the whole response is never held in memory.
+
     :param url: url to query from database
     :type url: String
 
     :returns: Latitudes, longitudes, times and values data
     :rtype: (Numpy array, Numpy array, Numpy array, Numpy array)
+
+    :raises ValueError: If the response doesn't contain a data section or a
+        row doesn't have the expected number of columns.
     '''
 
-    string = urlopen(url)
-    data_string = string.read()
-    index_of_data = re.search(b'data: \r\n', data_string)
-    data = data_string[index_of_data.end():len(data_string)]
-    data = data.split(b'\r\n')
-
-    lats = []
-    lons = []
-    #levels = []
-    values = []
-    times = []
-
-    # Because the last row is empty, "len(data)-1" is used.
-    for i in range(len(data) - 1):
-        row = data[i].split(b',')
-        lats.append(np.float32(row[0]))
-        lons.append(np.float32(row[1]))
-        # Level is not currently supported in Dataset class.
-        # levels.append(np.float32(row[2]))
-        times.append(row[3])
-        values.append(np.float32(row[4]))
-
-    lats = np.array(lats)
-    lons = np.array(lons)
-    times = np.array(times)
-    values = np.array(values)
+    # A response that fails to parse is discarded from the cache, so that
+    # a retry requests it again.
+    with cache.open_response(url, 'rcmed',
+                             lambda: urlopen(url)) as response:
+        arrays = _allocate_rows(_estimate_rows(response))
+        num_rows = 0
+        pending = b''
+        in_data = False
+
+        while True:
+            block = response.read(READ_SIZE)
+            if not block:
+                break
+            pending += block
+            if not in_data:
+                index_of_data = re.search(b'data: \r\n', pending)
+                if index_of_data is None:
+                    continue
+                pending = pending[index_of_data.end():]
+                in_data = True
+            # Only parse complete rows, the rest is kept for the next block.
+            end_of_rows = pending.rfind(b'\r\n')
+            if end_of_rows < 0:
+                continue
+            arrays, num_rows = _parse_rows(pending[:end_of_rows], arrays,
+                                           num_rows)
+            pending = pending[end_of_rows + 2:]
+
+        if not in_data:
+            raise ValueError('The RCMED response does not contain any data.')
+        arrays, num_rows = _parse_rows(pending, arrays, num_rows)
+
+    lats, lons, times, values = [array[:num_rows] for array in arrays]
 
     return lats, lons, times, values
 
 
+def _estimate_rows(response):
+    '''Estimate the number of rows in a query response from its length.'''
+
+    headers = getattr(response, 'headers', None)
+    length = headers.get('Content-Length') if headers is not None else None
+    if length is None:
+        return 65536
+    # Rows are at least 30 bytes long: "50.5,1.5,0,2002-08-31 00:00:00,1"
+    return int(length) // 30 + 1
+
+
+def _allocate_rows(num_rows):
+    '''Allocate arrays for the latitudes, longitudes, times and values.'''
+
+    return [np.empty(num_rows, dtype=np.float32),
+            np.empty(num_rows, dtype=np.float32),
+            np.empty(num_rows, dtype='S19'),
+            np.empty(num_rows, dtype=np.float32)]
+
+
+def _parse_rows(data, arrays, num_rows):
+    '''Parse the complete rows in data into arrays after num_rows rows.
+
+    :param data: "\\r\\n" separated rows of comma separated columns.
+    :type data: Bytes
+    :param arrays: Latitudes, longitudes, times and values arrays.
+    :type arrays: List of numpy arrays
+    :param num_rows: The number of rows already stored in arrays.
+    :type num_rows: Integer
+
+    :returns: The arrays, which are enlarged if needed, and the number of
+        rows they hold.
+    :rtype: (List of numpy arrays, Integer)
+    '''
+
+    data = data.strip()
+    if not data:
+        return arrays, num_rows
+
+    # Giving numpy the width of the longest column is much faster than
+    # letting it find it.
+    fields = data.replace(b'\r\n', b',').split(b',')
+    columns = np.array(fields, dtype='S{}'.format(max(map(len, fields))))
+    if columns.size % _NUM_COLUMNS:
+        raise ValueError('The RCMED response contains an incomplete row.')
+    columns = columns.reshape(-1, _NUM_COLUMNS)
+
+    end = num_rows + len(columns)
+    if end > len(arrays[0]):
+        capacity = max(end, 2 * len(arrays[0]))
+        new_arrays = _allocate_rows(capacity)
+        for new_array, array in zip(new_arrays, arrays):
+            new_array[:num_rows] = array[:num_rows]
+        arrays = new_arrays
+    if columns.dtype.itemsize > arrays[2].dtype.itemsize:
+        arrays[2] = arrays[2].astype(columns.dtype)
+
+    arrays[0][num_rows:end] = columns[:, 0].astype(np.float32)
+    arrays[1][num_rows:end] = columns[:, 1].astype(np.float32)
+    # Level is not currently supported in Dataset class.
+    arrays[2][num_rows:end] = columns[:, 3]
+    arrays[3][num_rows:end] = columns[:, 4].astype(np.float32)
+
+    return arrays, end
+
+
 def _beginning_of_date(time, time_step):
     '''Calculate the beginning of given time, based on time step.
 
@@ -302,7 +536,7 @@ def _get_parameter_info(parameters_metadata, parameter_id):
     return (database, time_step, realm, instrument, start_date, end_date, unit)
 
 
-def parameter_dataset(dataset_id, parameter_id, min_lat, max_lat, min_lon, max_lon, start_time, end_time, name=''):
+def parameter_dataset(dataset_id, parameter_id, min_lat, max_lat, min_lon, max_lon, start_time, end_time, name='', nworkers=4):
     '''Get data from one database(parameter).
 
     :param dataset_id: Dataset id.
@@ -332,6 +566,9 @@ def parameter_dataset(dataset_id, parameter_id, min_lat, max_lat, min_lon, max_l
     :param name: (Optional) A name for the loaded dataset.
     :type name: :mod:`string`
 
+    :param nworkers: (Optional) The number of queries sent to RCMED at once.
+    :type nworkers: :class:`int`
+
     :returns: An OCW Dataset object contained the requested data from RCMED.
     :rtype: :class:`dataset.Dataset`
     '''
@@ -342,11 +579,12 @@ def parameter_dataset(dataset_id, parameter_id, min_lat, max_lat, min_lon, max_l
 
     lats, lons, times, values = \
         _coalesce_data(dataset_id, parameter_id, min_lat, max_lat, min_lon, max_lon,
-                       start_time, end_time, time_step)
+                       start_time, end_time, time_step, nworkers=nworkers)
 
     unique_lats_lons_times = _make_unique(lats, lons, times)
     unique_times = _calculate_time(unique_lats_lons_times[2], time_step)
-    values = _reshape_values(values, unique_lats_lons_times)
+    values = _reshape_values(values, unique_lats_lons_times,
+                             (lats, lons, times))
     values = _make_mask_array(values, parameter_id, parameters_metadata)
 
     origin = {
@@ -366,7 +604,7 @@ def parameter_dataset(dataset_id, parameter_id, min_lat, max_lat, min_lon, max_l
 
 
 def _coalesce_data(dataset_id, parameter_id, min_lat, max_lat, min_lon, max_lon,
-                       start_time, end_time, time_step):
+                       start_time, end_time, time_step, nworkers=4):
 
     """
     Refer to this JIRA:  https://issues.apache.org/jira/browse/CLIMATE-744
@@ -375,6 +613,12 @@ def _coalesce_data(dataset_id, parameter_id, min_lat, max_lat, min_lon, max_lon,
     range of data and / or number of data points are very large.  This method breaks
     the single large query into several smaller queries and then appends the results.
 
+    The first window spans up to five years. The size of its response sets the
+    number of years in the remaining windows (see WINDOW_ROWS), up to twice
+    as many years, and they are fetched concurrently. If the first window is
+    empty the others span five years as well. Failed queries are retried
+    RETRIES times.
+
     :param dataset_id:  The RCMED dataset ID.
     :param parameter_id:  The parameter ID within the RCMED dataset.
     :param min_lat: The minimum lat of the dataset boundary.
@@ -384,53 +628,85 @@ def _coalesce_data(dataset_id, parameter_id, min_lat, max_lat, min_lon, max_lon,
     :param start_time: The start datetime of the dataset boundary.
     :param end_time: The end datetime of the dataset boundary.
     :param time_step: The timestep to use when segmenting the datetime boundary.
+    :param nworkers: The number of windows fetched at once.
     :return:  lats, lons, times, and values for the requested dataset / parameter from RCMED.
     """
 
-    lats = None
-    lons = None
-    times = None
-    values = None
+    def fetch(window):
+        url = _generate_query_url(dataset_id, parameter_id, min_lat, max_lat,
+                                  min_lon, max_lon, window[0], window[1],
+                                  time_step)
+        return _get_data_with_retries(url)
 
     # This is a magic number which strikes a balance between making an excessive number of
     # calls to RCMED (e.g. 1) and RCMED not sending back the full data set.
     step = 4
 
-    current_start = start_time
-    current_end = min(end_time, datetime(current_start.year + step, 12, 31))
-
-    while True:
+    first_window = (start_time,
+                    min(end_time, datetime(start_time.year + step, 12, 31)))
+    results = [fetch(first_window)]
+
+    if first_window[1] != end_time:
+        num_rows = len(results[0][0])
+        years = step + 1
+        if num_rows:
+            rows_per_year = float(num_rows) / (step + 1)
+            years = int(min(max(WINDOW_ROWS // rows_per_year, 1),
+                            MAX_WINDOW_GROWTH * (step + 1)))
+        windows = _year_windows(first_window[1].year + 1, end_time, years)
+        pool = ThreadPool(max(min(nworkers, len(windows)), 1))
+        try:
+            results.extend(pool.map(fetch, windows))
+        finally:
+            pool.close()
+            pool.join()
+
+    # Copy the windows into arrays of the total number of rows at once. The
+    # times of some windows may be wider than those of others.
+    total_rows = sum(len(result[0]) for result in results)
+    arrays = [np.empty(total_rows, dtype=np.result_type(*window_arrays))
+              for window_arrays in zip(*results)]
+    start = 0
+    for result in results:
+        end = start + len(result[0])
+        for array, window_array in zip(arrays, result):
+            array[start:end] = window_array
+        start = end
+
+    lats, lons, times, values = arrays
 
-        url = _generate_query_url(dataset_id, parameter_id, min_lat,
-                                  max_lat, min_lon, max_lon, current_start, current_end, time_step)
+    return lats, lons, times, values
 
-        tmp_lats, tmp_lons, tmp_times, tmp_values = _get_data(url)
 
-        if lats is None:
-            lats = tmp_lats
-        else:
-            lats = np.append(lats, tmp_lats)
+def _year_windows(first_year, end_time, years):
+    '''Split the time from the start of first_year to end_time into windows.
 
-        if lons is None:
-            lons = tmp_lons
-        else:
-            lons = np.append(lons, tmp_lons)
+    :returns: The start and end times of windows of the given number of
+        years. The last window ends at end_time.
+    :rtype: List of (Datetime, Datetime)
+    '''
 
-        if times is None:
-            times = tmp_times
-        else:
-            times = np.append(times, tmp_times)
+    windows = []
+    for year in range(first_year, end_time.year + 1, years):
+        windows.append((datetime(year, 1, 1),
+                        min(end_time, datetime(year + years - 1, 12, 31))))
 
-        if values is None:
-            values = tmp_values
-        else:
-            values = np.append(values, tmp_values)
+    return windows
 
-        if current_end == end_time:
-            break
 
-        current_start = datetime(current_end.year + 1, 1, 1)
-        current_end = min(end_time, datetime(current_start.year + step, 12, 31))
+def _get_data_with_retries(url):
+    '''Call _get_data, retrying with increasing waits if the transfer fails.
 
+    Invalid responses raise a ValueError straight away.
+    '''
 
-    return lats, lons, times, values
+    for attempt in range(RETRIES + 1):
+        try:
+            return _get_data(url)
+        except (IOError, httplib.HTTPException, socket.error) as err:
+            if attempt == RETRIES:
+                raise
+            wait = RETRY_BACKOFF * 2 ** attempt
+            logger.warning('RCMED query %s failed (%s), retrying in %s '
+                           'seconds.', url, err, wait)
+            time.sleep(wait)
@@ -23,24 +23,38 @@ Classes:
     Bounds - Container for holding spatial and temporal bounds information
                 for operations on a Dataset.
 
+    TimeIndex - Compact numeric representation of a Dataset's times.
+
 '''
 
 import datetime as dt
+import hashlib
+import json
 import logging
+import os
 
+import cftime
 import netCDF4
 import numpy
+import numpy.ma as ma
 
+import ocw.config as config
 import ocw.utils as utils
 
 logger = logging.getLogger(__name__)
 
+#: Version of the layout written by :meth:`Dataset.save_store`.
+STORE_VERSION = 1
+
+#: Number of times hashed at once by :meth:`Dataset.fingerprint`.
+FINGERPRINT_TIME_CHUNK = 100
+
 
-class Dataset:
+class Dataset(object):
     '''Container for a dataset's attributes and data.'''
 
     def __init__(self, lats, lons, times, values, variable=None, units=None,
-                 origin=None, name=""):
+                 origin=None, name="", dtype=None):
         '''Default Dataset constructor
 
         :param lats: One dimensional numpy array of unique latitude values.
@@ -70,11 +84,24 @@ class Dataset:
             this dataset was loaded from.
         :type origin: :class:`dict`
 
+        :param dtype: An optional floating point type ('float32' or
+            'float64') for the values of this Dataset and of the Datasets
+            derived from it. It overrides the package wide setting of
+            :func:`ocw.config.set_dtype`.
+        :type dtype: :mod:`string` or :class:`numpy.dtype`
+
         :raises: ValueError
         '''
         self._validate_inputs(lats, lons, times, values)
         lats, lons, values = utils.normalize_lat_lon_values(lats, lons, values)
 
+        if dtype is not None:
+            dtype = config._validate_dtype(dtype)
+            values = values.astype(dtype, copy=False)
+
+        # Derived values such as the spatial boundaries are cached here and
+        # dropped whenever lats, lons, times or values are reassigned.
+        self._cache = {}
         self.lats = lats
         self.lons = lons
         self.times = times
@@ -83,6 +110,66 @@ class Dataset:
         self.units = units
         self.name = name
         self.origin = origin
+        self.dtype = dtype
+
+    @property
+    def lats(self):
+        """ Getter for lats attribute. """
+        return self._lats
+
+    @lats.setter
+    def lats(self, value):
+        """ Setter for lats attribute. Resets the cached derived values. """
+        self._lats = value
+        self._cache.clear()
+
+    @property
+    def lons(self):
+        """ Getter for lons attribute. """
+        return self._lons
+
+    @lons.setter
+    def lons(self, value):
+        """ Setter for lons attribute. Resets the cached derived values. """
+        self._lons = value
+        self._cache.clear()
+
+    @property
+    def times(self):
+        """ Getter for times attribute. """
+        return self._times
+
+    @times.setter
+    def times(self, value):
+        """ Setter for times attribute. Resets the cached derived values. """
+        self._times = value
+        self._cache.clear()
+
+    @property
+    def values(self):
+        """ Getter for values attribute. """
+        return self._values
+
+    @values.setter
+    def values(self, value):
+        """ Setter for values attribute. Resets the cached derived values. """
+        self._values = value
+        self._cache.clear()
+
+    @property
+    def time_index(self):
+        '''The compact numeric :class:`TimeIndex` of the Dataset's times.'''
+        return self._cached('time_index', lambda: TimeIndex(self.times))
+
+    def _cached(self, key, calculate):
+        '''Return a derived value, calculating it on first use.
+
+        Cached values are kept until lats, lons, times or values are
+        reassigned. Modifying those arrays in place doesn't reset the cache.
+        '''
+        if key not in self._cache:
+            self._cache[key] = calculate()
+        return self._cache[key]
 
     def spatial_boundaries(self):
         '''Calculate the spatial boundaries.
@@ -93,8 +180,9 @@ class Dataset:
             :class:`float`, :class:`float`).
 
         '''
-        return (float(numpy.min(self.lats)), float(numpy.max(self.lats)),
-                float(numpy.min(self.lons)), float(numpy.max(self.lons)))
+        return self._cached('spatial_boundaries', lambda: (
+            float(numpy.min(self.lats)), float(numpy.max(self.lats)),
+            float(numpy.min(self.lons)), float(numpy.max(self.lons))))
 
     def temporal_boundaries(self):
         '''Calculate the temporal range
@@ -104,11 +192,9 @@ class Dataset:
         :rtype: :func:`tuple` of the form (:class:`datetime.datetime`,
             :class:`datetime.datetime`)
         '''
-        sorted_time = numpy.sort(self.times)
-        start_time = sorted_time[0]
-        end_time = sorted_time[-1]
-
-        return (start_time, end_time)
+        return self._cached('temporal_boundaries', lambda: (
+            self.times[self.time_index.start_index()],
+            self.times[self.time_index.end_index()]))
 
     def spatial_resolution(self):
         '''Calculate the latitudinal and longitudinal spatial resolution.
@@ -121,10 +207,14 @@ class Dataset:
         :rtype: (:class:`float`, :class:`float`)
 
         '''
+        return self._cached('spatial_resolution',
+                            self._calc_spatial_resolution)
 
+    def _calc_spatial_resolution(self):
+        '''Calculate the uncached spatial resolution.'''
         if self.lats.ndim == 1 and self.lons.ndim == 1:
-            sorted_lats = numpy.sort(list(set(self.lats)))
-            sorted_lons = numpy.sort(list(set(self.lons)))
+            sorted_lats = numpy.unique(self.lats)
+            sorted_lons = numpy.unique(self.lons)
             lat_resolution = sorted_lats[1] - sorted_lats[0]
             lon_resolution = sorted_lons[1] - sorted_lons[0]
         if self.lats.ndim == 2 and self.lons.ndim == 2:
@@ -142,21 +232,249 @@ class Dataset:
         :returns: The temporal resolution.
         :rtype: :mod:`string`
         '''
-        sorted_times = numpy.sort(self.times)
-        time_resolution = sorted_times[1] - sorted_times[0]
-        num_days = time_resolution.days
+        return self._cached('temporal_resolution',
+                            self._calc_temporal_resolution)
 
-        if num_days == 0:
-            num_hours = time_resolution.seconds / 3600
-            time_resolution = 'hourly' if num_hours >= 1 else 'minutely'
-        elif num_days == 1:
-            time_resolution = 'daily'
-        elif num_days <= 31:
-            time_resolution = 'monthly'
-        elif num_days > 31:
-            time_resolution = 'yearly'
+    def _calc_temporal_resolution(self):
+        '''Calculate the uncached temporal resolution.'''
+        return self.time_index.temporal_resolution()
 
-        return time_resolution
+    def fingerprint(self):
+        '''Calculate a digest of the Dataset's contents.
+
+        Datasets with the same variable, units, coordinates, times and
+        values have the same fingerprint, whatever their name or origin,
+        so it can key results derived from the contents. The values are
+        hashed in blocks of times, so memory mapped values are read one
+        block at a time.
+
+        Unlike the other derived values the fingerprint isn't cached, since
+        it must also change when the arrays are modified in place.
+
+        :returns: The SHA-1 hex digest of the contents.
+        :rtype: :mod:`string`
+        '''
+        digest = hashlib.sha1()
+        header = {
+            'variable': self.variable,
+            'units': self.units,
+            'calendar': self.time_index.calendar,
+            'dtype': str(numpy.dtype(self.values.dtype)),
+            'shape': list(self.values.shape),
+        }
+        digest.update(json.dumps(header, sort_keys=True).encode('utf-8'))
+        for array in (self.lats, self.lons, self.time_index.offsets):
+            digest.update(numpy.ascontiguousarray(array).tobytes())
+        for time_slice in self._time_slices(FINGERPRINT_TIME_CHUNK):
+            block = self.values[time_slice]
+            digest.update(numpy.ascontiguousarray(ma.filled(block, 0))
+                          .tobytes())
+            digest.update(numpy.packbits(ma.getmaskarray(block)).tobytes())
+        return digest.hexdigest()
+
+    def iter_chunks(self, time_chunk):
+        '''Iterate over the Dataset in consecutive blocks of times.
+
+        Each chunk only references a slice of the values. When the values
+        are a :class:`numpy.memmap` or another array which reads its data on
+        access, only one chunk needs to be held in memory at a time.
+
+        :param time_chunk: The maximum number of times in each chunk.
+        :type time_chunk: :class:`int`
+
+        :returns: A generator of Datasets which share the attributes of this
+            Dataset and together cover all of its times.
+
+        :raises ValueError: If time_chunk isn't a positive integer.
+        '''
+        for time_slice in self._time_slices(time_chunk):
+            yield Dataset(self.lats,
+                          self.lons,
+                          self.times[time_slice],
+                          self.values[time_slice],
+                          variable=self.variable,
+                          units=self.units,
+                          origin=self.origin,
+                          name=self.name,
+                          dtype=self.dtype)
+
+    def save_store(self, path, time_chunk=100, compress=False):
+        '''Save the Dataset to a directory that can be reopened quickly.
+
+        The store holds a JSON header (``header.json``) with the coordinates,
+        the times and the attributes, and the values in numpy's binary
+        format. Uncompressed values are written to a single ``values.npy``
+        (and ``mask.npy`` for masked values) which :meth:`open_store` can
+        memory-map. Compressed values are written to one ``.npz`` file per
+        block of time_chunk times. The values are copied one block of times
+        at a time in both cases.
+
+        :param path: The directory of the store. It is created if needed and
+            an existing store in it is overwritten.
+        :type path: :mod:`string`
+
+        :param time_chunk: (Optional) The number of times in each block.
+        :type time_chunk: :class:`int`
+
+        :param compress: (Optional) Compress the values. Compressed stores
+            can't be memory-mapped.
+        :type compress: :class:`bool`
+
+        :raises ValueError: If time_chunk isn't a positive integer.
+        '''
+        time_slices = self._time_slices(time_chunk)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        header_path = os.path.join(path, 'header.json')
+        if os.path.exists(header_path):
+            os.remove(header_path)
+
+        values = self.values
+        has_mask = ma.is_masked(values)
+        chunks = []
+        if compress:
+            for ichunk, time_slice in enumerate(time_slices):
+                chunk_name = 'values_{:05d}.npz'.format(ichunk)
+                chunk = ma.asarray(values[time_slice])
+                numpy.savez_compressed(os.path.join(path, chunk_name),
+                                       values=ma.getdata(chunk),
+                                       mask=ma.getmaskarray(chunk))
+                chunks.append(chunk_name)
+        else:
+            out_values = numpy.lib.format.open_memmap(
+                os.path.join(path, 'values.npy'), mode='w+',
+                dtype=values.dtype, shape=values.shape)
+            if has_mask:
+                out_mask = numpy.lib.format.open_memmap(
+                    os.path.join(path, 'mask.npy'), mode='w+',
+                    dtype=bool, shape=values.shape)
+            for time_slice in time_slices:
+                chunk = values[time_slice]
+                out_values[time_slice] = ma.getdata(chunk)
+                if has_mask:
+                    out_mask[time_slice] = ma.getmaskarray(chunk)
+            out_values.flush()
+            del out_values
+            if has_mask:
+                out_mask.flush()
+                del out_mask
+
+        time_index = self.time_index
+        is_cftime = bool(len(self.times) and not isinstance(
+            self.times[0], (dt.date, numpy.datetime64)))
+        header = {
+            'version': STORE_VERSION,
+            'shape': list(values.shape),
+            'dtype': values.dtype.str,
+            'has_mask': bool(has_mask),
+            'compressed': bool(compress),
+            'chunks': chunks,
+            'lats': numpy.asarray(self.lats).tolist(),
+            'lats_dtype': numpy.asarray(self.lats).dtype.str,
+            'lons': numpy.asarray(self.lons).tolist(),
+            'lons_dtype': numpy.asarray(self.lons).dtype.str,
+            'calendar': time_index.calendar,
+            'cftime': is_cftime,
+            'cftime_class': (type(self.times[0]).__name__ if is_cftime
+                             else None),
+            'has_year_zero': (getattr(self.times[0], 'has_year_zero', None)
+                              if is_cftime else None),
+            'time_offsets': time_index.offsets.tolist(),
+            'variable': self.variable,
+            'units': self.units,
+            'name': self.name,
+            'origin': self.origin,
+            'value_dtype': None if self.dtype is None else str(self.dtype)
+        }
+        # The header is written last, so an interrupted save doesn't leave a
+        # store that looks complete.
+        with open(header_path, 'w') as header_file:
+            json.dump(header, header_file, default=str)
+
+    @classmethod
+    def open_store(cls, path, mmap=True):
+        '''Open a Dataset saved with :meth:`save_store`.
+
+        :param path: The directory of the store.
+        :type path: :mod:`string`
+
+        :param mmap: (Optional) Memory-map the values read-only instead of
+            reading them, so that they are only read when accessed and can be
+            shared between processes. Compressed stores are always read.
+        :type mmap: :class:`bool`
+
+        :returns: The saved Dataset.
+        :rtype: :class:`dataset.Dataset`
+
+        :raises ValueError: If path doesn't contain a store.
+        '''
+        header_path = os.path.join(path, 'header.json')
+        if not os.path.isfile(header_path):
+            raise ValueError("'{}' does not contain a Dataset store."
+                             .format(path))
+        with open(header_path) as header_file:
+            header = json.load(header_file)
+        if header.get('version') != STORE_VERSION:
+            raise ValueError("Unsupported Dataset store version {}."
+                             .format(header.get('version')))
+
+        shape = tuple(header['shape'])
+        if header['compressed']:
+            values = numpy.empty(shape, dtype=header['dtype'])
+            mask = numpy.empty(shape, dtype=bool)
+            start = 0
+            for chunk_name in header['chunks']:
+                chunk = numpy.load(os.path.join(path, chunk_name))
+                stop = start + chunk['values'].shape[0]
+                values[start:stop] = chunk['values']
+                mask[start:stop] = chunk['mask']
+                chunk.close()
+                start = stop
+            values = ma.array(values, mask=mask, shrink=True)
+        else:
+            mmap_mode = 'r' if mmap else None
+            values = numpy.load(os.path.join(path, 'values.npy'),
+                                mmap_mode=mmap_mode)
+            if header['has_mask']:
+                mask = numpy.load(os.path.join(path, 'mask.npy'),
+                                  mmap_mode=mmap_mode)
+                values = ma.array(values, mask=mask, copy=False)
+
+        # The offsets are TimeIndex offsets, which count the standard
+        # calendar proleptically, so they are split into time fields rather
+        # than decoded with netCDF4.num2date.
+        offsets = numpy.array(header['time_offsets'], dtype=numpy.int64)
+        time_fields = utils.offsets_to_time_fields(offsets,
+                                                   header['calendar'])
+        if header['cftime']:
+            times = _time_fields_to_cftimes(time_fields,
+                                            header.get('cftime_class'),
+                                            header.get('has_year_zero'))
+        else:
+            times = utils.time_fields_to_datetimes(time_fields)
+
+        return cls(numpy.array(header['lats'], dtype=header['lats_dtype']),
+                   numpy.array(header['lons'], dtype=header['lons_dtype']),
+                   numpy.asarray(times),
+                   values,
+                   variable=header['variable'],
+                   units=header['units'],
+                   origin=header['origin'],
+                   name=header['name'],
+                   dtype=header['value_dtype'])
+
+    def _time_slices(self, time_chunk):
+        '''Split the time axis into slices of at most time_chunk times.
+
+        :raises ValueError: If time_chunk isn't a positive integer.
+        '''
+        if int(time_chunk) != time_chunk or time_chunk < 1:
+            raise ValueError("time_chunk must be a positive integer. "
+                             "{} was given.".format(time_chunk))
+        time_chunk = int(time_chunk)
+        time_len = len(self.times)
+        return [slice(start, min(start + time_chunk, time_len))
+                for start in range(0, time_len, time_chunk)]
 
     def _validate_inputs(self, lats, lons, times, values):
         """Check that Dataset inputs are valid.
@@ -232,6 +550,140 @@ class Dataset:
         )
 
 
+def _time_fields_to_cftimes(time_fields, cftime_class=None,
+                            has_year_zero=None):
+    '''Create cftime objects from time fields.
+
+    :param cftime_class: (Optional) The name of the cftime class to create,
+        such as 'DatetimeNoLeap'. Defaults to :class:`cftime.datetime`.
+    :type cftime_class: :mod:`string`
+
+    :param has_year_zero: (Optional) The has_year_zero of the created times.
+        Defaults to the cftime default of the calendar.
+    :type has_year_zero: :class:`bool`
+
+    :returns: An array of cftime objects.
+    :rtype: :class:`numpy.ndarray`
+    '''
+    kwargs = {}
+    if has_year_zero is not None:
+        kwargs['has_year_zero'] = has_year_zero
+    time_class = getattr(cftime, cftime_class or '', None)
+    if time_class is None or time_class is cftime.datetime:
+        time_class = cftime.datetime
+        kwargs['calendar'] = time_fields['calendar']
+
+    fields = zip(*[time_fields[name].tolist() for name in
+                   ['year', 'month', 'day', 'hour', 'minute', 'second']])
+    times = numpy.empty(len(time_fields['year']), dtype=object)
+    times[:] = [time_class(*field, **kwargs) for field in fields]
+    return times
+
+
+class TimeIndex(object):
+    """Compact numeric representation of a Dataset's times.
+
+    The times are stored as int64 offsets in seconds since
+    0001-01-01 00:00:00 of the times' calendar, together with precomputed
+    year, month, day, hour and day of year arrays. This allows time based
+    selections and groupings to use vectorized integer operations instead of
+    per-element datetime attribute access.
+    """
+
+    def __init__(self, times):
+        """Default TimeIndex constructor
+
+        :param times: One dimensional array of python datetime, numpy
+            datetime64 or cftime objects.
+        :type times: :class:`numpy.ndarray`
+        """
+        fields = utils.datetimes_to_time_fields(times)
+
+        #: The normalized CF calendar name of the times.
+        self.calendar = fields['calendar']
+        self.year = fields['year']
+        self.month = fields['month']
+        self.day = fields['day']
+        self.hour = fields['hour']
+        self.minute = fields['minute']
+        self.second = fields['second']
+        #: Day of the year, starting at 1.
+        self.doy = utils.calc_day_of_year(fields)
+        #: Seconds since 0001-01-01 00:00:00 in the times' calendar.
+        self.offsets = utils.time_fields_to_offsets(fields)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def start_index(self):
+        """Index of the earliest time."""
+        return int(numpy.argmin(self.offsets))
+
+    def end_index(self):
+        """Index of the latest time."""
+        return int(numpy.argmax(self.offsets))
+
+    def first_step(self):
+        """Seconds between the two earliest times.
+
+        :raises ValueError: If there are fewer than two times.
+        """
+        if len(self.offsets) < 2:
+            raise ValueError("At least two times are needed to calculate a "
+                             "time step.")
+        earliest = numpy.partition(self.offsets, 1)[:2]
+        return int(earliest[1] - earliest[0])
+
+    def temporal_resolution(self):
+        """Name of the time step between the two earliest times.
+
+        :returns: One of 'minutely', 'hourly', 'daily', 'monthly' or
+            'yearly'.
+        :rtype: :mod:`string`
+
+        :raises ValueError: If there are fewer than two times.
+        """
+        num_days, num_seconds = divmod(self.first_step(), 86400)
+
+        if num_days == 0:
+            num_hours = num_seconds / 3600
+            time_resolution = 'hourly' if num_hours >= 1 else 'minutely'
+        elif num_days == 1:
+            time_resolution = 'daily'
+        elif num_days <= 31:
+            time_resolution = 'monthly'
+        elif num_days > 31:
+            time_resolution = 'yearly'
+
+        return time_resolution
+
+    def offset_of(self, time):
+        """Convert a datetime into an offset comparable with ``offsets``.
+
+        :param time: Any object with year, month, day, hour, minute and
+            second attributes. The date is interpreted in the calendar of
+            this index.
+
+        :returns: The offset of the time in seconds.
+        :rtype: :class:`int`
+        """
+        fields = {'calendar': self.calendar}
+        for name in ['year', 'month', 'day', 'hour', 'minute', 'second']:
+            fields[name] = numpy.int64(getattr(time, name, 0))
+        return int(utils.time_fields_to_offsets(fields))
+
+    def months_in(self, months):
+        """Indices of the times which fall in one of the given months.
+
+        :param months: Months of the year (Jan=1).
+        :type months: :class:`list` of :class:`int`
+
+        :returns: The sorted time indices.
+        :rtype: :class:`numpy.ndarray`
+        """
+        return numpy.nonzero(numpy.isin(self.month, months))[0]
+
+
 class Bounds(object):
     """Container for holding spatial and temporal bounds information.
 
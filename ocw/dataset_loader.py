@@ -20,6 +20,7 @@ Classes:
     DatasetLoader - Generate OCW Dataset objects from a variety of sources.
 '''
 
+import ocw.data_source.catalog as catalog
 import ocw.data_source.local as local
 import ocw.data_source.rcmed as rcmed
 import ocw.data_source.podaac_datasource as podaac
@@ -61,6 +62,8 @@ class DatasetLoader:
         * ``'local'`` - One or multiple dataset files in a local directory
         * ``'local_split'`` - A single dataset split accross multiple files in a
                               local directory
+        * ``'catalog'`` - The local files of a variable found in a
+                          :class:`ocw.data_source.catalog.Catalog`
         * ``'esgf'`` - Download the dataset from the Earth System Grid
                        Federation
         * ``'rcmed'`` - Download the dataset from the Regional Climate Model
@@ -92,6 +95,7 @@ class DatasetLoader:
         self._source_loaders = {
             'local': local.load_multiple_files,
             'local_split': local.load_dataset_from_multiple_netcdf_files,
+            'catalog': catalog.load_dataset,
             'rcmed': rcmed.parameter_dataset,
             'podaac': podaac.extract_l4_granule
         }
@@ -26,11 +26,21 @@ from matplotlib.path import Path
 from scipy.interpolate import griddata
 from scipy.ndimage import map_coordinates
 
+import ocw.config as config
 import ocw.utils as utils
 from ocw import dataset as ds
 
 logger = logging.getLogger(__name__)
 
+# The time fields reset to their first value by each normalization timestep
+_NORMALIZED_FIELDS = {
+    'minutely': ['second'],
+    'hourly': ['minute', 'second'],
+    'daily': ['hour', 'minute', 'second'],
+    'monthly': ['day', 'hour', 'minute', 'second'],
+    'yearly': ['month', 'day', 'hour', 'minute', 'second'],
+}
+
 
 def temporal_subset(target_dataset, month_start, month_end,
                     average_each_year=False):
@@ -58,12 +68,7 @@ def temporal_subset(target_dataset, month_start, month_end,
     else:
         month_index = range(month_start, month_end + 1)
 
-    dates = target_dataset.times
-    months = np.array([d.month for d in dates])
-    time_index = []
-    for m_value in month_index:
-        time_index.extend(list(np.where(months == m_value)[0]))
-    time_index.sort()
+    time_index = target_dataset.time_index.months_in(month_index)
 
     new_dataset = ds.Dataset(target_dataset.lats,
                              target_dataset.lons,
@@ -71,7 +76,8 @@ def temporal_subset(target_dataset, month_start, month_end,
                              target_dataset.values[time_index, :],
                              variable=target_dataset.variable,
                              units=target_dataset.units,
-                             name=target_dataset.name)
+                             name=target_dataset.name,
+                             dtype=target_dataset.dtype)
 
     if average_each_year:
         new_times = new_dataset.times
@@ -89,7 +95,8 @@ def temporal_subset(target_dataset, month_start, month_end,
 
         averaged_time = []
         ny, nx = target_dataset.values.shape[1:]
-        averaged_values = ma.zeros([nyear, ny, nx])
+        averaged_values = ma.zeros([nyear, ny, nx],
+                                   dtype=config.get_dtype(target_dataset))
         for iyear in np.arange(nyear):
             # centered time index of the season between month_start and
             # month_end in each year
@@ -105,11 +112,12 @@ def temporal_subset(target_dataset, month_start, month_end,
                                  averaged_values,
                                  variable=target_dataset.variable,
                                  units=target_dataset.units,
-                                 name=target_dataset.name)
+                                 name=target_dataset.name,
+                                 dtype=target_dataset.dtype)
     return new_dataset
 
 
-def temporal_rebin(target_dataset, temporal_resolution):
+def temporal_rebin(target_dataset, temporal_resolution, time_chunk=None):
     """ Rebin a Dataset to a new temporal resolution
 
     :param target_dataset: Dataset object that needs temporal rebinned
@@ -118,14 +126,30 @@ def temporal_rebin(target_dataset, temporal_resolution):
     :param temporal_resolution: The new temporal resolution
     :type temporal_resolution: :mod:`string`
 
+    :param time_chunk: (Optional) Read the values in blocks of this many
+        times, so that only one block and the rebinned values are held in
+        memory at a time.
+    :type time_chunk: :class:`int`
+
     :returns: A new temporally rebinned Dataset
     :rtype: :class:`dataset.Dataset`
     """
     # Decode the temporal resolution into a string format that
     # _rcmes_calc_average_on_new_time_unit_K() can understand
 
-    binned_values, binned_dates = _rcmes_calc_average_on_new_time_unit(
-        target_dataset.values, target_dataset.times, temporal_resolution)
+    if time_chunk is not None:
+        bins, num_bins, binned_dates = _rcmes_new_time_unit_bins(
+            target_dataset.times, temporal_resolution,
+            target_dataset.time_index)
+        binned_values = utils.calc_group_means(target_dataset, bins,
+                                               num_bins, time_chunk)
+        if temporal_resolution == 'full':
+            binned_values = binned_values[0]
+    else:
+        binned_values, binned_dates = _rcmes_calc_average_on_new_time_unit(
+            target_dataset.values, target_dataset.times, temporal_resolution,
+            time_index=target_dataset.time_index,
+            dtype=config.get_dtype(target_dataset))
     binned_dates = np.array(binned_dates)
     new_dataset = ds.Dataset(target_dataset.lats,
                              target_dataset.lons,
@@ -134,7 +158,8 @@ def temporal_rebin(target_dataset, temporal_resolution):
                              variable=target_dataset.variable,
                              units=target_dataset.units,
                              name=target_dataset.name,
-                             origin=target_dataset.origin)
+                             origin=target_dataset.origin,
+                             dtype=target_dataset.dtype)
     return new_dataset
 
 
@@ -161,7 +186,8 @@ def temporal_rebin_with_time_index(target_dataset, nt_average):
     nt2 = nt // nt_average
     binned_dates = target_dataset.times[np.arange(nt2) * nt_average]
     binned_values = ma.zeros(
-        np.insert(target_dataset.values.shape[1:], 0, nt2))
+        np.insert(target_dataset.values.shape[1:], 0, nt2),
+        dtype=config.get_dtype(target_dataset))
     for it in np.arange(nt2):
         binned_values[it, :] = ma.average(
             target_dataset.values[nt_average * it:
@@ -175,7 +201,8 @@ def temporal_rebin_with_time_index(target_dataset, nt_average):
                              variable=target_dataset.variable,
                              units=target_dataset.units,
                              name=target_dataset.name,
-                             origin=target_dataset.origin)
+                             origin=target_dataset.origin,
+                             dtype=target_dataset.dtype)
     return new_dataset
 
 
@@ -225,8 +252,8 @@ def spatial_regrid(target_dataset, new_latitudes, new_longitudes,
             lons[iy, :][lons[iy, :] < 0] = lons[iy, :][lons[iy, :] < 0] + 360.
 
     # Make masked array of shape (times, new_latitudes,new_longitudes)
-    new_values = ma.zeros([len(target_dataset.times),
-                           ny_new, nx_new])+1.e+20
+    new_values = ma.zeros([len(target_dataset.times), ny_new, nx_new],
+                          dtype=config.get_dtype(target_dataset)) + 1.e+20
 
     # Boundary vertices of target_dataset
     vertices = []
@@ -311,7 +338,8 @@ def spatial_regrid(target_dataset, new_latitudes, new_longitudes,
                                    variable=target_dataset.variable,
                                    units=target_dataset.units,
                                    name=target_dataset.name,
-                                   origin=target_dataset.origin)
+                                   origin=target_dataset.origin,
+                                   dtype=target_dataset.dtype)
     return regridded_dataset
 
 
@@ -331,7 +359,8 @@ def ensemble(datasets):
     """
     _check_dataset_shapes(datasets)
     dataset_values = [dataset.values for dataset in datasets]
-    ensemble_values = ma.mean(dataset_values, axis=0)
+    ensemble_values = ma.mean(dataset_values, axis=0, dtype=np.float64)
+    ensemble_values = ensemble_values.astype(config.get_dtype(datasets[0]))
 
     # Build new dataset object from the input datasets and
     # the ensemble values and return it
@@ -340,7 +369,8 @@ def ensemble(datasets):
                                   datasets[0].times,
                                   ensemble_values,
                                   units=datasets[0].units,
-                                  name="Dataset Ensemble")
+                                  name="Dataset Ensemble",
+                                  dtype=datasets[0].dtype)
 
     return ensemble_dataset
 
@@ -403,7 +433,8 @@ def subset(target_dataset, subregion, subregion_name=None, extract=True, user_ma
                 variable=target_dataset.variable,
                 units=target_dataset.units,
                 name=subregion_name,
-                origin=target_dataset.origin)
+                origin=target_dataset.origin,
+                dtype=target_dataset.dtype)
 
         elif target_dataset.lats.ndim == 1 and target_dataset.lons.ndim == 1:
             # Get subregion indices into subregion data
@@ -411,23 +442,11 @@ def subset(target_dataset, subregion, subregion_name=None, extract=True, user_ma
                                                           subregion)
             # Slice the values array with our calculated slice indices
             if target_dataset.values.ndim == 2:
-                subset_values = ma.zeros([len(target_dataset.values[
-                    dataset_slices["lat_start"]:dataset_slices["lat_end"]]),
-                    len(target_dataset.values[
-                        dataset_slices["lon_start"]:dataset_slices["lon_end"]])])
-
                 subset_values = target_dataset.values[
                     dataset_slices["lat_start"]:dataset_slices["lat_end"] + 1,
                     dataset_slices["lon_start"]:dataset_slices["lon_end"] + 1]
 
             elif target_dataset.values.ndim == 3:
-                subset_values = ma.zeros([len(target_dataset.values[
-                    dataset_slices["time_start"]:dataset_slices["time_end"]]),
-                    len(target_dataset.values[
-                        dataset_slices["lat_start"]:dataset_slices["lat_end"]]),
-                    len(target_dataset.values[
-                        dataset_slices["lon_start"]:dataset_slices["lon_end"]])])
-
                 subset_values = target_dataset.values[
                     dataset_slices["time_start"]:dataset_slices["time_end"] + 1,
                     dataset_slices["lat_start"]:dataset_slices["lat_end"] + 1,
@@ -448,7 +467,8 @@ def subset(target_dataset, subregion, subregion_name=None, extract=True, user_ma
                 variable=target_dataset.variable,
                 units=target_dataset.units,
                 name=subregion_name,
-                origin=target_dataset.origin
+                origin=target_dataset.origin,
+                dtype=target_dataset.dtype
             )
 
     if subregion.boundary_type == 'us_states' or subregion.boundary_type == 'countries':
@@ -457,7 +477,8 @@ def subset(target_dataset, subregion, subregion_name=None, extract=True, user_ma
         spatial_mask = utils.mask_using_shapefile_info(target_dataset.lons, target_dataset.lats,
                                                        subregion.masked_regions, extract=extract)
         subset_values = utils.propagate_spatial_mask_over_time(
-            temporal_subset.values, mask=spatial_mask)
+            temporal_subset.values, mask=spatial_mask,
+            dtype=config.get_dtype(target_dataset))
         return ds.Dataset(
             target_dataset.lats,
             target_dataset.lons,
@@ -466,7 +487,8 @@ def subset(target_dataset, subregion, subregion_name=None, extract=True, user_ma
             variable=target_dataset.variable,
             units=target_dataset.units,
             name=subregion_name,
-            origin=target_dataset.origin)
+            origin=target_dataset.origin,
+            dtype=target_dataset.dtype)
 
     if subregion.boundary_type == 'user':
         temporal_subset = temporal_slice(
@@ -475,7 +497,8 @@ def subset(target_dataset, subregion, subregion_name=None, extract=True, user_ma
                                                  subregion.mask_longitude, subregion.mask_latitude, subregion.mask_variable,
                                                  user_mask_values, extract=extract)
         subset_values = utils.propagate_spatial_mask_over_time(
-            temporal_subset.values, mask=spatial_mask)
+            temporal_subset.values, mask=spatial_mask,
+            dtype=config.get_dtype(target_dataset))
         return ds.Dataset(
             target_dataset.lats,
             target_dataset.lons,
@@ -484,7 +507,8 @@ def subset(target_dataset, subregion, subregion_name=None, extract=True, user_ma
             variable=target_dataset.variable,
             units=target_dataset.units,
             name=subregion_name,
-            origin=target_dataset.origin)
+            origin=target_dataset.origin,
+            dtype=target_dataset.dtype)
 
 def temporal_slice(target_dataset, start_time, end_time):
     '''Temporally slice given dataset(s) with subregion information. This does not
@@ -507,28 +531,16 @@ def temporal_slice(target_dataset, start_time, end_time):
 
     # https://issues.apache.org/jira/browse/CLIMATE-938
     # netCDF datetimes allow for a variety of calendars while Python has
-    # only one.  This would throw an error about a calendar mismatch when
-    # comparing a Python datetime object to a netcdf datetime object.
-    # Cast the date as best we can so the comparison will compare like
-    # data types  This will still throw an excdeption if the start / end date are
-    # not valid in given calendar.  February 29th in a DatetimeNoLeap calendar for example.
-    slice_start_time = start_time
-    slice_end_time = end_time
-
-    if type(target_dataset.times[0]) != datetime.datetime:
-        slice_start_time =\
-            type(target_dataset.times.item(0))(start_time.year, start_time.month, start_time.day,
-                                            start_time.hour, start_time.minute, start_time.second)
-
-        slice_end_time =\
-            type(target_dataset.times.item(0))(end_time.year, end_time.month, end_time.day,
-                                            end_time.hour, end_time.minute, end_time.second)
+    # only one.  Comparing the numeric offsets of the dataset's TimeIndex
+    # interprets the start / end dates in the dataset's calendar, so Python
+    # datetime objects can be used to slice datasets with any calendar.
+    time_index = target_dataset.time_index
 
     start_time_index = np.where(
-        target_dataset.times >= slice_start_time)[0][0]
+        time_index.offsets >= time_index.offset_of(start_time))[0][0]
 
     end_time_index = np.where(
-        target_dataset.times <= slice_end_time)[0][-1]
+        time_index.offsets <= time_index.offset_of(end_time))[0][-1]
 
     new_times = target_dataset.times[start_time_index:end_time_index + 1]
     new_values = target_dataset.values[start_time_index:end_time_index + 1, :]
@@ -540,7 +552,8 @@ def temporal_slice(target_dataset, start_time, end_time):
         new_values,
         variable=target_dataset.variable,
         units=target_dataset.units,
-        origin=target_dataset.origin)
+        origin=target_dataset.origin,
+        dtype=target_dataset.dtype)
 
 def safe_subset(target_dataset, subregion, subregion_name=None):
     '''Safely subset given dataset with subregion information
@@ -590,41 +603,96 @@ def safe_subset(target_dataset, subregion, subregion_name=None):
 def normalize_dataset_datetimes(dataset, timestep):
     ''' Normalize Dataset datetime values.
 
+    Force hourly data to the start of the hour.
     Force daily to an hour time value of 00:00:00.
     Force monthly data to the first of the month at midnight.
+    Force yearly data to the first of January at midnight.
 
     :param dataset: The Dataset which will have its time value normalized.
     :type dataset: :class:`dataset.Dataset`
 
-    :param timestep: The timestep of the Dataset's values. Either 'daily' or
-        'monthly'.
+    :param timestep: The timestep of the Dataset's values. One of
+        'minutely', 'hourly', 'daily', 'monthly' or 'yearly'.
     :type timestep: :mod:`string`
 
     :returns: A new Dataset with normalized datetime values.
     :rtype: :class:`dataset.Dataset`
+
+    :raises ValueError: If timestep isn't supported.
     '''
-    new_times = _rcmes_normalize_datetimes(dataset.times, timestep)
+    new_times = _rcmes_normalize_datetimes(dataset.times, timestep,
+                                           time_index=dataset.time_index)
     return ds.Dataset(
         dataset.lats,
         dataset.lons,
-        np.array(new_times),
+        new_times,
         dataset.values,
         variable=dataset.variable,
         units=dataset.units,
         name=dataset.name,
-        origin=dataset.origin
+        origin=dataset.origin,
+        dtype=dataset.dtype
     )
 
 
-def write_netcdf(dataset, path, compress=True):
+def write_netcdf(dataset, path, compress=True, dtype=None, chunksizes=None,
+                 complevel=4, shuffle=True, least_significant_digit=None,
+                 time_chunk=None):
     ''' Write a dataset to a NetCDF file.
 
+    The values are written one block of times at a time, so a dataset whose
+    values are memory-mapped (see :meth:`dataset.Dataset.open_store`) is
+    never read into memory all at once.
+
     :param dataset: The dataset to write.
     :type dataset: :class:`dataset.Dataset`
 
     :param path: The output file path.
     :type path: :mod:`string`
+
+    :param compress: (Optional) Compress the variables with zlib.
+    :type compress: :class:`bool`
+
+    :param dtype: (Optional) The type of the values in the file. Defaults to
+        the type given by :func:`ocw.config.get_dtype`.
+    :type dtype: :class:`numpy.dtype` or :mod:`string`
+
+    :param chunksizes: (Optional) The (time, y, x) shape of the HDF5 chunks
+        of the values. Chunks spanning many times over a few grid points make
+        reading time series fast. Defaults to the netCDF library's choice.
+    :type chunksizes: :class:`tuple` of :class:`int`
+
+    :param complevel: (Optional) The zlib compression level, from 1 to 9.
+        Only used if compress is True.
+    :type complevel: :class:`int`
+
+    :param shuffle: (Optional) Apply the HDF5 shuffle filter before
+        compressing, which usually improves the compression of floats.
+    :type shuffle: :class:`bool`
+
+    :param least_significant_digit: (Optional) Quantize the values to this
+        many decimal digits so that they compress better.
+    :type least_significant_digit: :class:`int`
+
+    :param time_chunk: (Optional) The number of times written at once.
+        Defaults to the time length of chunksizes, or 100.
+    :type time_chunk: :class:`int`
+
+    :raises ValueError: If chunksizes doesn't have one positive size per
+        dimension or compress is True and complevel isn't between 1 and 9.
     '''
+    if chunksizes is not None:
+        chunksizes = tuple(chunksizes)
+        if len(chunksizes) != 3 or min(chunksizes) < 1:
+            raise ValueError('chunksizes must be three positive integers.')
+    if compress and not 1 <= complevel <= 9:
+        raise ValueError('complevel must be between 1 and 9.')
+    if time_chunk is None:
+        time_chunk = chunksizes[0] if chunksizes else 100
+    time_slices = dataset._time_slices(time_chunk)
+    if dtype is None:
+        dtype = config.get_dtype(dataset)
+
     out_file = netCDF4.Dataset(path, 'w', format='NETCDF4')
 
     # Set attribute lengths
@@ -653,10 +721,10 @@ def write_netcdf(dataset, path, compress=True):
     times = out_file.createVariable('time', 'f8', ('time'), zlib=compress)
 
     var_name = dataset.variable if dataset.variable else 'var'
-    values = out_file.createVariable(var_name,
-                                     'f8',
-                                     ('time', 'y', 'x'),
-                                     zlib=compress)
+    values = out_file.createVariable(
+        var_name, dtype, ('time', 'y', 'x'), zlib=compress,
+        complevel=complevel, shuffle=shuffle, chunksizes=chunksizes,
+        least_significant_digit=least_significant_digit)
 
     # Set the time variable units
     # We don't deal with hourly/minutely/anything-less-than-a-day data so
@@ -669,7 +737,8 @@ def write_netcdf(dataset, path, compress=True):
     lats[:] = dataset.lats
     lons[:] = dataset.lons
     times[:] = netCDF4.date2num(dataset.times, times.units)
-    values[:] = dataset.values
+    for time_slice in time_slices:
+        values[time_slice] = dataset.values[time_slice]
     values.units = dataset.units
 
     out_file.close()
@@ -684,87 +753,130 @@ def write_netcdf_multiple_datasets_with_subregions(ref_dataset, ref_name,
                                                    ref_subregion_mean=None,
                                                    ref_subregion_std=None,
                                                    model_subregion_mean=None,
-                                                   model_subregion_std=None):
+                                                   model_subregion_std=None,
+                                                   model_axis=False,
+                                                   model_variable='model_values',
+                                                   chunksizes=None):
     # Write multiple reference and model datasets and their subregional means
     # and standard deivations in a NetCDF file.
-
-    # :To be updated
     #
+    # model_dataset_array may be any iterable of datasets, e.g. a generator
+    # that regrids one model at a time. Each model is written as soon as it
+    # is produced, one block of times at a time.
+    #
+    # By default each model is a separate (time, y, x) variable named after
+    # it. With model_axis=True all models are stored in one
+    # (nmodel, time, y, x) variable named model_variable, and their names in
+    # the 'model_names' variable. chunksizes is the (1, time, y, x) shape of
+    # its chunks and defaults to one model and up to 100 times per chunk.
+    # The variable has a single units attribute, so a ValueError is raised
+    # if the models' units differ.
     out_file = netCDF4.Dataset(path, 'w', format='NETCDF4')
+    try:
+        dataset = ref_dataset
+        # Set attribute lenghts
+        nobs = 1
+        nmodel = len(model_names)
+        lat_len, lon_len = dataset.values.shape[1:]
+        lat_ndim = dataset.lats.ndim
+        lon_ndim = dataset.lons.ndim
+        time_len = len(dataset.times)
+
+        if subregions is not None:
+            nsubregion = len(subregions)
+
+        # Create attribute dimensions
+        out_file.createDimension('y', lat_len)
+        out_file.createDimension('x', lon_len)
+        out_file.createDimension('time', time_len)
+
+        # Create variables and store the values
+        if lat_ndim == 2:
+            lats = out_file.createVariable('lat', 'f8', ('y', 'x'))
+        else:
+            lats = out_file.createVariable('lat', 'f8', ('y'))
+        lats[:] = dataset.lats
+        if lon_ndim == 2:
+            lons = out_file.createVariable('lon', 'f8', ('y', 'x'))
+        else:
+            lons = out_file.createVariable('lon', 'f8', ('x'))
+        lons[:] = dataset.lons
+        times = out_file.createVariable('time', 'f8', ('time',))
+        times.units = "days since %s" % dataset.times[0]
+        times[:] = netCDF4.date2num(dataset.times, times.units)
+
+        # mask_array = np.zeros([time_len, lat_len, lon_len])
+        # for iobs in np.arange(nobs):
+        #    index = np.where(ref_dataset_array[iobs].values.mask[:] == True)
+        #    mask_array[index] = 1
+        time_slices = dataset._time_slices(100)
+        out_file.createVariable(ref_name, config.get_dtype(ref_dataset),
+                                ('time', 'y', 'x'))
+        for time_slice in time_slices:
+            out_file.variables[ref_name][time_slice] = \
+                ref_dataset.values[time_slice]
+        out_file.variables[ref_name].units = ref_dataset.units
 
-    dataset = ref_dataset
-    # Set attribute lenghts
-    nobs = 1
-    nmodel = len(model_dataset_array)
-    lat_len, lon_len = dataset.values.shape[1:]
-    lat_ndim = dataset.lats.ndim
-    lon_ndim = dataset.lons.ndim
-    time_len = len(dataset.times)
-
-    if subregions is not None:
-        nsubregion = len(subregions)
-
-    # Create attribute dimensions
-    out_file.createDimension('y', lat_len)
-    out_file.createDimension('x', lon_len)
-    out_file.createDimension('time', time_len)
-
-    # Create variables and store the values
-    if lat_ndim == 2:
-        lats = out_file.createVariable('lat', 'f8', ('y', 'x'))
-    else:
-        lats = out_file.createVariable('lat', 'f8', ('y'))
-    lats[:] = dataset.lats
-    if lon_ndim == 2:
-        lons = out_file.createVariable('lon', 'f8', ('y', 'x'))
-    else:
-        lons = out_file.createVariable('lon', 'f8', ('x'))
-    lons[:] = dataset.lons
-    times = out_file.createVariable('time', 'f8', ('time',))
-    times.units = "days since %s" % dataset.times[0]
-    times[:] = netCDF4.date2num(dataset.times, times.units)
-
-    # mask_array = np.zeros([time_len, lat_len, lon_len])
-    # for iobs in np.arange(nobs):
-    #    index = np.where(ref_dataset_array[iobs].values.mask[:] == True)
-    #    mask_array[index] = 1
-    out_file.createVariable(ref_name, 'f8', ('time', 'y', 'x'))
-    out_file.variables[ref_name][:] = ref_dataset.values
-    out_file.variables[ref_name].units = ref_dataset.units
-    for imodel in np.arange(nmodel):
-        out_file.createVariable(model_names[imodel], 'f8', ('time', 'y', 'x'))
-        # out_file.variables[model_names[imodel]][:] = ma.array(
-        #    model_dataset_array[imodel].values, mask = mask_array)
-        out_file.variables[model_names[imodel]][:] = model_dataset_array[
-            imodel].values
-        out_file.variables[model_names[imodel]].units = model_dataset_array[
-            imodel].units
-
-    if subregions is not None:
-        out_file.createVariable('subregion_array', 'i4', ('y', 'x'))
-        out_file.variables['subregion_array'][:] = subregion_array[:]
-        nsubregion = len(subregions)
-        out_file.createDimension('nsubregion', nsubregion)
-        out_file.createDimension('nobs', nobs)
         out_file.createDimension('nmodel', nmodel)
-        out_file.createVariable('obs_subregion_mean', 'f8', ('nobs',
-                                                             'time',
-                                                             'nsubregion'))
-        out_file.variables['obs_subregion_mean'][:] = ref_subregion_mean[:]
-        out_file.createVariable('obs_subregion_std', 'f8', ('nobs',
-                                                            'time',
-                                                            'nsubregion'))
-        out_file.variables['obs_subregion_std'][:] = ref_subregion_std[:]
-        out_file.createVariable('model_subregion_mean', 'f8', ('nmodel',
-                                                               'time',
-                                                               'nsubregion'))
-        out_file.variables['model_subregion_mean'][:] = model_subregion_mean[:]
-        out_file.createVariable('model_subregion_std', 'f8', ('nmodel',
-                                                              'time',
-                                                              'nsubregion'))
-        out_file.variables['model_subregion_std'][:] = model_subregion_std[:]
-
-    out_file.close()
+        if model_axis:
+            if chunksizes is None:
+                chunksizes = (1, min(time_len, 100), lat_len, lon_len)
+            names = out_file.createVariable('model_names', str, ('nmodel',))
+            names[:] = np.array(model_names, dtype=object)
+            model_values = out_file.createVariable(
+                model_variable, config.get_dtype(ref_dataset),
+                ('nmodel', 'time', 'y', 'x'), zlib=True, chunksizes=chunksizes)
+
+        imodel = -1
+        for imodel, model_dataset in enumerate(model_dataset_array):
+            if imodel >= nmodel:
+                raise ValueError('There are more model datasets than model names.')
+            if model_axis:
+                if imodel == 0:
+                    model_values.units = model_dataset.units
+                elif model_dataset.units != model_values.units:
+                    raise ValueError(
+                        'The units of model {} ({}) differ from those of the '
+                        'other models ({}).'.format(model_names[imodel],
+                                                    model_dataset.units,
+                                                    model_values.units))
+                for time_slice in time_slices:
+                    model_values[imodel, time_slice] = \
+                        model_dataset.values[time_slice]
+            else:
+                variable = out_file.createVariable(
+                    model_names[imodel], config.get_dtype(model_dataset),
+                    ('time', 'y', 'x'))
+                for time_slice in time_slices:
+                    variable[time_slice] = model_dataset.values[time_slice]
+                variable.units = model_dataset.units
+        if imodel != nmodel - 1:
+            raise ValueError('There are more model names than model datasets.')
+
+        if subregions is not None:
+            out_file.createVariable('subregion_array', 'i4', ('y', 'x'))
+            out_file.variables['subregion_array'][:] = subregion_array[:]
+            nsubregion = len(subregions)
+            out_file.createDimension('nsubregion', nsubregion)
+            out_file.createDimension('nobs', nobs)
+            out_file.createVariable('obs_subregion_mean', 'f8', ('nobs',
+                                                                 'time',
+                                                                 'nsubregion'))
+            out_file.variables['obs_subregion_mean'][:] = ref_subregion_mean[:]
+            out_file.createVariable('obs_subregion_std', 'f8', ('nobs',
+                                                                'time',
+                                                                'nsubregion'))
+            out_file.variables['obs_subregion_std'][:] = ref_subregion_std[:]
+            out_file.createVariable('model_subregion_mean', 'f8', ('nmodel',
+                                                                   'time',
+                                                                   'nsubregion'))
+            out_file.variables['model_subregion_mean'][:] = model_subregion_mean[:]
+            out_file.createVariable('model_subregion_std', 'f8', ('nmodel',
+                                                                  'time',
+                                                                  'nsubregion'))
+            out_file.variables['model_subregion_std'][:] = model_subregion_std[:]
+    finally:
+        out_file.close()
 
 
 def water_flux_unit_conversion(dataset):
@@ -840,43 +952,67 @@ def variable_unit_conversion(dataset):
     return dataset
 
 
-def _rcmes_normalize_datetimes(datetimes, timestep):
+def _rcmes_normalize_datetimes(datetimes, timestep, time_index=None):
     """ Normalize Dataset datetime values.
 
+    Force minutely data to zero seconds.
+    Force hourly data to the start of the hour.
     Force daily to an hour time value of 00:00:00.
     Force monthly data to the first of the month at midnight.
+    Force yearly data to the first of January at midnight.
+
+    Monthly and yearly times already on the first day of their month or
+    year are left unchanged. The normalized times have the type of
+    datetimes: :class:`datetime.datetime`, :class:`numpy.datetime64` or
+    the same cftime class, calendar and has_year_zero.
 
     :param datetimes: The datetimes to normalize.
     :type datetimes: List of `datetime` values.
 
     :param timestep: The flag for how to normalize the datetimes.
     :type timestep: String
-    """
 
-    normalDatetimes = []
-    if timestep.lower() == 'monthly':
-        for inputDatetime in datetimes:
-            if inputDatetime.day != 1:
-                # Clean the inputDatetime
-                inputDatetimeString = inputDatetime.strftime('%Y%m%d')
-                normalInputDatetimeString = inputDatetimeString[:6] + '01'
-                inputDatetime = datetime.datetime.strptime(
-                    normalInputDatetimeString, '%Y%m%d')
+    :param time_index: (Optional) The TimeIndex of datetimes, if it has
+        already been calculated.
+    :type time_index: :class:`dataset.TimeIndex`
 
-            normalDatetimes.append(inputDatetime)
+    :returns: The normalized datetimes, in the calendar of datetimes.
+    :rtype: :class:`numpy.ndarray`
 
-    elif timestep.lower() == 'daily':
-        for inputDatetime in datetimes:
-            if (inputDatetime.hour != 0 or inputDatetime.minute != 0 or
-                    inputDatetime.second != 0):
-                datetimeString = inputDatetime.strftime('%Y%m%d%H%M%S')
-                normalDatetimeString = datetimeString[:8] + '000000'
-                inputDatetime = datetime.datetime.strptime(
-                    normalDatetimeString, '%Y%m%d%H%M%S')
+    :raises ValueError: If timestep isn't supported.
+    """
+    timestep = timestep.lower()
+    if timestep not in _NORMALIZED_FIELDS:
+        raise ValueError("Unsupported timestep '{}'. Use one of {}.".format(
+            timestep, ', '.join(_NORMALIZED_FIELDS)))
+
+    datetimes = np.asarray(datetimes)
+    if time_index is None:
+        time_index = ds.TimeIndex(datetimes)
+    normalized = _NORMALIZED_FIELDS[timestep]
+    date_fields = [field for field in ['month', 'day'] if field in normalized]
+    if date_fields:
+        changed = np.zeros(len(time_index), dtype=bool)
+        for field in date_fields:
+            changed |= getattr(time_index, field) != 1
+    else:
+        changed = np.ones(len(time_index), dtype=bool)
 
-            normalDatetimes.append(inputDatetime)
+    fields = {'calendar': time_index.calendar}
+    for field in ['year', 'month', 'day', 'hour', 'minute', 'second']:
+        fields[field] = getattr(time_index, field)
+        if field in normalized:
+            fields[field] = np.where(
+                changed, 1 if field in ['month', 'day'] else 0,
+                fields[field])
 
-    return normalDatetimes
+    if np.issubdtype(datetimes.dtype, np.datetime64):
+        return utils.time_fields_to_datetimes(fields).astype(datetimes.dtype)
+    if len(datetimes) and not isinstance(datetimes[0], datetime.date):
+        return ds._time_fields_to_cftimes(
+            fields, type(datetimes[0]).__name__,
+            getattr(datetimes[0], 'has_year_zero', None))
+    return utils.time_fields_to_datetimes(fields)
 
 
 def mask_missing_data(dataset_array):
@@ -886,7 +1022,7 @@ def mask_missing_data(dataset_array):
     :param dataset_array: an array of OCW datasets
     '''
 
-    mask_array = np.zeros(dataset_array[0].values.shape)
+    mask_array = np.zeros(dataset_array[0].values.shape, dtype=bool)
     for dataset in dataset_array:
         # CLIMATE-797 - Not every array passed in will be a masked array.
         # For those that are, action based on the mask passed in.
@@ -894,7 +1030,7 @@ def mask_missing_data(dataset_array):
         if hasattr(dataset.values, 'mask'):
             index = np.where(dataset.values.mask == True)
             if index[0].size > 0:
-                mask_array[index] = 1
+                mask_array[index] = True
     masked_array = []
     for dataset in dataset_array:
         dataset.values = ma.array(dataset.values, mask=mask_array)
@@ -913,18 +1049,21 @@ def deseasonalize_dataset(dataset):
     :rtype: :class:`dataset.Dataset`
     '''
 
-    days = [d.month * 100. + d.day for d in dataset.times]
-    days_sorted = np.unique(days)
-    ndays = days_sorted.size
+    time_index = dataset.time_index
+    days = time_index.month * 100 + time_index.day
+    days_sorted, day_indices = _group_time_indices(days)
     nt, ny, nx = dataset.values.shape
-    values_clim = ma.zeros([ndays, ny, nx])
-    for iday, day in enumerate(days_sorted):
-        t_index = np.where(days == day)[0]
-        values_clim[iday, :] = ma.mean(dataset.values[t_index, :], axis=0)
-    for iday, day in enumerate(days_sorted):
-        t_index = np.where(days == day)[0]
-        dataset.values[t_index, :] = dataset.values[
-            t_index, :] - values_clim[iday, :]
+    values_clim = ma.zeros([days_sorted.size, ny, nx],
+                           dtype=config.get_dtype(dataset))
+    for iday, t_index in enumerate(day_indices):
+        values_clim[iday, :] = ma.mean(dataset.values[t_index, :], axis=0,
+                                       dtype=np.float64)
+    # The values are reassigned rather than modified in place, so that the
+    # values derived from them are recalculated.
+    values = dataset.values.copy()
+    for iday, t_index in enumerate(day_indices):
+        values[t_index, :] = values[t_index, :] - values_clim[iday, :]
+    dataset.values = values
     return dataset
 
 
@@ -1082,7 +1221,8 @@ def _rcmes_create_mask_using_threshold(masked_array, threshold=0.5):
     return mymask
 
 
-def _rcmes_calc_average_on_new_time_unit(data, dates, unit):
+def _rcmes_calc_average_on_new_time_unit(data, dates, unit, time_index=None,
+                                         dtype=None):
     """ Rebin 3d array and list of dates using the provided unit parameter
 
     :param data: Input data that needs to be averaged
@@ -1092,6 +1232,12 @@ def _rcmes_calc_average_on_new_time_unit(data, dates, unit):
     :param unit: Time unit to average the data into
     :type unit: String matching one of these values :
         full | annual | monthly | daily
+    :param time_index: (Optional) The TimeIndex of dates. It is built from
+        dates if it isn't given.
+    :type time_index: :class:`dataset.TimeIndex`
+    :param dtype: (Optional) The floating point type of the averaged data.
+        Defaults to the package wide setting of :mod:`ocw.config`.
+    :type dtype: :class:`numpy.dtype`
 
     :returns: meanstorem, newTimesList
     :rtype: 3D numpy masked array the same shape as the input array,
@@ -1106,57 +1252,133 @@ def _rcmes_calc_average_on_new_time_unit(data, dates, unit):
         raise ValueError('Error: unknown unit type selected '
                          'for time averaging: EXIT')
 
+    if time_index is None:
+        time_index = ds.TimeIndex(dates)
+    if dtype is None:
+        dtype = config.get_dtype()
+
+    # Means are accumulated in double precision and stored as dtype
     nt, ny, nx = data.shape
     if unit == 'full':
-        new_data = ma.mean(data, axis=0)
+        new_data = ma.mean(data, axis=0, dtype=np.float64).astype(dtype)
         new_date = [dates[dates.size // 2]]
     if unit == 'annual':
-        years = [d.year for d in dates]
-        years_sorted = np.unique(years)
-        new_data = ma.zeros([years_sorted.size, ny, nx])
-        it = 0
+        years_sorted, year_indices = _group_time_indices(time_index.year)
+        new_data = ma.zeros([years_sorted.size, ny, nx], dtype=dtype)
         new_date = []
-        for year in years_sorted:
-            index = np.where(years == year)[0]
-            new_data[it, :] = ma.mean(data[index, :], axis=0)
-            new_date.append(datetime.datetime(year=year, month=7, day=2))
-            it = it + 1
+        for it, index in enumerate(year_indices):
+            new_data[it, :] = ma.mean(data[index, :], axis=0,
+                                      dtype=np.float64)
+            new_date.append(datetime.datetime(year=int(years_sorted[it]),
+                                              month=7, day=2))
     if unit == 'monthly':
-        years = [d.year for d in dates]
-        years_sorted = np.unique(years)
-        months = [d.month for d in dates]
-        months_sorted = np.unique(months)
-
-        new_data = ma.zeros([years_sorted.size * months_sorted.size, ny, nx])
-        it = 0
+        years_sorted = np.unique(time_index.year)
+        months_sorted = np.unique(time_index.month)
+        year_months, month_indices = _group_time_indices(
+            time_index.year * 100 + time_index.month)
+
+        new_data = ma.zeros([years_sorted.size * months_sorted.size, ny, nx],
+                            dtype=dtype)
+        new_data[:] = ma.masked
         new_date = []
+        it = 0
         for year in years_sorted:
             for month in months_sorted:
-                index = np.where((years == year) & (months == month))[0]
-                new_data[it, :] = ma.mean(data[index, :], axis=0)
-                new_date.append(datetime.datetime(year=year,
-                                                  month=month,
+                igroup = np.searchsorted(year_months, year * 100 + month)
+                if (igroup < year_months.size and
+                        year_months[igroup] == year * 100 + month):
+                    new_data[it, :] = ma.mean(
+                        data[month_indices[igroup], :], axis=0,
+                        dtype=np.float64)
+                new_date.append(datetime.datetime(year=int(year),
+                                                  month=int(month),
                                                   day=15))
                 it = it + 1
     if unit == 'daily':
-        days = [d.year * 10000. + d.month * 100. + d.day for d in dates]
-        days_sorted = np.unique(days)
+        days = (time_index.year * 10000 + time_index.month * 100 +
+                time_index.day)
+        days_sorted, day_indices = _group_time_indices(days)
 
-        new_data = ma.zeros([days_sorted.size, ny, nx])
-        it = 0
+        new_data = ma.zeros([days_sorted.size, ny, nx], dtype=dtype)
         new_date = []
-        for day in days_sorted:
-            index = np.where(days == day)[0]
-            new_data[it, :] = ma.mean(data[index, :], axis=0)
-            y = int(day // 10000)
-            m = int(day % 10000) // 100
-            d = int(day % 100)
-            new_date.append(datetime.datetime(year=y, month=m, day=d))
-            it = it + 1
+        for it, index in enumerate(day_indices):
+            new_data[it, :] = ma.mean(data[index, :], axis=0,
+                                      dtype=np.float64)
+            day = int(days_sorted[it])
+            new_date.append(datetime.datetime(year=day // 10000,
+                                              month=day % 10000 // 100,
+                                              day=day % 100))
 
     return new_data, np.array(new_date)
 
 
+def _rcmes_new_time_unit_bins(dates, unit, time_index):
+    """ Assign each date to a bin of the provided time unit
+
+    The bins and their dates are the same as those of
+    _rcmes_calc_average_on_new_time_unit.
+
+    :param dates: List of dates to bin
+    :type dates: Python datetime objects
+    :param unit: Time unit to bin the dates into
+    :type unit: String matching one of these values :
+        full | annual | monthly | daily
+    :param time_index: The TimeIndex of dates.
+    :type time_index: :class:`dataset.TimeIndex`
+
+    :returns: The bin number of each date, the number of bins and the
+        dates of the bins
+    :rtype: :class:`numpy.ndarray`, :class:`int`, :class:`numpy.ndarray`
+    :raises: ValueError
+    """
+    if unit not in ['full', 'annual', 'monthly', 'daily']:
+        raise ValueError('Error: unknown unit type selected '
+                         'for time averaging: EXIT')
+
+    if unit == 'full':
+        bins = np.zeros(len(time_index), dtype=int)
+        new_date = [dates[dates.size // 2]]
+    if unit == 'annual':
+        years_sorted = np.unique(time_index.year)
+        bins = np.searchsorted(years_sorted, time_index.year)
+        new_date = [datetime.datetime(year=int(year), month=7, day=2)
+                    for year in years_sorted]
+    if unit == 'monthly':
+        years_sorted = np.unique(time_index.year)
+        months_sorted = np.unique(time_index.month)
+        bins = (np.searchsorted(years_sorted, time_index.year) *
+                months_sorted.size +
+                np.searchsorted(months_sorted, time_index.month))
+        new_date = [datetime.datetime(year=int(year), month=int(month),
+                                      day=15)
+                    for year in years_sorted for month in months_sorted]
+    if unit == 'daily':
+        days = (time_index.year * 10000 + time_index.month * 100 +
+                time_index.day)
+        days_sorted = np.unique(days)
+        bins = np.searchsorted(days_sorted, days)
+        new_date = [datetime.datetime(year=int(day) // 10000,
+                                      month=int(day) % 10000 // 100,
+                                      day=int(day) % 100)
+                    for day in days_sorted]
+
+    return bins, len(new_date), np.array(new_date)
+
+
+def _group_time_indices(keys):
+    """ Group time indices by a key such as the year of each time.
+
+    :param keys: One dimensional integer array with a key for each time.
+    :type keys: :class:`numpy.ndarray`
+
+    :returns: The sorted unique keys and a list with the array of time
+        indices that belong to each key.
+    """
+    order = np.argsort(keys, kind='mergesort')
+    unique_keys, starts = np.unique(keys[order], return_index=True)
+    return unique_keys, np.split(order, starts[1:])
+
+
 def _rcmes_calc_average_on_new_time_unit_K(data, dates, unit):
     """ Rebin 3d array and list of dates using the provided unit parameter
 
@@ -1228,7 +1450,7 @@ def _rcmes_calc_average_on_new_time_unit_K(data, dates, unit):
     # 1D data arrays, i.e. time series
     if data.ndim == 1:
         # Create array to store the resulting data
-        meanstore = np.zeros(len(unique_times))
+        meanstore = np.zeros(len(unique_times), dtype=config.get_dtype())
 
         # Calculate the means across each unique time unit
         i = 0
@@ -1245,7 +1467,8 @@ def _rcmes_calc_average_on_new_time_unit_K(data, dates, unit):
     # 3D data arrays
     if data.ndim == 3:
         # Create array to store the resulting data
-        meanstore = np.zeros([len(unique_times), data.shape[1], data.shape[2]])
+        meanstore = np.zeros([len(unique_times), data.shape[1], data.shape[2]],
+                             dtype=config.get_dtype())
 
         # Calculate the means across each unique time unit
         i = 0
@@ -1522,8 +1745,11 @@ def _get_subregion_slice_indices(target_dataset, subregion):
     lonEnd = max(np.nonzero(target_dataset.lons <= subregion.lon_max)[0])
 
     if not (subregion.start is None):
-        timeStart = min(np.nonzero(target_dataset.times >= subregion.start)[0])
-        timeEnd = max(np.nonzero(target_dataset.times <= subregion.end)[0])
+        time_index = target_dataset.time_index
+        timeStart = min(np.nonzero(
+            time_index.offsets >= time_index.offset_of(subregion.start))[0])
+        timeEnd = max(np.nonzero(
+            time_index.offsets <= time_index.offset_of(subregion.end))[0])
     else:
         timeStart = 0
         timeEnd = len(target_dataset.times) -1
@@ -17,81 +17,165 @@
 # under the License.
 #
 """
-OCW module to download a file from ESGF.
+OCW module to download files from ESGF.
+
+Files are streamed to disk over a shared authenticated session. Interrupted
+downloads are resumed, files are verified against their checksums, and files
+that are already present and verified are not downloaded again.
 
 """
 
 from __future__ import print_function
 
-import sys
+import hashlib
+import os
+from multiprocessing.pool import ThreadPool
 from os.path import expanduser, join
 
+import requests
+
 from ocw.esgf.constants import ESGF_CREDENTIALS
 
-if sys.version_info[0] >= 3:
-    from http.client import HTTPSConnection
-    from urllib.request import build_opener
-    from urllib.request import HTTPCookieProcessor
-    from urllib.request import HTTPSHandler
-else:
-    # Not Python 3 - today, it is most likely to be Python 2
-    # But note that this might need an update when Python 4
-    # might be around one day
-    from httplib import HTTPSConnection
-    from urllib2 import build_opener
-    from urllib2 import HTTPCookieProcessor
-    from urllib2 import HTTPSHandler
-
-
-class HTTPSClientAuthHandler(HTTPSHandler):
+# size in bytes of the blocks that are written to disk and checksummed
+CHUNK_SIZE = 1 << 20
+
+# suffix of the files being downloaded
+PARTIAL_SUFFIX = '.part'
+
+
+def make_session():
     """
-    HTTP handler that transmits an X509 certificate as part of the request
+    Create a session that authenticates with the ESGF certificate.
+    The session keeps its cookies and connections between downloads, and can
+    be shared by concurrent downloads.
+    :return: a requests.Session object.
     """
+    session = requests.Session()
+    cert_file = expanduser(ESGF_CREDENTIALS)
+    if os.path.exists(cert_file):
+        session.cert = (cert_file, cert_file)
+    return session
+
 
-    def __init__(self, key, cert):
-        HTTPSHandler.__init__(self)
-        self.key = key
-        self.cert = cert
-
-    def https_open(self, req):
-        """
-        Opens the https connection.
-        :param req:  The https request object.
-        :return: An addinfourl object for the request.
-        """
-        return self.do_open(self.getConnection, req)
-
-    def getConnection(self, host, timeout=300):
-        """
-        Create an HTTPSConnection object.
-        :param host: The ESGF server to connect to.
-        :param timeout: Connection timeout in seconds.
-        :return:
-        """
-        return HTTPSConnection(host, key_file=self.key, cert_file=self.cert, timeout=timeout)
-
-
-def download(url, toDirectory="/tmp"):
+def download(url, toDirectory="/tmp", checksum=None, checksumType='SHA256',
+             session=None, retries=3):
     """
     Function to download a single file from ESGF.
+    The file is first written to the target path plus PARTIAL_SUFFIX, and
+    renamed when it's complete and verified. A partial file left by an
+    interrupted download is resumed with an HTTP Range request.
     :param url: the URL of the file to download
     :param toDirectory: target directory where the file will be written
+    :param checksum: optional checksum of the file, as returned by the ESGF
+        search service. If the file is already present and matches it, or if
+        it is present and there is no checksum, it is not downloaded again.
+    :param checksumType: the hash algorithm of the checksum, e.g. SHA256 or MD5
+    :param session: optional requests.Session to download with. Defaults to a
+        new session from make_session().
+    :param retries: number of times a failed download is resumed
+    :return: the local path of the file
+    :raises ValueError: if the downloaded file doesn't match the checksum
     """
+    local_file_path = join(toDirectory, url.split('/')[-1])
+    if os.path.exists(local_file_path):
+        if checksum is None or verify_checksum(local_file_path, checksum,
+                                               checksumType):
+            print("\nSkipping url: %s, %s is already present" %
+                  (url, local_file_path))
+            return local_file_path
+        os.remove(local_file_path)
 
-    # setup HTTP handler
-    cert_file = expanduser(ESGF_CREDENTIALS)
-    opener = build_opener(HTTPSClientAuthHandler(cert_file, cert_file))
-    opener.add_handler(HTTPCookieProcessor())
+    if session is None:
+        session = make_session()
 
-    # download file
-    local_file_path = join(toDirectory, url.split('/')[-1])
     print("\nDownloading url: %s to local path: %s ..." % (url, local_file_path))
-    local_file = open(local_file_path, 'w')
-    web_file = opener.open(url)
-    local_file.write(web_file.read())
-
-    # cleanup
-    local_file.close()
-    web_file.close()
-    opener.close()
+    partial_file_path = local_file_path + PARTIAL_SUFFIX
+    for attempt in range(retries + 1):
+        try:
+            _download_to(session, url, partial_file_path)
+            break
+        except (requests.RequestException, IOError):
+            if attempt == retries:
+                raise
+            print("... interrupted, resuming")
+
+    if checksum is not None and not verify_checksum(partial_file_path,
+                                                    checksum, checksumType):
+        os.remove(partial_file_path)
+        raise ValueError('The %s checksum of %s does not match %s' %
+                         (checksumType, url, checksum))
+    os.rename(partial_file_path, local_file_path)
     print("... done")
+
+    return local_file_path
+
+
+def download_files(files, toDirectory="/tmp", nworkers=4, session=None):
+    """
+    Function to download several files from ESGF concurrently.
+    :param files: list of URLs, or of (URL, checksum, checksum type) tuples
+    :param toDirectory: target directory where the files will be written
+    :param nworkers: number of files downloaded at once
+    :param session: optional requests.Session shared by the downloads.
+        Defaults to a new session from make_session().
+    :return: list of the local paths of the files
+    """
+    if session is None:
+        session = make_session()
+
+    def download_file(file_info):
+        if isinstance(file_info, (tuple, list)):
+            url, checksum, checksumType = file_info
+        else:
+            url, checksum, checksumType = file_info, None, 'SHA256'
+        return download(url, toDirectory=toDirectory, checksum=checksum,
+                        checksumType=checksumType, session=session)
+
+    if nworkers <= 1 or len(files) <= 1:
+        return [download_file(file_info) for file_info in files]
+    pool = ThreadPool(min(nworkers, len(files)))
+    try:
+        return pool.map(download_file, files)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def verify_checksum(path, checksum, checksumType='SHA256'):
+    """
+    Check a file against a checksum.
+    :param path: the path of the file
+    :param checksum: the expected hexadecimal checksum
+    :param checksumType: the hash algorithm, e.g. SHA256 or MD5
+    :return: True if the file matches the checksum
+    """
+    file_hash = hashlib.new(checksumType.lower().replace('-', ''))
+    with open(path, 'rb') as local_file:
+        for block in iter(lambda: local_file.read(CHUNK_SIZE), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest().lower() == checksum.lower()
+
+
+def _download_to(session, url, path):
+    """
+    Stream url into path, appending to the bytes already in path if the
+    server supports Range requests.
+    """
+    headers = {}
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+    if offset:
+        headers['Range'] = 'bytes=%d-' % offset
+
+    response = session.get(url, headers=headers, stream=True, timeout=300)
+    try:
+        if response.status_code == 416:
+            # The partial file is already complete
+            return
+        response.raise_for_status()
+        # A server that ignores the Range header sends the whole file
+        mode = 'ab' if response.status_code == 206 else 'wb'
+        with open(path, mode) as local_file:
+            for block in response.iter_content(CHUNK_SIZE):
+                local_file.write(block)
+    finally:
+        response.close()
@@ -23,8 +23,12 @@ RCMES module to execute a faceted search for ESGF files.
 
 from __future__ import print_function
 
+import io
+import json
+
 from pyesgf.search import SearchConnection
 
+import ocw.data_source.cache as cache
 from ocw.esgf.constants import JPL_SEARCH_SERVICE_URL
 
 
@@ -41,6 +45,7 @@ class SearchClient(object):
         :param distrib: True to execute a federation-wide search,
                         False to search only the specified search service
         """
+        self.searchServiceUrl = searchServiceUrl
         connection = SearchConnection(searchServiceUrl, distrib=distrib)
 
         # dictionary of query constraints
@@ -64,7 +69,7 @@ class SearchClient(object):
         """
         :return: the number of datasets matching the current constraints.
         """
-        return self.context.hit_count
+        return self._cached('hit_count', lambda: self.context.hit_count)
 
     def getFacets(self, facet):
         """
@@ -73,13 +78,17 @@ class SearchClient(object):
 
         Example (for facet='project'): {u'COUND': 4, u'CMIP5': 2657, u'obs4MIPs': 7}
         """
-        return self.context.facet_counts[facet]
+        return self._cached('facet_counts:' + facet,
+                            lambda: self.context.facet_counts[facet])
 
     def getFiles(self):
         """
         Executes a search for files with the current constraints.
         :return: list of file download URLs.
         """
+        return self._cached('files', self._getFiles)
+
+    def _getFiles(self):
         datasets = self.context.search()
         urls = []
         for dataset in datasets:
@@ -90,3 +99,17 @@ class SearchClient(object):
                 print('Found file=%s' % current_file.download_url)
                 urls.append(current_file.download_url)
         return urls
+
+    def _cached(self, request, search):
+        """
+        Runs a search through the response cache of ocw.data_source.cache.
+        :param request: name of the requested search result.
+        :param search: function that executes the search.
+        :return: the JSON serializable result of the search.
+        """
+        params = dict(self.constraints, ocw_request=request)
+        with cache.open_response(
+                self.searchServiceUrl, 'esgf_search',
+                lambda: io.BytesIO(json.dumps(search()).encode('utf-8')),
+                params=params) as response:
+            return json.loads(response.read().decode('utf-8'))
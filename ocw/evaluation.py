@@ -22,13 +22,29 @@ Classes:
 
 import logging
 from ocw.metrics import Metric, UnaryMetric, BinaryMetric
+from ocw.metrics import StatisticsMetric, BinaryStatistics
 from ocw.dataset import Dataset, Bounds
+from ocw.result_cache import result_key
 import ocw.dataset_processor as DSP
 
+import numpy
 import numpy.ma as ma
 
 logger = logging.getLogger(__name__)
 
+# Marks results that aren't in the result cache.
+_MISSING = object()
+
+# The values of the targets that are run together, and the temporary
+# arrays of the same size made from them, are kept below about this many
+# bytes by splitting the targets into groups and reading the times of the
+# statistics metrics in blocks.
+MAX_BATCH_BYTES = 2 ** 30
+
+# The number of arrays of the size of the stacked values that are alive
+# at once while the metrics run.
+_BATCH_COPIES = 8
+
 
 class Evaluation(object):
     '''Container for running an evaluation
@@ -51,9 +67,14 @@ class Evaluation(object):
     Evaluation.
 
     An Evaluation must have at least one metric to be valid.
+
+    With a :class:`result_cache.ResultCache` each result is cached under its
+    metric, the contents of its datasets and its subregion, and a rerun only
+    calculates the results that aren't cached yet.
     '''
 
-    def __init__(self, reference, targets, metrics, subregions=None):
+    def __init__(self, reference, targets, metrics, subregions=None,
+                 result_cache=None):
         '''Default Evaluation constructor.
 
         :param reference: The reference Dataset for the evaluation.
@@ -71,6 +92,10 @@ class Evaluation(object):
                 evaluation. A subregion is specified with a Bounds object.
         :type subregions: :class:`list` of :class:`dataset.Bounds`
 
+        :param result_cache: (Optional) Cache of metric results shared by
+                runs of the evaluation.
+        :type result_cache: :class:`result_cache.ResultCache`
+
         :raises: ValueError
         '''
         #: The reference dataset.
@@ -95,6 +120,12 @@ class Evaluation(object):
         #: evaluation.
         self._subregions = subregions
 
+        #: An optional :class:`result_cache.ResultCache` of the metric
+        #: results.
+        self.result_cache = result_cache
+        # The fingerprints of the datasets in the current run, by id.
+        self._fingerprints = {}
+
         #: A list containing the results of running regular metric evaluations.
         #: The shape of results is ``(num_target_datasets, num_metrics)`` if
         #: the user doesn't specify subregion information. Otherwise the shape
@@ -229,6 +260,10 @@ class Evaluation(object):
             logger.warning(error)
             return
 
+        # The datasets may have changed in place since the last run, so
+        # they are fingerprinted again.
+        self._fingerprints = {}
+
         if self._should_run_regular_metrics():
             if self.subregions:
                 self.results = self._run_subregion_evaluation()
@@ -272,69 +307,221 @@ class Evaluation(object):
 
     def _run_subregion_evaluation(self):
         results = []
-        new_refs = [DSP.subset(self.ref_dataset, s) for s in self.subregions]
-
-        for target in self.target_datasets:
+        # The results of each subregion, for each target and metric
+        subregion_results = [self._run_cached_metrics(subregion)
+                             for subregion in self.subregions]
+        for itarget in range(len(self.target_datasets)):
             results.append([])
-            new_targets = [DSP.subset(target, s) for s in self.subregions]
-
-            for metric in self.metrics:
-                results[-1].append([])
-
-                for i in range(len(self.subregions)):
-                    new_ref = new_refs[i]
-                    new_tar = new_targets[i]
-
-                    run_result = metric.run(new_ref, new_tar)
-                    results[-1][-1].append(run_result)
+            for imetric in range(len(self.metrics)):
+                results[-1].append([run_results[itarget][imetric]
+                                    for run_results in subregion_results])
         return convert_evaluation_result(results, subregion=True)
 
     def _run_no_subregion_evaluation(self):
-        results = []
-        for target in self.target_datasets:
-            results.append([])
-            for metric in self.metrics:
-                run_result = metric.run(self.ref_dataset, target)
-                results[-1].append(run_result)
+        results = self._run_cached_metrics()
         return convert_evaluation_result(results)
 
+    def _run_cached_metrics(self, subregion=None):
+        '''Run the binary metrics on the datasets, or their subsets of a
+        subregion, reusing the results in the result cache.
+
+        Only the targets and metrics with a missing result are run, and
+        the datasets are only subset for them.
+
+        :returns: The result of each metric, for each target.
+        '''
+        def subset(dataset):
+            if subregion is None:
+                return dataset
+            return DSP.subset(dataset, subregion)
+
+        if self.result_cache is None:
+            return self._run_metrics(
+                subset(self.ref_dataset),
+                [subset(target) for target in self.target_datasets])
+
+        keys = [[result_key(metric, [self._fingerprint(self.ref_dataset),
+                                     self._fingerprint(target)],
+                            subregion)
+                 for metric in self.metrics]
+                for target in self.target_datasets]
+        results = [[self.result_cache.get(key, _MISSING) for key in row]
+                   for row in keys]
+        missing_targets = [itarget for itarget, row in enumerate(results)
+                           if any(result is _MISSING for result in row)]
+        if not missing_targets:
+            return results
+
+        missing_metrics = [imetric for imetric in range(len(self.metrics))
+                           if any(results[itarget][imetric] is _MISSING
+                                  for itarget in missing_targets)]
+        run_results = self._run_metrics(
+            subset(self.ref_dataset),
+            [subset(self.target_datasets[itarget])
+             for itarget in missing_targets],
+            [self.metrics[imetric] for imetric in missing_metrics])
+        for itarget, target_results in zip(missing_targets, run_results):
+            for imetric, result in zip(missing_metrics, target_results):
+                if results[itarget][imetric] is _MISSING:
+                    results[itarget][imetric] = result
+                    self.result_cache.put(keys[itarget][imetric], result)
+        return results
+
+    def _run_metrics(self, ref_dataset, target_datasets, metrics=None):
+        '''Run the binary metrics on a reference and the target datasets.
+
+        Targets whose values have the shape of the reference values are run
+        together, with their values stacked along a model axis, by the
+        metrics that support it. The statistics metrics are calculated from
+        a single :class:`metrics.BinaryStatistics` of the datasets. The
+        targets are split into groups, and the statistics read in blocks of
+        times, to stay within about MAX_BATCH_BYTES.
+
+        :param metrics: (Optional) The metrics to run. Defaults to all of the
+            binary metrics.
+
+        :returns: The result of each metric, for each target.
+        '''
+        if metrics is None:
+            metrics = self.metrics
+        shape = numpy.shape(ref_dataset.values)
+        if len(target_datasets) < 2 or any(
+                numpy.shape(target.values) != shape
+                for target in target_datasets):
+            return [self._run_target_metrics(ref_dataset, target, metrics)
+                    for target in target_datasets]
+
+        time_bytes = self._time_bytes([ref_dataset] + list(target_datasets))
+        if not all(isinstance(metric, StatisticsMetric) for metric in metrics):
+            # The other metrics stack all the times of the targets.
+            group_bytes = time_bytes * max(shape[0], 1)
+        else:
+            group_bytes = time_bytes
+        group_size = max(MAX_BATCH_BYTES // group_bytes - 1, 1)
+        if group_size < len(target_datasets):
+            results = []
+            for start in range(0, len(target_datasets), group_size):
+                results.extend(self._run_metrics(
+                    ref_dataset, target_datasets[start:start + group_size],
+                    metrics))
+            return results
+
+        statistics = None
+        metric_results = []
+        for metric in metrics:
+            if isinstance(metric, StatisticsMetric):
+                if statistics is None:
+                    statistics = BinaryStatistics.from_datasets(
+                        ref_dataset, list(target_datasets),
+                        time_chunk=self._statistics_time_chunk(
+                            metrics, (len(target_datasets) + 1) * time_bytes))
+                metric_results.append(list(metric.from_statistics(statistics)))
+            else:
+                metric_results.append(metric.run_models(ref_dataset,
+                                                        target_datasets))
+        return [list(run_results) for run_results in zip(*metric_results)]
+
+    def _run_target_metrics(self, ref_dataset, target_dataset, metrics):
+        '''Run binary metrics on a reference and target dataset.'''
+        statistics = None
+        run_results = []
+        for metric in metrics:
+            if isinstance(metric, StatisticsMetric):
+                if statistics is None:
+                    time_bytes = self._time_bytes([ref_dataset,
+                                                   target_dataset])
+                    statistics = BinaryStatistics.from_datasets(
+                        ref_dataset, target_dataset,
+                        time_chunk=self._statistics_time_chunk(
+                            metrics, 2 * time_bytes))
+                run_results.append(metric.from_statistics(statistics))
+            else:
+                run_results.append(metric.run(ref_dataset, target_dataset))
+        return run_results
+
+    def _time_bytes(self, datasets):
+        '''Estimate the bytes used for a time of the values of one of the
+        datasets while the metrics run.'''
+        return _BATCH_COPIES * max(
+            int(numpy.prod(numpy.shape(dataset.values)[1:])) *
+            dataset.values.dtype.itemsize for dataset in datasets)
+
+    def _statistics_time_chunk(self, metrics, time_bytes):
+        '''The smallest time_chunk of the statistics metrics, or the number
+        of times of time_bytes each that fit in MAX_BATCH_BYTES.'''
+        time_chunks = [metric.time_chunk for metric in metrics
+                       if isinstance(metric, StatisticsMetric) and
+                       metric.time_chunk is not None]
+        if time_chunks:
+            return min(time_chunks)
+        return max(MAX_BATCH_BYTES // max(time_bytes, 1), 1)
+
     def _run_unary_metric_evaluation(self):
         unary_results = []
         for metric in self.unary_metrics:
             unary_results.append([])
             # Unary metrics should be run over the reference Dataset also
             if self.ref_dataset:
-                unary_results[-1].append(metric.run(self.ref_dataset))
+                unary_results[-1].append(
+                    self._run_unary_metric(metric, self.ref_dataset))
 
             for target in self.target_datasets:
-                unary_results[-1].append(metric.run(target))
+                unary_results[-1].append(self._run_unary_metric(metric, target))
         return convert_unary_evaluation_result(unary_results)
 
     def _run_subregion_unary_evaluation(self):
         unary_results = []
+        datasets = list(self.target_datasets)
         if self.ref_dataset:
-            new_refs = [DSP.subset(self.ref_dataset, s)
-                        for s in self.subregions]
+            datasets.insert(0, self.ref_dataset)
+
+        # The subset of each dataset and subregion, made on first use.
+        subsets = {}
 
-        new_targets = [
-            [DSP.subset(t, s) for s in self.subregions]
-            for t in self.target_datasets
-        ]
+        def subset(idataset, isubregion):
+            if (idataset, isubregion) not in subsets:
+                subsets[idataset, isubregion] = DSP.subset(
+                    datasets[idataset], self.subregions[isubregion])
+            return subsets[idataset, isubregion]
 
         for metric in self.unary_metrics:
             unary_results.append([])
 
-            for i in range(len(self.subregions)):
+            for i, subregion in enumerate(self.subregions):
                 unary_results[-1].append([])
 
-                if self.ref_dataset:
-                    unary_results[-1][-1].append(metric.run(new_refs[i]))
-
-                for t in range(len(self.target_datasets)):
-                    unary_results[-1][-1].append(metric.run(new_targets[t][i]))
+                for d, dataset in enumerate(datasets):
+                    unary_results[-1][-1].append(self._run_unary_metric(
+                        metric, dataset, subregion,
+                        lambda: subset(d, i)))
 
         return convert_unary_evaluation_result(unary_results, subregion=True)
 
+    def _run_unary_metric(self, metric, dataset, subregion=None,
+                          subset=None):
+        '''Run a unary metric on a dataset, or its subset of a subregion,
+        reusing the result in the result cache.
+
+        :param subset: (Optional) Function without arguments returning the
+            subset of dataset to run the metric on. Only called if the
+            result isn't cached.
+        '''
+        if self.result_cache is None:
+            return metric.run(dataset if subset is None else subset())
+
+        key = result_key(metric, [self._fingerprint(dataset)], subregion)
+        result = self.result_cache.get(key, _MISSING)
+        if result is _MISSING:
+            result = metric.run(dataset if subset is None else subset())
+            self.result_cache.put(key, result)
+        return result
+
+    def _fingerprint(self, dataset):
+        '''Fingerprint a dataset once per run.'''
+        if id(dataset) not in self._fingerprints:
+            self._fingerprints[id(dataset)] = dataset.fingerprint()
+        return self._fingerprints[id(dataset)]
+
     def __str__(self):
         formatted_repr = (
             "<Evaluation - ref_dataset: {}, "
@@ -18,19 +18,106 @@
 '''
 Classes:
     Metric - Abstract Base Class from which all metrics must inherit.
+
+    BinaryStatistics - Sufficient statistics of a reference and target
+        dataset, from which the StatisticsMetric metrics are calculated.
+
+    UnaryStatistics - Count, mean and sum of squared deviations of a
+        dataset's values over time.
 '''
 
 from abc import ABCMeta, abstractmethod
+import ocw.config as config
 import ocw.utils as utils
 import numpy
 import numpy.ma as ma
+from scipy import stats
 from scipy.stats import mstats
 
 
 class Metric(object):
-    '''Base Metric Class'''
+    '''Base Metric Class
+
+    Besides running on whole datasets, a metric can be calculated from
+    blocks of times of the datasets' values with an accumulator. Datasets
+    larger than memory are then read one block at a time, and accumulators
+    of separate blocks, from parallel workers for instance, are merged
+    exactly.
+
+    >>> accumulator = metric.init()
+    >>> for values in blocks:
+    ...     accumulator = metric.update(accumulator, *values)
+    >>> result = metric.finalize(metric.merge(accumulator, other_accumulator))
+    '''
     __metaclass__ = ABCMeta
 
+    def init(self):
+        '''Create an empty accumulator of the metric.
+
+        :returns: The accumulator.
+
+        :raises NotImplementedError: If the metric doesn't support
+            accumulation.
+        '''
+        raise NotImplementedError('{} does not support accumulation.'
+                                  .format(type(self).__name__))
+
+    def update(self, accumulator, *values):
+        '''Add a block of times of the datasets' values to an accumulator.
+
+        :param accumulator: The accumulator, which may be modified.
+
+        :param values: (time, ...) arrays of the block's values of each
+            dataset, in the order of the arguments of run.
+        :type values: :class:'numpy.ma.core.MaskedArray'
+
+        :returns: The updated accumulator.
+        '''
+        raise NotImplementedError('{} does not support accumulation.'
+                                  .format(type(self).__name__))
+
+    def merge(self, accumulator, other):
+        '''Merge two accumulators. The blocks of other must follow those of
+        accumulator in time.
+
+        :param accumulator: The accumulator, which may be modified.
+
+        :param other: The accumulator of the following blocks.
+
+        :returns: The merged accumulator.
+        '''
+        raise NotImplementedError('{} does not support accumulation.'
+                                  .format(type(self).__name__))
+
+    def finalize(self, accumulator):
+        '''Calculate the metric from an accumulator.
+
+        :param accumulator: The accumulator of all blocks of times.
+
+        :returns: The result of the metric, as returned by run.
+        '''
+        raise NotImplementedError('{} does not support accumulation.'
+                                  .format(type(self).__name__))
+
+    def run_in_chunks(self, datasets, time_chunk):
+        '''Run the metric reading the datasets' values in blocks of times.
+
+        :param datasets: The datasets, in the order of the arguments of run.
+        :type datasets: :class:`list` of :class:`dataset.Dataset`
+
+        :param time_chunk: The number of times in each block.
+        :type time_chunk: :class:`int`
+
+        :returns: The result of the metric, as returned by run.
+
+        :raises ValueError: If the datasets don't have the same number of
+            times.
+        '''
+        accumulator = self.init()
+        for values in _iter_value_chunks(time_chunk, *datasets):
+            accumulator = self.update(accumulator, *values)
+        return self.finalize(accumulator)
+
 
 class UnaryMetric(Metric):
     '''Abstract Base Class from which all unary metrics inherit.'''
@@ -68,6 +155,126 @@ class BinaryMetric(Metric):
             target dataset.
         '''
 
+    def run_models(self, ref_dataset, target_datasets):
+        '''Run the metric for several target datasets against the same
+        reference dataset.
+
+        Metrics that support it calculate the results of all targets at once
+        from their values stacked along a leading model axis. The others run
+        once for each target.
+
+        :param ref_dataset: The reference dataset.
+        :type ref_dataset: :class:`dataset.Dataset`
+
+        :param target_datasets: The target datasets, or, for metrics that
+            support it, a (model, time, ...) array of their stacked values
+            with the shape of the reference values after the model axis.
+        :type target_datasets: :class:`list` of :class:`dataset.Dataset`
+
+        :returns: The result of the metric for each target dataset.
+        :rtype: :class:`list`
+
+        :raises ValueError: If the metric doesn't support stacked values.
+        '''
+        if isinstance(target_datasets, numpy.ndarray):
+            raise ValueError('{} needs target datasets, not stacked values.'
+                             .format(type(self).__name__))
+        return [self.run(ref_dataset, target_dataset)
+                for target_dataset in target_datasets]
+
+
+class StatisticsMetric(BinaryMetric):
+    '''Abstract Base Class of the binary metrics calculated from the
+    :class:`BinaryStatistics` of the reference and target datasets.
+
+    An Evaluation accumulates the statistics of each pair of datasets once
+    and shares them between all of its statistics metrics.
+    '''
+    __metaclass__ = ABCMeta
+
+    def __init__(self, time_chunk=None):
+        '''Default constructor.
+
+        :param time_chunk: (Optional) Read the dataset values in blocks of
+            this many times instead of all at once.
+        :type time_chunk: :class:`int`
+        '''
+        self.time_chunk = time_chunk
+
+    def run(self, ref_dataset, target_dataset):
+        '''Run the metric for the given reference and target datasets.
+
+        .. note::
+           Overrides BinaryMetric.run()
+
+        :param ref_dataset: The reference dataset to use in this metric run.
+        :type ref_dataset: :class:`dataset.Dataset`
+
+        :param target_dataset: The target dataset to evaluate against the
+            reference dataset in this metric run.
+        :type target_dataset: :class:`dataset.Dataset`
+
+        :returns: The result of evaluating the metric on the reference and
+            target dataset.
+        '''
+        return self.from_statistics(BinaryStatistics.from_datasets(
+            ref_dataset, target_dataset, time_chunk=self.time_chunk))
+
+    def run_models(self, ref_dataset, target_datasets):
+        '''Run the metric for all target datasets at once from their batched
+        statistics.
+
+        .. note::
+           Overrides BinaryMetric.run_models()
+        '''
+        return list(self.from_statistics(BinaryStatistics.from_datasets(
+            ref_dataset, target_datasets, time_chunk=self.time_chunk)))
+
+    def init(self):
+        '''Create empty statistics.
+
+        .. note::
+           Overrides Metric.init()
+        '''
+        return BinaryStatistics()
+
+    def update(self, accumulator, ref_values, target_values):
+        '''Add a block of times to the statistics.
+
+        .. note::
+           Overrides Metric.update()
+        '''
+        accumulator.update(ref_values, target_values)
+        return accumulator
+
+    def merge(self, accumulator, other):
+        '''Merge the statistics of two sets of blocks.
+
+        .. note::
+           Overrides Metric.merge()
+        '''
+        accumulator.merge(other)
+        return accumulator
+
+    def finalize(self, accumulator):
+        '''Calculate the metric from the statistics.
+
+        .. note::
+           Overrides Metric.finalize()
+        '''
+        return self.from_statistics(accumulator)
+
+    @abstractmethod
+    def from_statistics(self, statistics):
+        '''Calculate the metric from the statistics of a pair of datasets.
+
+        :param statistics: The statistics of the reference and target
+            datasets.
+        :type statistics: :class:`BinaryStatistics`
+
+        :returns: The result of evaluating the metric.
+        '''
+
 
 class Bias(BinaryMetric):
     '''Calculate the bias between a reference and target dataset.'''
@@ -89,7 +296,49 @@ class Bias(BinaryMetric):
         :rtype: :class:`numpy.ndarray`
         '''
         return calc_bias(target_dataset.values, ref_dataset.values)
-    
+
+    def run_models(self, ref_dataset, target_datasets):
+        '''Calculate the biases of all target datasets at once.
+
+        .. note::
+           Overrides BinaryMetric.run_models()
+        '''
+        return list(calc_bias(_stack_values(target_datasets),
+                              ref_dataset.values))
+
+    def init(self):
+        '''The blocks of biases.
+
+        .. note::
+           Overrides Metric.init()
+        '''
+        return []
+
+    def update(self, accumulator, ref_values, target_values):
+        '''Calculate the bias of a block of times.
+
+        .. note::
+           Overrides Metric.update()
+        '''
+        accumulator.append(calc_bias(target_values, ref_values))
+        return accumulator
+
+    def merge(self, accumulator, other):
+        '''Join the blocks of biases.
+
+        .. note::
+           Overrides Metric.merge()
+        '''
+        return accumulator + other
+
+    def finalize(self, accumulator):
+        '''Concatenate the blocks of biases.
+
+        .. note::
+           Overrides Metric.finalize()
+        '''
+        return ma.concatenate(accumulator)
+
 
 class AbsoluteBias(BinaryMetric):
     '''Calculate the absolute bias between a reference and target dataset.'''
@@ -112,32 +361,83 @@ class AbsoluteBias(BinaryMetric):
         '''
         return calc_absbias(target_dataset.values, ref_dataset.values)
 
+    def run_models(self, ref_dataset, target_datasets):
+        '''Calculate the absolute biases of all target datasets at once.
+
+        .. note::
+           Overrides BinaryMetric.run_models()
+        '''
+        return list(calc_absbias(_stack_values(target_datasets),
+                                 ref_dataset.values))
+
+    def init(self):
+        '''The blocks of absolute biases.
+
+        .. note::
+           Overrides Metric.init()
+        '''
+        return []
+
+    def update(self, accumulator, ref_values, target_values):
+        '''Calculate the absolute bias of a block of times.
 
-class SpatialPatternTaylorDiagram(BinaryMetric):
+        .. note::
+           Overrides Metric.update()
+        '''
+        accumulator.append(calc_absbias(target_values, ref_values))
+        return accumulator
+
+    def merge(self, accumulator, other):
+        '''Join the blocks of absolute biases.
+
+        .. note::
+           Overrides Metric.merge()
+        '''
+        return accumulator + other
+
+    def finalize(self, accumulator):
+        '''Concatenate the blocks of absolute biases.
+
+        .. note::
+           Overrides Metric.finalize()
+        '''
+        return ma.concatenate(accumulator)
+
+
+class SpatialPatternTaylorDiagram(StatisticsMetric):
     ''' Calculate the target to reference ratio of spatial standard deviation and pattern correlation'''
 
-    def run(self, ref_dataset, target_dataset):
+    def from_statistics(self, statistics):
         '''Calculate two metrics to plot a Taylor diagram to compare spatial patterns      
 
         .. note::
-           Overrides BinaryMetric.run() 
+           Overrides StatisticsMetric.from_statistics()
 
-        :param ref_dataset: The reference dataset to use in this metric run.
-        :type ref_dataset: :class:`dataset.Dataset`
-
-        :param target_dataset: The target dataset to evaluate against the
-            reference dataset in this metric run.
-        :type target_dataset: :class:`dataset.Dataset`
+        :param statistics: The statistics of the reference and target
+            datasets.
+        :type statistics: :class:`BinaryStatistics`
 
         :returns: standard deviation ratio, pattern correlation coefficient
         :rtype: :float:'float','float' 
         '''
-        return ma.array([calc_stddev_ratio(target_dataset.values, ref_dataset.values), calc_correlation(target_dataset.values, ref_dataset.values)])
+        # Transposed so that batched statistics give a pair for each model
+        return ma.array([statistics.stddev_ratio(),
+                         statistics.pattern_correlation()],
+                        dtype=statistics.dtype).T
 
 
 class TemporalStdDev(UnaryMetric):
     '''Calculate the standard deviation over the time.'''
 
+    def __init__(self, time_chunk=None):
+        '''Default constructor.
+
+        :param time_chunk: (Optional) Read the dataset values in blocks of
+            this many times instead of all at once.
+        :type time_chunk: :class:`int`
+        '''
+        self.time_chunk = time_chunk
+
     def run(self, target_dataset):
         '''Calculate the temporal std. dev. for a datasets.
 
@@ -151,61 +451,106 @@ class TemporalStdDev(UnaryMetric):
         :returns: The temporal standard deviation of the target dataset
         :rtype: :class:`ndarray`
         '''
+        if self.time_chunk is not None:
+            return self.run_in_chunks([target_dataset], self.time_chunk)
         return calc_stddev(target_dataset.values, axis=0)
 
+    def init(self):
+        '''Create empty statistics.
 
-class StdDevRatio(BinaryMetric):
-    '''Calculate the standard deviation ratio between two datasets.'''
+        .. note::
+           Overrides Metric.init()
+        '''
+        return UnaryStatistics()
 
-    def run(self, ref_dataset, target_dataset):
-        '''Calculate the standard deviation ratio.
+    def update(self, accumulator, target_values):
+        '''Add a block of times to the statistics.
 
         .. note::
-            Overrides BinaryMetric.run()
+           Overrides Metric.update()
+        '''
+        accumulator.update(target_values)
+        return accumulator
 
-        :param ref_dataset: The reference dataset to use in this metric run.
-        :type ref_dataset: :class:`dataset.Dataset`
+    def merge(self, accumulator, other):
+        '''Merge the statistics of two sets of blocks.
 
-        :param target_dataset: The target dataset to evaluate against the
-            reference dataset in this metric run.
-        :type target_dataset: :class:`dataset.Dataset`
+        .. note::
+           Overrides Metric.merge()
+        '''
+        accumulator.merge(other)
+        return accumulator
 
-        :returns: The standard deviation ratio of the reference and target
+    def finalize(self, accumulator):
+        '''Calculate the standard deviation from the statistics.
+
+        .. note::
+           Overrides Metric.finalize()
         '''
+        return accumulator.stddev()
 
-        return calc_stddev_ratio(target_dataset.values, ref_dataset.values)
 
+class StdDevRatio(StatisticsMetric):
+    '''Calculate the standard deviation ratio between two datasets.
 
-class PatternCorrelation(BinaryMetric):
+    Only the values at which both datasets are valid are used, so datasets
+    with different masks are compared over the same points and times. The
+    standard deviation of each dataset over all of its own valid values is
+    given by :func:`calc_stddev_ratio`.
+    '''
+
+    def from_statistics(self, statistics):
+        '''Calculate the standard deviation ratio.
+
+        .. note::
+            Overrides StatisticsMetric.from_statistics()
+
+        :param statistics: The statistics of the reference and target
+            datasets.
+        :type statistics: :class:`BinaryStatistics`
+
+        :returns: The standard deviation ratio of the reference and target
+        '''
+        return statistics.stddev_ratio()
+
+
+class PatternCorrelation(StatisticsMetric):
     '''Calculate the correlation coefficient between two datasets'''
 
-    def run(self, ref_dataset, target_dataset):
+    def from_statistics(self, statistics):
         '''Calculate the correlation coefficient between two dataset.
 
         .. note::
-           Overrides BinaryMetric.run()
+           Overrides StatisticsMetric.from_statistics()
 
-        :param ref_dataset: The reference dataset to use in this metric run.
-        :type ref_dataset: :class:`dataset.Dataset`
-
-        :param target_dataset: The target dataset to evaluate against the
-            reference dataset in this metric run.
-        :type target_dataset: :class:`dataset.Dataset`
+        :param statistics: The statistics of the reference and target
+            datasets.
+        :type statistics: :class:`BinaryStatistics`
 
         :returns: The correlation coefficient between a reference and target dataset.
         '''
-        # stats.pearsonr returns correlation_coefficient, 2-tailed p-value
-        # We only care about the correlation coefficient
-        # Docs at
-        # http://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.pearsonr.html
-
-        return calc_correlation(target_dataset.values, ref_dataset.values)
+        return statistics.pattern_correlation()
 
 
 class TemporalCorrelation(BinaryMetric):
     '''Calculate the temporal correlation coefficients and associated
        confidence levels between two datasets, using Pearson's correlation.'''
 
+    def __init__(self, p_values=False, effective_sample_size=False):
+        '''Default constructor.
+
+        :param p_values: (Optional) Also return the two-sided p-values of the
+            coefficients.
+        :type p_values: :class:`bool`
+
+        :param effective_sample_size: (Optional) Also return the number of
+            independent times, given the lag-1 autocorrelation of the series.
+            The p-values are then calculated with it.
+        :type effective_sample_size: :class:`bool`
+        '''
+        self.p_values = p_values
+        self.effective_sample_size = effective_sample_size
+
     def run(self, reference_dataset, target_dataset):
         '''Calculate the temporal correlation coefficients and associated
            confidence levels between two datasets, using Pearson's correlation.
@@ -221,65 +566,848 @@ class TemporalCorrelation(BinaryMetric):
             reference dataset in this metric run
         :type target_dataset: :class:`dataset.Dataset`
 
-        :returns: A 2D array of temporal correlation coefficients and a 2D
-            array of confidence levels associated with the temporal correlation
-            coefficients
-        '''
-        num_times, num_lats, num_lons = reference_dataset.values.shape
-        coefficients = ma.zeros([num_lats, num_lons])
-        for i in numpy.arange(num_lats):
-            for j in numpy.arange(num_lons):
-                coefficients[i, j] = calc_correlation(
-                    target_dataset.values[:, i, j],
-                    reference_dataset.values[:, i, j])
+        :returns: A 2D array of temporal correlation coefficients, followed
+            by 2D arrays of their p-values and of the effective sample sizes
+            if they were requested.
+        '''
+        results = calc_temporal_correlation(
+            target_dataset.values, reference_dataset.values,
+            p_values=self.p_values,
+            effective_sample_size=self.effective_sample_size)
+        if isinstance(results, tuple):
+            return (results[0].astype(config.get_dtype(reference_dataset)),) \
+                + results[1:]
+        return results.astype(config.get_dtype(reference_dataset))
+
+    def run_models(self, reference_dataset, target_datasets):
+        '''Calculate the temporal correlation coefficients of all target
+        datasets at once.
+
+        .. note::
+           Overrides BinaryMetric.run_models()
+        '''
+        # Time first and a model axis for the reference to broadcast along
+        target_values = _stack_values(target_datasets).swapaxes(0, 1)
+        reference_values = ma.asarray(reference_dataset.values)[:, numpy.newaxis]
+        results = calc_temporal_correlation(
+            target_values, reference_values, p_values=self.p_values,
+            effective_sample_size=self.effective_sample_size)
+        dtype = config.get_dtype(reference_dataset)
+        if isinstance(results, tuple):
+            return list(zip(results[0].astype(dtype), *results[1:]))
+        return list(results.astype(dtype))
+
+    def init(self):
+        '''Create empty statistics, or a list of the blocks of values if the
+        effective sample size is requested, as it needs the whole series.
+
+        .. note::
+           Overrides Metric.init()
+        '''
+        if self.effective_sample_size:
+            return []
+        return BinaryStatistics()
+
+    def update(self, accumulator, ref_values, target_values):
+        '''Add a block of times to the accumulator.
+
+        .. note::
+           Overrides Metric.update()
+        '''
+        if self.effective_sample_size:
+            accumulator.append((ma.asarray(ref_values),
+                                ma.asarray(target_values)))
+        else:
+            accumulator.update(ref_values, target_values)
+        return accumulator
+
+    def merge(self, accumulator, other):
+        '''Merge two accumulators.
+
+        .. note::
+           Overrides Metric.merge()
+        '''
+        if self.effective_sample_size:
+            return accumulator + other
+        accumulator.merge(other)
+        return accumulator
+
+    def finalize(self, accumulator):
+        '''Calculate the correlation coefficients from the accumulator.
+
+        .. note::
+           Overrides Metric.finalize()
+        '''
+        if self.effective_sample_size:
+            return calc_temporal_correlation(
+                ma.concatenate([target for _, target in accumulator]),
+                ma.concatenate([ref for ref, _ in accumulator]),
+                p_values=self.p_values, effective_sample_size=True)
+        count = numpy.asarray(accumulator.count)
+        undefined = ((count < 2) | (accumulator.ref_m2 == 0) |
+                     (accumulator.target_m2 == 0))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            coefficients = accumulator.cross_m2 / numpy.sqrt(
+                accumulator.ref_m2 * accumulator.target_m2)
+        coefficients = ma.array(numpy.clip(numpy.where(
+            undefined, 0., coefficients), -1., 1.), mask=undefined)
+        if self.p_values:
+            return coefficients, _calc_correlation_p_values(
+                coefficients, count.astype(numpy.float64))
         return coefficients
 
 
-class TemporalMeanBias(BinaryMetric):
+class TemporalMeanBias(StatisticsMetric):
     '''Calculate the bias averaged over time.'''
 
-    def run(self, ref_dataset, target_dataset):
+    def from_statistics(self, statistics):
         '''Calculate the bias averaged over time.
 
         .. note::
-           Overrides BinaryMetric.run()
+           Overrides StatisticsMetric.from_statistics()
 
-        :param ref_dataset: The reference dataset to use in this metric run.
-        :type ref_dataset: :class:`dataset.Dataset`
-
-        :param target_dataset: The target dataset to evaluate against the
-            reference dataset in this metric run.
-        :type target_dataset: :class:`dataset.Dataset`
+        :param statistics: The statistics of the reference and target
+            datasets.
+        :type statistics: :class:`BinaryStatistics`
 
         :returns: The mean bias between a reference and target dataset over time.
         '''
+        return statistics.temporal_mean_bias()
 
-        return calc_bias(target_dataset.values, ref_dataset.values, average_over_time=True)
 
-
-class RMSError(BinaryMetric):
+class RMSError(StatisticsMetric):
     '''Calculate the Root Mean Square Difference (RMS Error), with the mean
        calculated over time and space.'''
 
-    def run(self, reference_dataset, target_dataset):
+    def from_statistics(self, statistics):
         '''Calculate the Root Mean Square Difference (RMS Error), with the mean
            calculated over time and space.
 
         .. note::
-           Overrides BinaryMetric.run()
+           Overrides StatisticsMetric.from_statistics()
 
-        :param reference_dataset: The reference dataset to use in this metric
-            run
-        :type reference_dataset: :class:`dataset.Dataset`
+        :param statistics: The statistics of the reference and target
+            datasets.
+        :type statistics: :class:`BinaryStatistics`
 
-        :param target_dataset: The target dataset to evaluate against the
-            reference dataset in this metric run
+        :returns: The RMS error, with the mean calculated over time and space
+        '''
+        return statistics.rmse()
+
+
+class AnnualIndex(UnaryMetric):
+    '''Abstract Base Class of the ETCCDI indices, which are calculated
+    separately for each year of daily values.
+
+    The accumulator of an index calculates it over all the blocks of days
+    added to it, so run and run_in_chunks use a new accumulator for each
+    year.
+    '''
+    __metaclass__ = ABCMeta
+
+    def run(self, target_dataset):
+        '''Calculate the index of each year of the dataset.
+
+        .. note::
+           Overrides UnaryMetric.run()
+
+        :param target_dataset: The dataset of daily values.
         :type target_dataset: :class:`dataset.Dataset`
 
-        :returns: The RMS error, with the mean calculated over time and space
+        :returns: The (year, ...) index of every grid point in each year, in
+            the order of the years.
+        :rtype: :class:'numpy.ma.core.MaskedArray'
+        '''
+        return self._run_by_year(target_dataset)
+
+    def run_in_chunks(self, datasets, time_chunk):
+        '''Calculate the index of each year reading the days of a year in
+        blocks of times.
+
+        .. note::
+           Overrides Metric.run_in_chunks()
         '''
+        return self._run_by_year(datasets[0], time_chunk)
+
+    def _run_by_year(self, target_dataset, time_chunk=None):
+        '''Accumulate the days of each year separately.'''
+        years = target_dataset.time_index.year
+        results = []
+        for year in numpy.unique(years):
+            indices = numpy.nonzero(years == year)[0]
+            accumulator = self.init()
+            step = time_chunk or len(indices)
+            for start in range(0, len(indices), step):
+                accumulator = self.update(accumulator, ma.asarray(
+                    target_dataset.values[indices[start:start + step]]))
+            results.append(self.finalize(accumulator))
+        if not results:
+            return ma.masked_all((0,) + target_dataset.values.shape[1:])
+        return ma.stack(results)
+
+
+class RxNday(AnnualIndex):
+    '''Calculate the maximum precipitation accumulated over consecutive days
+    at every grid point in each year, from daily precipitation.
+
+    The sums of every window of days are taken from the differences of the
+    cumulative sums of the values. Windows with masked days are left out,
+    and the maxima are masked where no window of a year is complete.
+    '''
+
+    def __init__(self, days):
+        '''Default constructor.
+
+        :param days: The number of consecutive days.
+        :type days: :class:`int`
+
+        :raises ValueError: If days is smaller than one.
+        '''
+        if days < 1:
+            raise ValueError('The number of days must be at least one.')
+        self.days = days
+
+    def init(self):
+        '''No days yet.
+
+        .. note::
+           Overrides Metric.init()
+        '''
+        return None
+
+    def update(self, accumulator, target_values):
+        '''Add a block of days.
+
+        .. note::
+           Overrides Metric.update()
+        '''
+        return self.merge(accumulator,
+                          _RollingMaximum.from_values(target_values,
+                                                      self.days))
+
+    def merge(self, accumulator, other):
+        '''Merge the maxima of two sets of blocks, including the windows
+        across them.
+
+        .. note::
+           Overrides Metric.merge()
+        '''
+        if accumulator is None:
+            return other
+        if other is None:
+            return accumulator
+        return accumulator.merge(other)
+
+    def finalize(self, accumulator):
+        '''The maximum precipitation of every grid point.
+
+        .. note::
+           Overrides Metric.finalize()
+        '''
+        return accumulator.maximum
+
+
+class Rx1day(RxNday):
+    '''Calculate the maximum 1-day precipitation (ETCCDI Rx1day).'''
+
+    def __init__(self):
+        '''Default constructor.'''
+        super(Rx1day, self).__init__(1)
+
 
-        return calc_rmse(target_dataset.values, reference_dataset.values)
+class Rx5day(RxNday):
+    '''Calculate the maximum consecutive 5-day precipitation (ETCCDI
+    Rx5day).'''
+
+    def __init__(self):
+        '''Default constructor.'''
+        super(Rx5day, self).__init__(5)
+
+
+class ConsecutiveDays(AnnualIndex):
+    '''Calculate the longest spell of consecutive wet or dry days at every
+    grid point in each year, from daily precipitation.
+
+    The spells are found for all grid points at once from the run-length
+    encoding of the wet or dry days. Masked days and the ends of the years
+    interrupt the spells, and the results are masked where no days of a
+    year are valid.
+    '''
+
+    def __init__(self, wet, wet_day=1.):
+        '''Default constructor.
+
+        :param wet: True to count wet days, False to count dry days.
+        :type wet: :class:`bool`
+
+        :param wet_day: (Optional) The minimum precipitation of a wet day.
+            Days with less precipitation are dry.
+        :type wet_day: :class:`float`
+        '''
+        self.wet = wet
+        self.wet_day = wet_day
+
+    def init(self):
+        '''No days yet.
+
+        .. note::
+           Overrides Metric.init()
+        '''
+        return None
+
+    def update(self, accumulator, target_values):
+        '''Add a block of days.
+
+        .. note::
+           Overrides Metric.update()
+        '''
+        target_values = ma.asarray(target_values)
+        if self.wet:
+            days = target_values.filled(0) >= self.wet_day
+        else:
+            days = target_values.filled(0) < self.wet_day
+        return self.merge(accumulator, _Spells.from_days(
+            days & ~ma.getmaskarray(target_values),
+            ma.count(target_values, axis=0)))
+
+    def merge(self, accumulator, other):
+        '''Merge the spells of two sets of blocks, joining the spells across
+        them.
+
+        .. note::
+           Overrides Metric.merge()
+        '''
+        if accumulator is None:
+            return other
+        if other is None:
+            return accumulator
+        return accumulator.merge(other)
+
+    def finalize(self, accumulator):
+        '''The number of days of the longest spell of every grid point.
+
+        .. note::
+           Overrides Metric.finalize()
+        '''
+        return ma.array(accumulator.longest, mask=accumulator.count == 0)
+
+
+class CDD(ConsecutiveDays):
+    '''Calculate the maximum number of consecutive days with less than
+    1 mm of precipitation (ETCCDI CDD).'''
+
+    def __init__(self, wet_day=1.):
+        '''Default constructor.
+
+        :param wet_day: (Optional) The minimum precipitation of a wet day.
+        :type wet_day: :class:`float`
+        '''
+        super(CDD, self).__init__(False, wet_day)
+
+
+class CWD(ConsecutiveDays):
+    '''Calculate the maximum number of consecutive days with at least 1 mm
+    of precipitation (ETCCDI CWD).'''
+
+    def __init__(self, wet_day=1.):
+        '''Default constructor.
+
+        :param wet_day: (Optional) The minimum precipitation of a wet day.
+        :type wet_day: :class:`float`
+        '''
+        super(CWD, self).__init__(True, wet_day)
+
+
+class R95p(AnnualIndex):
+    '''Calculate the total precipitation of the very wet days in each year
+    (ETCCDI R95p), the wet days above the 95th percentile of wet day
+    precipitation of a base period.'''
+
+    def __init__(self, percentile=95., wet_day=1., threshold=None):
+        '''Default constructor.
+
+        :param percentile: (Optional) The percentile of the wet day
+            precipitation above which a day is very wet.
+        :type percentile: :class:`float`
+
+        :param wet_day: (Optional) The minimum precipitation of a wet day.
+        :type wet_day: :class:`float`
+
+        :param threshold: (Optional) The precipitation above which a day is
+            very wet at every grid point, such as the percentile of a base
+            period or reference dataset from :func:`calc_wet_day_percentile`.
+            By default run uses the percentile of the whole evaluated
+            dataset. A threshold is needed to accumulate blocks of days.
+        :type threshold: :class:`numpy.ndarray`
+        '''
+        self.percentile = percentile
+        self.wet_day = wet_day
+        self.threshold = threshold
+
+    def run(self, target_dataset):
+        '''Calculate the very wet days precipitation.
+
+        .. note::
+           Overrides UnaryMetric.run()
+
+        :param target_dataset: The dataset of daily precipitation.
+        :type target_dataset: :class:`dataset.Dataset`
+
+        :returns: The (year, ...) total precipitation of the very wet days
+            of every grid point in each year, masked where no days are
+            valid.
+        :rtype: :class:'numpy.ma.core.MaskedArray'
+        '''
+        if self.threshold is None:
+            # Grid points without wet days have no threshold and a total of 0
+            threshold = calc_wet_day_percentile(
+                target_dataset.values, self.percentile, self.wet_day)
+            return R95p(self.percentile, self.wet_day,
+                        threshold.filled(numpy.inf)).run(target_dataset)
+        return super(R95p, self).run(target_dataset)
+
+    def init(self):
+        '''The total precipitation of the very wet days and the number of
+        valid days.
+
+        .. note::
+           Overrides Metric.init()
+
+        :raises ValueError: If there is no threshold, which would need all
+            the wet days to be kept.
+        '''
+        if self.threshold is None:
+            raise ValueError('R95p needs a threshold to accumulate blocks of '
+                             'days. Use calc_wet_day_percentile on a base '
+                             'period to calculate one.')
+        return [0., 0]
+
+    def update(self, accumulator, target_values):
+        '''Add a block of days.
+
+        .. note::
+           Overrides Metric.update()
+        '''
+        target_values = ma.asarray(target_values)
+        return self.merge(accumulator, [
+            _calc_total_above(target_values, self.wet_day, self.threshold),
+            ma.count(target_values, axis=0)])
+
+    def merge(self, accumulator, other):
+        '''Merge two accumulators.
+
+        .. note::
+           Overrides Metric.merge()
+        '''
+        return [accumulator[0] + other[0], accumulator[1] + other[1]]
+
+    def finalize(self, accumulator):
+        '''The total precipitation of the very wet days.
+
+        .. note::
+           Overrides Metric.finalize()
+        '''
+        total, count = accumulator
+        return ma.array(total, mask=numpy.asarray(count) == 0)
+
+
+class BinaryStatistics(object):
+    '''Sufficient statistics of the values of a reference and target dataset.
+
+    For every grid point, the number of times at which both datasets are
+    valid is kept with the means and the sums of squared deviations and
+    cross deviations of their values at those times. Blocks of times are
+    merged into the statistics with the pairwise update of Chan et al.
+    (1979), so that the datasets are read once, in as many blocks as needed,
+    to calculate all the :class:`StatisticsMetric` metrics.
+
+    Batched statistics of several target datasets against the same reference
+    have a leading model axis, and give the results of each model along it.
+    The statistics are accumulated in double precision and the results are
+    returned in the :func:`config.get_dtype` of the reference dataset.
+
+    >>> statistics = BinaryStatistics.from_datasets(ref, target, time_chunk=100)
+    >>> statistics.rmse(), statistics.pattern_correlation()
+    '''
+
+    def __init__(self, batched=False, dtype=None):
+        '''Create empty statistics.
+
+        :param batched: (Optional) Whether the target values have a leading
+            model axis.
+        :type batched: :class:`bool`
+
+        :param dtype: (Optional) The floating point type of the results.
+            Defaults to the package wide :func:`config.get_dtype`.
+        :type dtype: :class:`numpy.dtype`
+        '''
+        self.batched = batched
+        self.dtype = config.get_dtype() if dtype is None else \
+            numpy.dtype(dtype)
+        self.count = 0
+        self.ref_mean = 0.
+        self.target_mean = 0.
+        self.ref_m2 = 0.
+        self.target_m2 = 0.
+        self.cross_m2 = 0.
+        # The deviations of the differences are kept as well, as deriving
+        # them from the other sums loses precision for close datasets.
+        self.bias_m2 = 0.
+
+    @classmethod
+    def from_datasets(cls, ref_dataset, target_dataset, time_chunk=None):
+        '''Accumulate the statistics of a reference and target dataset.
+
+        :param ref_dataset: The reference dataset.
+        :type ref_dataset: :class:`dataset.Dataset`
+
+        :param target_dataset: The target dataset, or a list of target
+            datasets or a (model, time, ...) array of their stacked values
+            for batched statistics.
+        :type target_dataset: :class:`dataset.Dataset`
+
+        :param time_chunk: (Optional) Read the dataset values in blocks of
+            this many times instead of all at once. The values of a list of
+            target datasets are stacked one block at a time.
+        :type time_chunk: :class:`int`
+
+        :returns: The statistics of the datasets.
+        :rtype: :class:`BinaryStatistics`
+
+        :raises ValueError: If the datasets' values have different shapes.
+        '''
+        dtype = config.get_dtype(ref_dataset)
+        if isinstance(target_dataset, numpy.ndarray):
+            statistics = cls(batched=True, dtype=dtype)
+            statistics.update(ref_dataset.values, target_dataset)
+        elif isinstance(target_dataset, (list, tuple)):
+            statistics = cls(batched=True, dtype=dtype)
+            for values in _iter_value_chunks(
+                    time_chunk or max(len(ref_dataset.times), 1),
+                    ref_dataset, *target_dataset):
+                statistics.update(values[0], ma.stack(values[1:]))
+        else:
+            statistics = cls(dtype=dtype)
+            if time_chunk is None:
+                statistics.update(ref_dataset.values, target_dataset.values)
+            else:
+                for ref_values, target_values in _iter_value_chunks(
+                        time_chunk, ref_dataset, target_dataset):
+                    statistics.update(ref_values, target_values)
+        return statistics
+
+    def update(self, ref_values, target_values):
+        '''Add a block of times of the datasets' values to the statistics.
+
+        :param ref_values: (time, ...) values of the reference dataset.
+        :type ref_values: :class:'numpy.ma.core.MaskedArray'
+
+        :param target_values: (time, ...) values of the target dataset, or
+            (model, time, ...) values of the target datasets if batched.
+        :type target_values: :class:'numpy.ma.core.MaskedArray'
+
+        :raises ValueError: If the values have different shapes.
+        '''
+        target_shape = numpy.shape(target_values)
+        if self.batched:
+            target_shape = target_shape[1:]
+        if numpy.shape(ref_values) != target_shape:
+            raise ValueError('The reference and target values must have the '
+                             'same shape.')
+        if self.batched:
+            # Time first, with a model axis for the reference to broadcast
+            # along, so that the statistics have a leading model axis.
+            target_values = ma.asarray(target_values).swapaxes(0, 1)
+            ref_values = ma.asarray(ref_values)[:, numpy.newaxis]
+        valid = ~(ma.getmaskarray(ref_values) |
+                  ma.getmaskarray(target_values))
+        block = BinaryStatistics(self.batched)
+        block.count = valid.sum(axis=0)
+        n = numpy.maximum(block.count, 1)
+        # The values and their deviations stay in the values' floating point
+        # type. Only the sums over time are in double precision.
+        deviations = []
+        for values in [ref_values, target_values]:
+            values = ma.getdata(values)
+            dtype = numpy.result_type(values.dtype, numpy.float32)
+            values = numpy.where(valid, values, 0).astype(dtype, copy=False)
+            mean = values.sum(axis=0, dtype=numpy.float64) / n
+            deviations.append(numpy.where(valid, values - mean.astype(dtype),
+                                          0))
+            deviations.append(mean)
+        ref_deviation, block.ref_mean, target_deviation, block.target_mean = \
+            deviations
+        block.ref_m2 = (ref_deviation ** 2).sum(axis=0, dtype=numpy.float64)
+        block.target_m2 = (target_deviation ** 2).sum(axis=0,
+                                                      dtype=numpy.float64)
+        block.cross_m2 = (ref_deviation * target_deviation).sum(
+            axis=0, dtype=numpy.float64)
+        block.bias_m2 = ((target_deviation - ref_deviation) ** 2).sum(
+            axis=0, dtype=numpy.float64)
+        self.merge(block)
+
+    def merge(self, other):
+        '''Merge the statistics of other blocks of times into these.
+
+        :param other: The statistics to merge.
+        :type other: :class:`BinaryStatistics`
+        '''
+        total = self.count + other.count
+        weight = other.count / numpy.maximum(total, 1.)
+        ref_delta = other.ref_mean - self.ref_mean
+        target_delta = other.target_mean - self.target_mean
+        self.ref_mean = self.ref_mean + ref_delta * weight
+        self.target_mean = self.target_mean + target_delta * weight
+        self.ref_m2 = (self.ref_m2 + other.ref_m2 +
+                       ref_delta ** 2 * self.count * weight)
+        self.target_m2 = (self.target_m2 + other.target_m2 +
+                          target_delta ** 2 * self.count * weight)
+        self.cross_m2 = (self.cross_m2 + other.cross_m2 +
+                         ref_delta * target_delta * self.count * weight)
+        self.bias_m2 = (self.bias_m2 + other.bias_m2 +
+                        (target_delta - ref_delta) ** 2 * self.count * weight)
+        self.count = total
+
+    def temporal_mean_bias(self):
+        '''The mean difference of the target and reference over time.
+
+        :returns: The mean bias of every grid point, masked where no times are
+            valid.
+        :rtype: :class:'numpy.ma.core.MaskedArray'
+        '''
+        count = numpy.asarray(self.count)
+        return ma.array(self.target_mean - self.ref_mean, mask=count == 0,
+                        dtype=self.dtype)
+
+    def rmse(self):
+        '''The root mean square difference over time and space.'''
+        count, ref_mean, target_mean, _, _, _, bias_m2 = self._pooled()
+        return self._result(
+            (bias_m2 / numpy.maximum(count, 1) +
+             (target_mean - ref_mean) ** 2) ** 0.5, count == 0)
+
+    def stddev_ratio(self):
+        '''The ratio of the target to reference sample standard deviation of
+        all values.'''
+        count, _, _, ref_m2, target_m2, _, _ = self._pooled()
+        undefined = (count < 2) | (ref_m2 == 0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return self._result((target_m2 / ref_m2) ** 0.5, undefined)
+
+    def pattern_correlation(self):
+        '''The Pearson correlation coefficient of all values.'''
+        count, _, _, ref_m2, target_m2, cross_m2, _ = self._pooled()
+        undefined = (count < 2) | (ref_m2 == 0) | (target_m2 == 0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return self._result(numpy.clip(
+                cross_m2 / (ref_m2 * target_m2) ** 0.5, -1., 1.), undefined)
+
+    def _result(self, value, undefined):
+        '''A pooled value, masked where it's undefined. Pooled values of a
+        single target are scalars.'''
+        if numpy.ndim(value) == 0:
+            return ma.masked if undefined else self.dtype.type(value)
+        return ma.array(numpy.where(undefined, 0., value), mask=undefined,
+                        dtype=self.dtype)
+
+    def _pooled(self):
+        '''Merge the statistics of all grid points, separately for each
+        model if batched.
+
+        :returns: The count, reference and target means and the sums of
+            squared reference, target, cross and bias deviations.
+        '''
+        count = numpy.asarray(self.count, dtype=numpy.float64)
+        axes = tuple(range(1 if self.batched else 0, count.ndim))
+        total = count.sum(axis=axes, keepdims=True)
+        n = numpy.maximum(total, 1.)
+        ref_mean = (count * self.ref_mean).sum(axis=axes, keepdims=True) / n
+        target_mean = (count * self.target_mean) \
+            .sum(axis=axes, keepdims=True) / n
+        ref_delta = self.ref_mean - ref_mean
+        target_delta = self.target_mean - target_mean
+        shape = count.shape[:1] if self.batched else ()
+        return tuple(numpy.reshape(pooled, shape) for pooled in [
+            total, ref_mean, target_mean,
+            numpy.sum(self.ref_m2 + count * ref_delta ** 2, axis=axes),
+            numpy.sum(self.target_m2 + count * target_delta ** 2, axis=axes),
+            numpy.sum(self.cross_m2 + count * ref_delta * target_delta,
+                      axis=axes),
+            numpy.sum(self.bias_m2 + count * (target_delta - ref_delta) ** 2,
+                      axis=axes)])
+
+
+class UnaryStatistics(object):
+    '''Count, mean and sum of squared deviations of a dataset's values at
+    every grid point over time.
+
+    Blocks of times are merged with the pairwise update of Chan et al.
+    (1979), so that the standard deviation matches calc_stddev without
+    holding all values in memory.
+    '''
+
+    def __init__(self):
+        '''Create empty statistics.'''
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+    def update(self, values):
+        '''Add a block of times of the dataset's values to the statistics.
+
+        :param values: (time, ...) values of the dataset.
+        :type values: :class:'numpy.ma.core.MaskedArray'
+        '''
+        values = ma.asarray(values)
+        block = UnaryStatistics()
+        block.count = ma.count(values, axis=0)
+        block.mean = ma.mean(values, axis=0, dtype=numpy.float64)
+        block.m2 = ma.filled(ma.sum((values - block.mean) ** 2, axis=0,
+                                    dtype=numpy.float64), 0)
+        block.mean = ma.filled(block.mean, 0)
+        self.merge(block)
+
+    def merge(self, other):
+        '''Merge the statistics of other blocks of times into these.
+
+        :param other: The statistics to merge.
+        :type other: :class:`UnaryStatistics`
+        '''
+        total = self.count + other.count
+        weight = other.count / numpy.maximum(total, 1.)
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * weight
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * weight
+        self.count = total
+
+    def stddev(self):
+        '''The sample standard deviation of every grid point, masked where
+        fewer than two times are valid.'''
+        count = numpy.asarray(self.count)
+        return ma.sqrt(ma.array(self.m2 / numpy.maximum(count - 1, 1),
+                                mask=count < 2))
+
+
+class _RollingMaximum(object):
+    '''Maximum sum of a window of consecutive times of a block of values,
+    with the first and last times needed to complete the windows across
+    blocks.'''
+
+    def __init__(self, days, maximum, head, tail):
+        self.days = days
+        self.maximum = maximum
+        self.head = head
+        self.tail = tail
+
+    @classmethod
+    def from_values(cls, values, days):
+        values = ma.asarray(values)
+        edge = days - 1
+        return cls(days, _calc_rolling_sum_maximum(values, days),
+                   values[:edge], values[max(len(values) - edge, 0):])
+
+    def merge(self, other):
+        '''Merge the maxima of the following block, including the windows
+        across the blocks.'''
+        edge = self.days - 1
+        across = _calc_rolling_sum_maximum(
+            ma.concatenate([self.tail, other.head]), self.days)
+        maximum = self.maximum
+        for block_maximum in [other.maximum, across]:
+            maximum = ma.array(
+                numpy.fmax(maximum.filled(-numpy.inf),
+                           block_maximum.filled(-numpy.inf)),
+                mask=ma.getmaskarray(maximum) &
+                ma.getmaskarray(block_maximum))
+        head = ma.concatenate([self.head, other.head])[:edge]
+        tail = ma.concatenate([self.tail, other.tail])
+        return _RollingMaximum(self.days, maximum, head,
+                               tail[max(len(tail) - edge, 0):])
+
+
+class _Spells(object):
+    '''Longest run of consecutive days of a block of days, with the runs at
+    its start and end that may continue in the blocks around it.'''
+
+    def __init__(self, length, count, longest, prefix, suffix):
+        self.length = length
+        self.count = count
+        self.longest = longest
+        self.prefix = prefix
+        self.suffix = suffix
+
+    @classmethod
+    def from_days(cls, days, count):
+        '''Find the runs of a (time, ...) boolean array of days.'''
+        length = days.shape[0]
+        rows = days.reshape(length, -1).T
+        edges = numpy.diff(numpy.pad(rows.astype(numpy.int8), ((0, 0), (1, 1)),
+                                     'constant'), axis=1)
+        cells, starts = numpy.nonzero(edges == 1)
+        ends = numpy.nonzero(edges == -1)[1]
+        longest = numpy.zeros(rows.shape[0], dtype=int)
+        numpy.maximum.at(longest, cells, ends - starts)
+        all_days = rows.all(axis=1)
+        prefix = numpy.where(all_days, length, numpy.argmin(rows, axis=1))
+        suffix = numpy.where(all_days, length,
+                             numpy.argmin(rows[:, ::-1], axis=1))
+        shape = days.shape[1:]
+        return cls(length, numpy.asarray(count), longest.reshape(shape),
+                   prefix.reshape(shape), suffix.reshape(shape))
+
+    def merge(self, other):
+        '''Merge the runs of the following block, joining the runs across
+        the blocks.'''
+        longest = numpy.maximum(numpy.maximum(self.longest, other.longest),
+                                self.suffix + other.prefix)
+        prefix = numpy.where(self.prefix == self.length,
+                             self.length + other.prefix, self.prefix)
+        suffix = numpy.where(other.suffix == other.length,
+                             other.length + self.suffix, other.suffix)
+        return _Spells(self.length + other.length, self.count + other.count,
+                       longest, prefix, suffix)
+
+
+def all_subclasses(cls):
+    '''Get the direct and indirect subclasses of a metric class.
+
+    :param cls: The class whose subclasses to get, such as
+        :class:`BinaryMetric`.
+    :type cls: :class:`type`
+
+    :returns: The subclasses of cls and of each of its subclasses.
+    :rtype: :class:`list` of :class:`type`
+    '''
+    subclasses = cls.__subclasses__()
+    return subclasses + [indirect for subclass in subclasses
+                         for indirect in all_subclasses(subclass)]
+
+
+def built_in_metrics(cls):
+    '''Get the metrics derived from a metric class that can be built
+    without arguments, such as the metrics named in configuration files.
+
+    Abstract base classes, which declare ABCMeta as their metaclass, and
+    base classes whose constructors need arguments, such as
+    :class:`RxNday`, are left out.
+
+    :param cls: The class whose metrics to get, such as
+        :class:`BinaryMetric`.
+    :type cls: :class:`type`
+
+    :returns: The metric classes.
+    :rtype: :class:`list` of :class:`type`
+    '''
+    metrics = []
+    for subclass in all_subclasses(cls):
+        if '__metaclass__' in vars(subclass):
+            continue
+        try:
+            subclass()
+        except TypeError:
+            continue
+        metrics.append(subclass)
+    return metrics
 
 
 def calc_bias(target_array, reference_array, average_over_time=False):
@@ -341,10 +1469,12 @@ def calc_stddev(array, axis=None):
     :rtype: :class:'numpy.ma.core.MaskedArray'
     '''
 
+    # Variances are accumulated in double precision to limit round off errors
+    # on single precision input.
     if isinstance(axis, int):
-        return ma.std(array, axis=axis, ddof=1)
+        return ma.std(array, axis=axis, ddof=1, dtype=numpy.float64)
     else:
-        return ma.std(array, ddof=1)
+        return ma.std(array, ddof=1, dtype=numpy.float64)
 
 
 def calc_stddev_ratio(target_array, reference_array):
@@ -382,6 +1512,181 @@ def calc_correlation(target_array, reference_array):
     return mstats.pearsonr(reference_array.flatten(), target_array.flatten())[0]
 
 
+def calc_temporal_correlation(target_array, reference_array, p_values=False,
+                              effective_sample_size=False):
+    '''Calculate the correlation coefficient of the time series of every
+    grid point of two arrays at once.
+
+    Only the times at which both arrays are valid are used. Grid points with
+    fewer than two such times or a constant series are masked.
+
+    :param target_array: a (time, y, x) array to be evaluated, as model output
+    :type target_array: :class:'numpy.ma.core.MaskedArray'
+
+    :param reference_array: a (time, y, x) array of reference dataset
+    :type reference_array: :class:'numpy.ma.core.MaskedArray'
+
+    :param p_values: if True, also return the two-sided p-values of the
+        coefficients, from Student's t distribution
+    :type p_values: 'bool'
+
+    :param effective_sample_size: if True, also return the number of
+        independent times, n (1 - r1 r2) / (1 + r1 r2) where r1 and r2 are the
+        lag-1 autocorrelations of the series. The p-values are then calculated
+        with it instead of n.
+    :type effective_sample_size: 'bool'
+
+    :returns: (y, x) array of pearson's correlation coefficients, followed by
+        the p-values and the effective sample sizes if they were requested
+    :rtype: :class:'numpy.ma.core.MaskedArray' or 'tuple'
+    '''
+
+    valid = ~(ma.getmaskarray(target_array) | ma.getmaskarray(reference_array))
+    count = valid.sum(axis=0)
+    n = numpy.maximum(count, 1)
+    anomalies = []
+    for array in [reference_array, target_array]:
+        array = numpy.where(valid, ma.getdata(array), 0.).astype(numpy.float64)
+        anomaly = array - array.sum(axis=0) / n
+        anomaly[~valid] = 0.
+        anomalies.append(anomaly)
+    ref_anomaly, target_anomaly = anomalies
+
+    covariance = (ref_anomaly * target_anomaly).sum(axis=0)
+    ref_variance = (ref_anomaly ** 2).sum(axis=0)
+    target_variance = (target_anomaly ** 2).sum(axis=0)
+    undefined = (count < 2) | (ref_variance == 0) | (target_variance == 0)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        coefficients = covariance / numpy.sqrt(ref_variance * target_variance)
+    coefficients = ma.array(numpy.clip(numpy.where(undefined, 0.,
+                                                   coefficients), -1., 1.),
+                            mask=undefined)
+    if not (p_values or effective_sample_size):
+        return coefficients
+
+    sample_size = count.astype(numpy.float64)
+    if effective_sample_size:
+        # Lag-1 autocorrelations over the pairs of consecutive valid times
+        pairs = valid[1:] & valid[:-1]
+        lag_correlations = []
+        for anomaly, variance in [(ref_anomaly, ref_variance),
+                                  (target_anomaly, target_variance)]:
+            lag_covariance = numpy.where(pairs, anomaly[1:] * anomaly[:-1],
+                                         0.).sum(axis=0)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                lag_correlations.append(numpy.where(
+                    undefined, 0., lag_covariance / variance))
+        lag_product = lag_correlations[0] * lag_correlations[1]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            sample_size = numpy.clip(
+                sample_size * (1. - lag_product) / (1. + lag_product),
+                numpy.minimum(sample_size, 2.), sample_size)
+
+    results = (coefficients,)
+    if p_values:
+        results += (_calc_correlation_p_values(coefficients, sample_size),)
+    if effective_sample_size:
+        results += (ma.array(sample_size, mask=undefined),)
+    return results
+
+
+def _calc_correlation_p_values(coefficients, sample_size):
+    ''' Calculate the two-sided p-values of correlation coefficients from
+    Student's t distribution
+
+    :param coefficients: the correlation coefficients
+    :type coefficients: :class:'numpy.ma.core.MaskedArray'
+
+    :param sample_size: the number of independent samples of each coefficient
+    :type sample_size: :class:'numpy.ndarray'
+
+    :returns: the p-values, masked where the coefficients are masked or
+        there are fewer than three samples
+    :rtype: :class:'numpy.ma.core.MaskedArray'
+    '''
+    degrees = numpy.maximum(sample_size - 2., 0.)
+    r = ma.getdata(coefficients)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        t = numpy.abs(r) * numpy.sqrt(degrees / (1. - r ** 2))
+        probabilities = 2. * stats.t.sf(t, degrees)
+    probabilities = numpy.where(numpy.abs(r) == 1., 0., probabilities)
+    return ma.array(probabilities,
+                    mask=ma.getmaskarray(coefficients) | (degrees <= 0))
+
+
+def calc_wet_day_percentile(array, percentile=95., wet_day=1.):
+    ''' Calculate a percentile of the wet day precipitation at every grid
+    point
+
+    The wet days of all grid points are partially sorted at once with
+    numpy.partition, and the percentile is interpolated linearly between
+    the closest ranks, as numpy.percentile does.
+
+    :param array: a (time, ...) array of daily precipitation
+    :type array: :class:'numpy.ma.core.MaskedArray'
+
+    :param percentile: the percentile to calculate, between 0 and 100
+    :type percentile: 'float'
+
+    :param wet_day: the minimum precipitation of a wet day
+    :type wet_day: 'float'
+
+    :returns: the percentile of every grid point, masked where there are no
+        wet days
+    :rtype: :class:'numpy.ma.core.MaskedArray'
+    '''
+    array = ma.asarray(array)
+    nt = array.shape[0]
+    wet = (~ma.getmaskarray(array) & (array.filled(0) >= wet_day)) \
+        .reshape(nt, -1)
+    values = numpy.where(wet, array.filled(0).reshape(nt, -1),
+                         numpy.inf).astype(numpy.float64)
+    count = wet.sum(axis=0)
+    position = percentile / 100. * numpy.maximum(count - 1, 0)
+    lower = numpy.floor(position).astype(int)
+    upper = numpy.ceil(position).astype(int)
+    ranks = numpy.unique(numpy.concatenate([lower, upper]))
+    if nt:
+        # The dry days, at infinity, are sorted after the wet days.
+        values = numpy.partition(values, ranks, axis=0)
+    else:
+        values = numpy.zeros((1, values.shape[1]))
+    cells = numpy.arange(values.shape[1])
+    lower_values = values[lower, cells]
+    upper_values = values[upper, cells]
+    with numpy.errstate(invalid='ignore'):
+        result = lower_values + (upper_values - lower_values) * \
+            (position - lower)
+    return ma.array(numpy.where(count > 0, result, 0.),
+                    mask=count == 0).reshape(array.shape[1:])
+
+
+def _calc_total_above(array, wet_day, threshold):
+    ''' Calculate the total of the wet days above threshold at every grid
+    point.'''
+    values = array.filled(0)
+    return numpy.where((values >= wet_day) & (values > threshold),
+                       values, 0.).sum(axis=0, dtype=numpy.float64)
+
+
+def _calc_rolling_sum_maximum(array, days):
+    ''' Calculate the maximum sum of consecutive days at every grid point
+    from the differences of the cumulative sums, leaving out the windows with
+    masked days.'''
+    array = ma.asarray(array)
+    if array.shape[0] < days:
+        return ma.masked_all(array.shape[1:])
+    padding = ((1, 0),) + ((0, 0),) * (array.ndim - 1)
+    sums = numpy.cumsum(numpy.pad(array.filled(0).astype(numpy.float64),
+                                  padding, 'constant'), axis=0)
+    masked = numpy.cumsum(numpy.pad(ma.getmaskarray(array).astype(int),
+                                    padding, 'constant'), axis=0)
+    complete = masked[days:] == masked[:-days]
+    window_sums = numpy.where(complete, sums[days:] - sums[:-days],
+                              -numpy.inf)
+    return ma.array(window_sums.max(axis=0), mask=~complete.any(axis=0))
+
+
 def calc_rmse(target_array, reference_array):
     ''' Calculate ratio of standard deivations of the two arrays
 
@@ -398,7 +1703,42 @@ def calc_rmse(target_array, reference_array):
     :rtype: :class:'float'
     '''
 
-    return (ma.mean((calc_bias(target_array, reference_array))**2))**0.5
+    return (ma.mean((calc_bias(target_array, reference_array))**2,
+                    dtype=numpy.float64))**0.5
+
+
+def _stack_values(target_datasets):
+    ''' Stack the values of target datasets along a leading model axis
+
+    :param target_datasets: The target datasets, or their stacked values.
+    :type target_datasets: :class:`list` of :class:`dataset.Dataset`
+
+    :returns: The (model, time, ...) values of the datasets.
+    :rtype: :class:'numpy.ma.core.MaskedArray'
+    '''
+    if isinstance(target_datasets, numpy.ndarray):
+        return ma.asarray(target_datasets)
+    return ma.stack([ma.asarray(dataset.values)
+                     for dataset in target_datasets])
+
+
+def _iter_value_chunks(time_chunk, *datasets):
+    ''' Iterate over matching blocks of times of the datasets' values
+
+    :param time_chunk: The number of times in each block.
+    :type time_chunk: 'int'
+
+    :returns: A generator of lists with a masked array of values for each
+        dataset.
+
+    :raises ValueError: If the datasets don't have the same number of times.
+    '''
+    if len(set(len(dataset.times) for dataset in datasets)) > 1:
+        raise ValueError('The datasets must have the same number of times.')
+
+    for chunks in zip(*[dataset.iter_chunks(time_chunk)
+                        for dataset in datasets]):
+        yield [ma.asarray(chunk.values) for chunk in chunks]
 
 
 def calc_histogram_overlap(hist1, hist2):
@@ -409,20 +1749,25 @@ def calc_histogram_overlap(hist1, hist2):
     :type hist2: :class:'numpy.ndarray'
     '''
 
-    hist1_flat = hist1.flatten()
-    hist2_flat = hist2.flatten()
+    hist1_flat = numpy.ravel(hist1)
+    hist2_flat = numpy.ravel(hist2)
 
     if len(hist1_flat) != len(hist2_flat):
         err = "The two histograms have different sizes"
         raise ValueError(err)
-    overlap = 0.
-    for ii in numpy.arange(len(hist1_flat)):
-        overlap = overlap + numpy.min([hist1_flat[ii], hist2_flat[ii]])
-    return overlap
+    return numpy.minimum(hist1_flat, hist2_flat).sum()
 
 
-def calc_joint_histogram(data_array1, data_array2, bins_for_data1, bins_for_data2):
+def calc_joint_histogram(data_array1, data_array2, bins_for_data1, bins_for_data2,
+                         histogram=None):
     ''' Calculate a joint histogram of two variables in data_array1 and data_array2
+
+    The bins are counted like numpy.histogram2d: each bin includes its lower
+    edge, the last one its upper edge as well, and values outside the bins or
+    masked in either array are left out. Passing the histogram of previous
+    blocks of times adds the counts of these arrays to it, so a large sample
+    can be binned one block at a time.
+
     :param data_array1: the first variable
     :type data_array1: :class:'numpy.ma.core.MaskedArray'
     :param data_array2: the second variable
@@ -431,24 +1776,53 @@ def calc_joint_histogram(data_array1, data_array2, bins_for_data1, bins_for_data
     :type bins_for_data1: :class:'numpy.ndarray'
     :param bins_for_data2: histogram bin edges for data_array2
     :type bins_for_data2: :class:'numpy.ndarray'
-    '''
-    if ma.count_masked(data_array1) != 0 or ma.count_masked(data_array2) != 0:
-        index = numpy.where((data_array1.mask == False) &
-                            (data_array2.mask == False))
-        new_array1 = data_array1[index]
-        new_array2 = data_array2[index]
-    else:
-        new_array1 = data_array1.flatten()
-        new_array2 = data_array2.flatten()
+    :param histogram: (optional) the joint histogram of previous blocks, to
+        which the counts are added
+    :type histogram: :class:'numpy.ndarray'
 
-    histo2d, xedge, yedge = numpy.histogram2d(new_array1, new_array2, bins=[
-                                              bins_for_data1, bins_for_data2])
-    return histo2d
+    :returns: the joint histogram, of shape (len(bins_for_data1) - 1,
+        len(bins_for_data2) - 1)
+    :rtype: :class:'numpy.ndarray'
 
-
-def wet_spell_analysis(reference_array, threshold=0.1, nyear=1, dt=3.):
+    :raises ValueError: if the bin edges decrease or the arrays have
+        different shapes
+    '''
+    if numpy.shape(data_array1) != numpy.shape(data_array2):
+        raise ValueError('The two arrays have different shapes')
+
+    valid = ~(ma.getmaskarray(data_array1).ravel() |
+              ma.getmaskarray(data_array2).ravel())
+    bin_indices = []
+    for data_array, bins in [(data_array1, bins_for_data1),
+                             (data_array2, bins_for_data2)]:
+        bins = numpy.asarray(bins, dtype=numpy.float64)
+        if numpy.any(numpy.diff(bins) < 0):
+            raise ValueError('The bin edges must increase monotonically')
+        values = ma.getdata(data_array).ravel()
+        index = numpy.searchsorted(bins, values, side='right') - 1
+        index[values == bins[-1]] = len(bins) - 2
+        valid &= (index >= 0) & (index < len(bins) - 1)
+        bin_indices.append(index)
+
+    shape = (len(bins_for_data1) - 1, len(bins_for_data2) - 1)
+    flat_index = bin_indices[0][valid] * shape[1] + bin_indices[1][valid]
+    counts = numpy.bincount(flat_index, minlength=shape[0] * shape[1]) \
+        .reshape(shape).astype(numpy.float64)
+    if histogram is not None:
+        counts += histogram
+    return counts
+
+
+def wet_spell_analysis(reference_array, threshold=0.1, nyear=1, dt=3.,
+                       summary=False):
     ''' Characterize wet spells using sub-daily (hourly) data
 
+    A wet spell is a run of consecutive times above threshold, preceded and
+    followed by a valid time at or below threshold within the same period.
+    Spells cut by the start or end of a period and spells containing masked
+    values are left out. The spells of all grid points are found at once
+    from the run-length encoding of the wet times.
+
     :param reference_array: an array to be analyzed
     :type reference_array: :class:'numpy.ma.core.MaskedArray'
 
@@ -460,38 +1834,72 @@ def wet_spell_analysis(reference_array, threshold=0.1, nyear=1, dt=3.):
 
     :param dt: the temporal resolution of reference_array
     :type dt: 'float'
+
+    :param summary: if True, also return a dictionary of per grid point
+        fields: 'count', the number of spells, and 'mean_duration',
+        'max_duration', 'mean_peak', 'max_peak' and 'mean_total', masked
+        where there are no spells
+    :type summary: 'bool'
+
+    :returns: the duration, peak rainfall and total rainfall of the spells of
+        all grid points, ordered by grid point, then time
+    :rtype: 'tuple' of :class:'numpy.ndarray'
     '''
+    reference_array = ma.asarray(reference_array)
     nt = reference_array.shape[0]
-    if reference_array.ndim == 3:
-        reshaped_array = reference_array.reshape([nt, reference_array.size / nt])
-    else:
-        reshaped_array = reference_array
-    if ma.count_masked(reshaped_array[0,:]) != 0:
-        xy_indices = numpy.where(reshaped_array.mask[0, :] == False)[0]
+    grid_shape = reference_array.shape[1:]
+    nt_each_year = nt // nyear
+
+    # One row of times for each grid point and period, in that order.
+    def periods(array):
+        array = array[:nt_each_year * nyear].reshape(nyear, nt_each_year, -1)
+        return array.transpose(2, 0, 1).reshape(-1, nt_each_year)
+    values = periods(reference_array.filled(0))
+    mask = periods(ma.getmaskarray(reference_array))
+    wet = mask | (values > threshold)
+
+    # The spells start where the padded wet array rises and end (exclusive)
+    # where it falls. Rows are scanned in order, so the starts and ends pair
+    # up.
+    edges = numpy.diff(numpy.pad(wet.astype(numpy.int8), ((0, 0), (1, 1)),
+                                 'constant'), axis=1)
+    rows, starts = numpy.nonzero(edges == 1)
+    ends = numpy.nonzero(edges == -1)[1]
+    masked_counts = numpy.pad(mask.cumsum(axis=1), ((0, 0), (1, 0)),
+                              'constant')
+    complete = ((starts > 0) & (ends < nt_each_year) &
+                (masked_counts[rows, ends] == masked_counts[rows, starts]))
+    rows, starts, ends = rows[complete], starts[complete], ends[complete]
+
+    spell_duration = (ends - starts) * dt
+    if rows.size:
+        # Segmented reductions over [start, end) of the flattened rows
+        bounds = numpy.column_stack([rows * nt_each_year + starts,
+                                     rows * nt_each_year + ends]).ravel()
+        flat_values = values.ravel()
+        peak_rainfall = numpy.maximum.reduceat(flat_values, bounds)[::2]
+        total_rainfall = numpy.add.reduceat(flat_values, bounds)[::2]
     else:
-        xy_indices = numpy.arange(reshaped_array.shape[1])
-
-    nt_each_year = nt / nyear
-    spell_duration = []
-    peak_rainfall = []
-    total_rainfall = []
-
-    for index in xy_indices:
-        for iyear in numpy.arange(nyear):
-            data0_temp = reshaped_array[nt_each_year * iyear:nt_each_year * (iyear + 1),
-                                        index]
-            # time indices when precipitation rate is smaller than the
-            # threshold [mm/hr]
-            t_index = numpy.where((data0_temp <= threshold) &
-                               (data0_temp.mask == False))[0]
-            t_index = numpy.insert(t_index, 0, 0)
-            t_index = t_index + nt_each_year * iyear
-            for it in numpy.arange(t_index.size - 1):
-                if t_index[it + 1] - t_index[it] > 1:
-                    data1_temp = data0_temp[t_index[it] + 1:t_index[it + 1]]
-                    if not ma.is_masked(data1_temp):
-                        spell_duration.append(
-                            (t_index[it + 1] - t_index[it] - 1) * dt)
-                        peak_rainfall.append(data1_temp.max())
-                        total_rainfall.append(data1_temp.sum())
-    return numpy.array(spell_duration), numpy.array(peak_rainfall), numpy.array(total_rainfall)
+        peak_rainfall = numpy.zeros(0, dtype=values.dtype)
+        total_rainfall = numpy.zeros(0, dtype=values.dtype)
+
+    if not summary:
+        return spell_duration, peak_rainfall, total_rainfall
+
+    cells = rows // nyear
+    ncells = values.shape[0] // max(nyear, 1)
+    count = numpy.bincount(cells, minlength=ncells)
+    no_spells = count == 0
+    fields = {'count': count.reshape(grid_shape)}
+    for name, spell_values in [('duration', spell_duration),
+                               ('peak', peak_rainfall),
+                               ('total', total_rainfall)]:
+        sums = numpy.bincount(cells, weights=spell_values, minlength=ncells)
+        fields['mean_' + name] = ma.array(
+            sums / numpy.maximum(count, 1), mask=no_spells).reshape(grid_shape)
+        if name != 'total':
+            maxima = numpy.full(ncells, -numpy.inf)
+            numpy.maximum.at(maxima, cells, spell_values)
+            fields['max_' + name] = ma.array(
+                maxima, mask=no_spells).reshape(grid_shape)
+    return spell_duration, peak_rainfall, total_rainfall, fields
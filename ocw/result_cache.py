@@ -0,0 +1,250 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+'''
+Classes:
+    ResultCache - Cache of metric results with an in-memory LRU tier and an
+        optional on-disk tier.
+
+Functions:
+    result_key - Key the result of a metric run on some datasets.
+
+    metric_key - Describe a metric by its class and parameters.
+'''
+
+import collections
+import datetime
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+#: Default number of results kept in memory by a ResultCache.
+DEFAULT_MAX_ENTRIES = 256
+
+#: Metric attributes which set how a result is calculated but not its value,
+#: and so are left out of the metric keys.
+EXECUTION_ATTRIBUTES = frozenset(['time_chunk'])
+
+
+class ResultCache(object):
+    '''Cache of metric results.
+
+    The most recently used results are kept in memory. When a directory is
+    given every result is also pickled to a file there, so that the results
+    outlive the process and can be shared by later evaluations.
+
+    >>> cache = ResultCache(directory='/path/to/results')
+    >>> key = result_key(metric, [ref_dataset.fingerprint(),
+    ...                           target_dataset.fingerprint()])
+    >>> result = cache.get(key)
+    >>> if result is None:
+    ...     result = metric.run(ref_dataset, target_dataset)
+    ...     cache.put(key, result)
+
+    Cached results are returned as they were stored and must not be
+    modified in place.
+    '''
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, directory=None):
+        '''Create a cache.
+
+        :param max_entries: (Optional) The number of results kept in memory.
+        :type max_entries: :class:`int`
+
+        :param directory: (Optional) The directory of the on-disk tier. It is
+            created if needed. Without a directory results are only kept in
+            memory.
+        :type directory: :mod:`string`
+
+        :raises ValueError: If max_entries is negative.
+        '''
+        if max_entries < 0:
+            raise ValueError('max_entries must not be negative. {} was given.'
+                             .format(max_entries))
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.max_entries = max_entries
+        self.directory = directory
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        '''The number of results kept in memory.'''
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        '''Get a cached result.
+
+        A result found in the on-disk tier is also kept in memory.
+
+        :param key: The key of the result, from :func:`result_key`.
+        :type key: :mod:`string`
+
+        :param default: (Optional) The value returned if the result isn't
+            cached.
+
+        :returns: The cached result, or default.
+        '''
+        with self._lock:
+            if key in self._entries:
+                result = self._entries.pop(key)
+                self._entries[key] = result
+                return result
+
+        if self.directory is None:
+            return default
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as result_file:
+                result = pickle.load(result_file)
+        except (IOError, OSError):
+            return default
+        except Exception:
+            logger.warning('Ignoring the unreadable cached result %s.', path)
+            return default
+        self._remember(key, result)
+        return result
+
+    def put(self, key, result):
+        '''Cache a result.
+
+        :param key: The key of the result, from :func:`result_key`.
+        :type key: :mod:`string`
+
+        :param result: The result to cache. It must be picklable if the cache
+            has a directory.
+        '''
+        self._remember(key, result)
+        if self.directory is None:
+            return
+
+        # The result is written to a temporary file first, so that an
+        # interrupted write isn't taken for a cached result.
+        temp_file = tempfile.NamedTemporaryFile(dir=self.directory,
+                                                delete=False)
+        try:
+            with temp_file:
+                pickle.dump(result, temp_file, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp_file.name, self._path(key))
+        except BaseException:
+            os.remove(temp_file.name)
+            raise
+
+    def clear(self):
+        '''Remove the cached results from memory and from the directory.'''
+        with self._lock:
+            self._entries.clear()
+        if self.directory is None:
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def _remember(self, key, result):
+        '''Keep a result in memory, evicting the least recently used ones.'''
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = result
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+
+def result_key(metric, fingerprints, subregion=None):
+    '''Key the result of a metric run on some datasets.
+
+    The key depends on the class and parameters of the metric, the
+    contents of the datasets and the subregion, so a result can be reused
+    whenever none of them change.
+
+    :param metric: The metric.
+    :type metric: :class:`metrics.Metric`
+
+    :param fingerprints: The :meth:`dataset.Dataset.fingerprint` of each
+        dataset the metric is run on, in order. For a subregion these are
+        the fingerprints of the datasets before they are subset.
+    :type fingerprints: :class:`list` of :mod:`string`
+
+    :param subregion: (Optional) The subregion the datasets are subset to.
+    :type subregion: :class:`dataset.Bounds`
+
+    :returns: The SHA-1 hex digest of the key.
+    :rtype: :mod:`string`
+    '''
+    key = [metric_key(metric),
+           list(fingerprints),
+           None if subregion is None else _describe(subregion)]
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')) \
+        .hexdigest()
+
+
+def metric_key(metric):
+    '''Describe a metric by its class and parameters.
+
+    :param metric: The metric.
+    :type metric: :class:`metrics.Metric`
+
+    :returns: A JSON serializable description of the metric.
+    :rtype: :class:`list`
+    '''
+    parameters = dict((name, value) for name, value in vars(metric).items()
+                      if name not in EXECUTION_ATTRIBUTES)
+    return [_class_path(metric), _describe(parameters)]
+
+
+def _describe(value):
+    '''Describe a value as JSON serializable data.'''
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_describe(item) for item in value]
+    if isinstance(value, dict):
+        return dict((str(name), _describe(item))
+                    for name, item in value.items())
+    if isinstance(value, numpy.ndarray):
+        array = numpy.ma.getdata(value)
+        digest = hashlib.sha1(numpy.ascontiguousarray(array).tobytes())
+        digest.update(numpy.packbits(numpy.ma.getmaskarray(value)).tobytes())
+        return {'dtype': str(value.dtype), 'shape': list(value.shape),
+                'sha1': digest.hexdigest()}
+    if isinstance(value, (datetime.date, datetime.timedelta)):
+        return repr(value)
+    if callable(value) and hasattr(value, '__name__'):
+        return '{}.{}'.format(getattr(value, '__module__', None),
+                              value.__name__)
+    if hasattr(value, '__dict__'):
+        return [_class_path(value), _describe(vars(value))]
+    return repr(value)
+
+
+def _class_path(value):
+    return '{}.{}'.format(type(value).__module__, type(value).__name__)
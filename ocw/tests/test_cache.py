@@ -0,0 +1,162 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Tests for cache.py, a record/replay cache of data source responses."""
+
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import ocw.data_source.cache as cache
+import ocw.data_source.rcmed as rcmed
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = cache.ResponseCache(self.directory)
+        self.requests = []
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    def opener(self, body):
+        def open_body():
+            self.requests.append(body)
+            return io.BytesIO(body)
+        return open_body
+
+    def test_record_and_replay(self):
+        url = 'http://Example.com/query?b=2&a=1'
+        response = self.cache.open(url, 'rcmed', self.opener(b'foo'))
+        self.assertEqual(response.read(), b'foo')
+        response = self.cache.open('http://example.com/query?a=1&b=2',
+                                   'rcmed', self.opener(b'bar'))
+        self.assertEqual(response.read(), b'foo')
+        self.assertEqual(self.requests, [b'foo'])
+
+        self.cache.mode = 'replay'
+        response = self.cache.open(url, 'rcmed', self.opener(b'bar'))
+        self.assertEqual(response.read(), b'foo')
+        with self.assertRaises(IOError):
+            self.cache.open(url, 'dap', self.opener(b'bar'))
+
+    def test_params(self):
+        self.cache.open('http://example.com', 'dap', self.opener(b'foo'),
+                        params={'variable': 'pr'})
+        response = self.cache.open('http://example.com', 'dap',
+                                   self.opener(b'bar'),
+                                   params={'variable': 'tas'})
+        self.assertEqual(response.read(), b'bar')
+
+    def test_expired_responses(self):
+        self.cache.ttls['rcmed'] = 0
+        self.cache.open('http://example.com', 'rcmed', self.opener(b'foo'))
+        response = self.cache.open('http://example.com', 'rcmed',
+                                   self.opener(b'bar'))
+        self.assertEqual(response.read(), b'bar')
+
+    def test_eviction(self):
+        self.cache.max_size = 8
+        self.cache.open('http://example.com/1', 'dap', self.opener(b'1234'))
+        self.cache.open('http://example.com/2', 'dap', self.opener(b'5678'))
+        # The first response was used last, so the second one is evicted.
+        self.cache.open('http://example.com/1', 'dap', self.opener(b'1234'))
+        self.cache.open('http://example.com/3', 'dap', self.opener(b'9012'))
+        self.assertEqual(self.cache.size(), 8)
+        self.cache.open('http://example.com/2', 'dap', self.opener(b'5678'))
+        self.assertEqual(self.requests, [b'1234', b'5678', b'9012', b'5678'])
+
+    def test_failed_request_is_not_cached(self):
+        def fail():
+            raise IOError('No network')
+        with self.assertRaises(IOError):
+            self.cache.open('http://example.com', 'dap', fail)
+        self.assertEqual(self.cache.size(), 0)
+
+    def test_discard(self):
+        url = 'http://example.com'
+        self.cache.open(url, 'dap', self.opener(b'foo'))
+        self.cache.mode = 'replay'
+        self.cache.discard(url, 'dap')
+        self.assertEqual(self.cache.size(), 3)
+        self.cache.mode = 'record'
+        self.cache.discard(url, 'dap')
+        self.assertEqual(self.cache.size(), 0)
+        response = self.cache.open(url, 'dap', self.opener(b'bar'))
+        self.assertEqual(response.read(), b'bar')
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            cache.ResponseCache(self.directory, mode='offline')
+
+
+class TestRCMEDReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.urlopen = rcmed.urlopen
+        self.file_path = os.path.dirname(__file__)
+        cache.enable(self.directory)
+
+    def tearDown(self):
+        cache.disable()
+        rcmed.urlopen = self.urlopen
+        shutil.rmtree(self.directory)
+
+    def test_replay_metadata(self):
+        rcmed.urlopen = lambda url: open(os.path.join(
+            self.file_path, 'parameters_metadata_text.txt'), 'rb')
+        metadata = rcmed.get_parameters_metadata()
+
+        def offline(url):
+            raise IOError('No network')
+        rcmed.urlopen = offline
+        cache.enable(self.directory, mode='replay')
+        self.assertEqual(rcmed.get_parameters_metadata(), metadata)
+        with open(os.path.join(self.file_path,
+                               'parameters_metadata_output.p'), 'rb') as meta:
+            self.assertEqual(metadata, pickle.load(meta))
+
+    def test_malformed_response_is_discarded(self):
+        bodies = [b'meta: \r\ndata: \r\n0.5,1.5,0',
+                  b'meta: \r\ndata: \r\n0.5,1.5,0,2000-01-01 00:00:00,1\r\n']
+        responses = []
+
+        def urlopen(url):
+            responses.append(io.BytesIO(bodies[len(responses)]))
+            return responses[-1]
+        rcmed.urlopen = urlopen
+        with self.assertRaises(ValueError):
+            rcmed._get_data('http://example.com/query')
+        # The malformed response isn't replayed from the cache.
+        values = rcmed._get_data('http://example.com/query')[3]
+        self.assertEqual(list(values), [1.])
+        self.assertEqual(len(responses), 2)
+        self.assertTrue(all(response.closed for response in responses))
+        values = rcmed._get_data('http://example.com/query')[3]
+        self.assertEqual(list(values), [1.])
+        self.assertEqual(len(responses), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Tests for catalog.py, a SQLite index of local netCDF files."""
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import netCDF4
+import numpy as np
+
+from ocw.data_source.catalog import Catalog, load_dataset
+
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        create_netcdf_file(self.directory, 'pr_1.nc', 'pr', 0)
+        create_netcdf_file(self.directory, 'pr_2.nc', 'pr', 31)
+        create_netcdf_file(self.directory, 'tas_1.nc', 'tas', 0)
+        with open(os.path.join(self.directory, 'broken.nc'), 'w') as bad:
+            bad.write('not a netCDF file')
+        self.catalog_path = os.path.join(self.directory, 'catalog.db')
+        self.catalog = Catalog(self.catalog_path)
+        self.catalog.scan(self.directory)
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.directory)
+
+    def test_incremental_scan(self):
+        self.assertEqual(self.catalog.scan(self.directory), 0)
+        path = os.path.join(self.directory, 'tas_1.nc')
+        os.utime(path, (0, 0))
+        self.assertEqual(self.catalog.scan(self.directory), 1)
+
+    def test_removed_files(self):
+        os.remove(os.path.join(self.directory, 'tas_1.nc'))
+        self.catalog.scan(self.directory)
+        self.assertEqual(self.catalog.variables(), ['pr'])
+
+    def test_file_metadata(self):
+        metadata = self.catalog.get_file(
+            os.path.join(self.directory, 'pr_1.nc'))
+        self.assertEqual(metadata['lat_name'], 'lat')
+        self.assertEqual(metadata['lon_min'], -90.)
+        self.assertEqual(metadata['lat_resolution'], 10.)
+        self.assertEqual(metadata['calendar'], '365_day')
+        self.assertEqual(metadata['time_resolution'], 'daily')
+        self.assertEqual(metadata['start_time'], '2000-01-01 00:00:00')
+        self.assertEqual(metadata['end_time'], '2000-01-31 00:00:00')
+        self.assertEqual(metadata['variables']['pr']['units'], 'mm/day')
+        self.assertTrue(metadata['variables']['time']['coordinate'])
+
+    def test_broken_file(self):
+        metadata = self.catalog.get_file(
+            os.path.join(self.directory, 'broken.nc'))
+        self.assertIsNotNone(metadata['error'])
+
+    def test_query(self):
+        files = self.catalog.query(variable='pr')
+        self.assertEqual([os.path.basename(meta['path']) for meta in files],
+                         ['pr_1.nc', 'pr_2.nc'])
+        files = self.catalog.query(
+            variable='pr', start_time=datetime.datetime(2000, 2, 1))
+        self.assertEqual([os.path.basename(meta['path']) for meta in files],
+                         ['pr_2.nc'])
+        self.assertEqual(self.catalog.query(lat_min=30), [])
+
+    def test_list_files(self):
+        files = self.catalog.list_files(self.directory, pattern='pr_*')
+        self.assertEqual([os.path.basename(path) for path in files],
+                         ['pr_1.nc', 'pr_2.nc'])
+
+    def test_load_dataset(self):
+        dataset = load_dataset(self.catalog_path, 'pr',
+                               directory=self.directory)
+        self.assertEqual(dataset.values.shape, (62, 3, 4))
+        last_time = dataset.times[-1]
+        self.assertEqual((last_time.year, last_time.month, last_time.day),
+                         (2000, 3, 3))
+
+    def test_load_missing_variable(self):
+        with self.assertRaises(ValueError):
+            load_dataset(self.catalog_path, 'uas')
+
+
+def create_netcdf_file(directory, file_name, variable_name, start_day):
+    """Create a netCDF file with 31 days of data for testing."""
+    netcdf_file = netCDF4.Dataset(os.path.join(directory, file_name), 'w')
+    netcdf_file.createDimension('time', None)
+    netcdf_file.createDimension('lat', 3)
+    netcdf_file.createDimension('lon', 4)
+    netcdf_file.createVariable('lat', 'f4', ('lat',))[:] = [-10, 0, 10]
+    netcdf_file.createVariable('lon', 'f4', ('lon',))[:] = [0, 90, 180, 270]
+    times = netcdf_file.createVariable('time', 'f8', ('time',))
+    times.units = 'days since 2000-01-01'
+    times.calendar = 'noleap'
+    times[:] = np.arange(start_day, start_day + 31)
+    values = netcdf_file.createVariable(variable_name, 'f4',
+                                        ('time', 'lat', 'lon'))
+    values.units = 'mm/day'
+    values[:] = np.ones((31, 3, 4))
+    netcdf_file.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
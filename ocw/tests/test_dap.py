@@ -17,8 +17,15 @@
 
 import unittest
 import datetime as dt
+import shutil
+import tempfile
+import numpy as np
+import pydap.client
+from pydap.handlers.lib import BaseHandler
+from pydap.model import BaseType, DatasetType
+import ocw.data_source.cache as cache
 import ocw.data_source.dap as dap
-from ocw.dataset import Dataset
+from ocw.dataset import Bounds, Dataset
 
 
 class TestDap(unittest.TestCase):
@@ -72,5 +79,63 @@ class TestDap(unittest.TestCase):
         self.assertEquals(self.dataset.origin['source'], 'dap')
         self.assertEquals(self.dataset.origin['url'], self.url)
 
+class TestLocalDap(unittest.TestCase):
+
+    def setUp(self):
+        self.values = np.arange(200.).reshape(10, 5, 4)
+        dataset = DatasetType('test')
+        dataset['time'] = BaseType('time', np.arange(10.), dims=('time',),
+                                   units='days since 2000-01-01',
+                                   calendar='noleap')
+        dataset['lat'] = BaseType('lat', np.arange(-2., 3.), dims=('lat',))
+        dataset['lon'] = BaseType('lon', np.arange(0., 4.), dims=('lon',))
+        dataset['pr'] = BaseType('pr', self.values,
+                                 dims=('time', 'lat', 'lon'))
+        self.application = BaseHandler(dataset)
+        self.open_url = dap.open_url
+        dap.open_url = lambda url: pydap.client.open_url(
+            url, application=self.application)
+
+    def tearDown(self):
+        dap.open_url = self.open_url
+
+    def test_time_chunks(self):
+        dataset = dap.load('http://localhost/', 'pr', time_chunk=3)
+        np.testing.assert_array_equal(dataset.values, self.values)
+        self.assertEqual(dataset.times[-1].calendar, 'noleap')
+        self.assertEqual(dataset.times[-1].day, 10)
+
+    def test_bounds(self):
+        bounds = Bounds(lat_min=-1, lat_max=1, lon_min=1, lon_max=2,
+                        start=dt.datetime(2000, 1, 3),
+                        end=dt.datetime(2000, 1, 8))
+        dataset = dap.load('http://localhost/', 'pr', bounds=bounds,
+                           time_chunk=4)
+        np.testing.assert_array_equal(dataset.lats, [-1, 0, 1])
+        np.testing.assert_array_equal(dataset.lons, [1, 2])
+        self.assertEqual(len(dataset.times), 6)
+        np.testing.assert_array_equal(dataset.values,
+                                      self.values[2:8, 1:4, 1:3])
+
+    def test_cached_load(self):
+        directory = tempfile.mkdtemp()
+        cache.enable(directory)
+        try:
+            dataset = dap.load('http://localhost/', 'pr', time_chunk=3)
+            dap.open_url = None
+            cached_dataset = dap.load('http://localhost/', 'pr',
+                                      time_chunk=3)
+        finally:
+            cache.disable()
+            shutil.rmtree(directory)
+        np.testing.assert_array_equal(cached_dataset.values, self.values)
+        np.testing.assert_array_equal(cached_dataset.times, dataset.times)
+
+    def test_empty_bounds(self):
+        bounds = Bounds(lat_min=10, lat_max=20)
+        with self.assertRaises(ValueError):
+            dap.load('http://localhost/', 'pr', bounds=bounds)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -17,9 +17,15 @@
 
 '''Unit tests for the Dataset.py module'''
 
+import os
+import shutil
+import tempfile
 import unittest
-from ocw.dataset import Dataset, Bounds
+from ocw.dataset import Dataset, Bounds, TimeIndex
+import cftime
+import netCDF4
 import numpy as np
+import numpy.ma as ma
 import datetime as dt
 
 
@@ -63,6 +69,13 @@ class TestDatasetAttributes(unittest.TestCase):
     def test_origin(self):
         self.assertEqual(self.test_dataset.origin, self.origin)
 
+    def test_dtype(self):
+        float_dataset = Dataset(self.lat, self.lon, self.time, self.value,
+                                dtype='float32')
+        self.assertEqual(float_dataset.values.dtype, np.float32)
+        self.assertEqual(float_dataset.dtype, np.float32)
+        self.assertIsNone(self.test_dataset.dtype)
+
 
 class TestInvalidDatasetInit(unittest.TestCase):
 
@@ -122,6 +135,11 @@ class TestInvalidDatasetInit(unittest.TestCase):
         ds = Dataset(self.lat[::-1], self.lon, self.time, self.value)
         np.testing.assert_array_equal(ds.lats, self.lat)
 
+    def test_invalid_dtype(self):
+        with self.assertRaises(ValueError):
+            Dataset(self.lat, self.lon, self.time, self.value,
+                    dtype='int32')
+
 
 class TestDatasetFunctions(unittest.TestCase):
 
@@ -187,6 +205,35 @@ class TestDatasetFunctions(unittest.TestCase):
                                     self.value, self.variable)
         self.assertEqual(self.test_dataset.temporal_resolution(), 'yearly')
 
+    def test_cached_boundaries_reset_on_assignment(self):
+        self.assertEqual(self.test_dataset.spatial_boundaries()[0], 10)
+        self.test_dataset.lats = self.lat + 10
+        self.assertEqual(self.test_dataset.spatial_boundaries()[0], 20)
+
+    def test_cached_temporal_values_reset_on_assignment(self):
+        self.assertEqual(self.test_dataset.temporal_resolution(), 'monthly')
+        self.test_dataset.times = np.array(
+            [dt.datetime(2000, 1, x) for x in range(1, 13)])
+        self.assertEqual(self.test_dataset.temporal_resolution(), 'daily')
+        self.assertEqual(self.test_dataset.temporal_boundaries()[1],
+                         dt.datetime(2000, 1, 12))
+
+    def test_fingerprint(self):
+        same_dataset = Dataset(self.lat, self.lon, self.time,
+                               self.value.copy(), self.variable, name='copy')
+        self.assertEqual(self.test_dataset.fingerprint(),
+                         same_dataset.fingerprint())
+        same_dataset.values = ma.array(self.value, mask=self.value == 0)
+        self.assertNotEqual(self.test_dataset.fingerprint(),
+                            same_dataset.fingerprint())
+        fingerprint = same_dataset.fingerprint()
+        same_dataset.values[0, 0, 1] += 1
+        self.assertNotEqual(same_dataset.fingerprint(), fingerprint)
+        other_variable = Dataset(self.lat, self.lon, self.time,
+                                 self.value, 'temp')
+        self.assertNotEqual(self.test_dataset.fingerprint(),
+                            other_variable.fingerprint())
+
     def test_str_(self):
         dataset = self.test_dataset
         lat_min, lat_max, lon_min, lon_max = dataset.spatial_boundaries()
@@ -215,6 +262,142 @@ class TestDatasetFunctions(unittest.TestCase):
         self.assertEqual(str(self.test_dataset), output)
 
 
+class TestDatasetChunks(unittest.TestCase):
+
+    def setUp(self):
+        self.lat = np.array([10, 12, 14, 16, 18])
+        self.lon = np.array([100, 102, 104, 106, 108])
+        self.time = np.array([dt.datetime(2000, x, 1) for x in range(1, 13)])
+        flat_array = np.array(range(300))
+        self.value = flat_array.reshape(12, 5, 5)
+        self.test_dataset = Dataset(self.lat, self.lon, self.time,
+                                    self.value, variable='prec', name='foo')
+
+    def test_iter_chunks(self):
+        chunks = list(self.test_dataset.iter_chunks(5))
+        self.assertEqual([len(chunk.times) for chunk in chunks], [5, 5, 2])
+        np.testing.assert_array_equal(
+            np.concatenate([chunk.values for chunk in chunks]), self.value)
+        np.testing.assert_array_equal(
+            np.concatenate([chunk.times for chunk in chunks]), self.time)
+        self.assertEqual(chunks[0].variable, 'prec')
+        self.assertEqual(chunks[0].name, 'foo')
+
+    def test_invalid_time_chunk(self):
+        with self.assertRaises(ValueError):
+            list(self.test_dataset.iter_chunks(0))
+
+
+class TestDatasetStore(unittest.TestCase):
+
+    def setUp(self):
+        self.lat = np.array([10, 12, 14, 16, 18])
+        self.lon = np.array([100, 102, 104, 106, 108])
+        self.time = np.array([dt.datetime(2000, x, 1) for x in range(1, 13)])
+        self.value = ma.array(np.arange(300.).reshape(12, 5, 5))
+        self.value[3, 2, 1] = ma.masked
+        self.test_dataset = Dataset(self.lat, self.lon, self.time,
+                                    self.value, variable='prec', units='mm',
+                                    name='foo', origin={'path': '/foo.nc'})
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'store')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assert_datasets_equal(self, dataset, expected):
+        np.testing.assert_array_equal(dataset.lats, expected.lats)
+        np.testing.assert_array_equal(dataset.lons, expected.lons)
+        np.testing.assert_array_equal(dataset.times, expected.times)
+        np.testing.assert_array_equal(dataset.values, expected.values)
+        np.testing.assert_array_equal(ma.getmaskarray(dataset.values),
+                                      ma.getmaskarray(expected.values))
+        self.assertEqual(dataset.variable, expected.variable)
+        self.assertEqual(dataset.units, expected.units)
+        self.assertEqual(dataset.name, expected.name)
+        self.assertEqual(dataset.origin, expected.origin)
+
+    def test_memory_mapped_store(self):
+        self.test_dataset.save_store(self.path, time_chunk=5)
+        dataset = Dataset.open_store(self.path)
+        self.assertIsInstance(ma.getdata(dataset.values), np.memmap)
+        self.assert_datasets_equal(dataset, self.test_dataset)
+
+    def test_compressed_store(self):
+        self.test_dataset.save_store(self.path, time_chunk=5, compress=True)
+        dataset = Dataset.open_store(self.path)
+        self.assertEqual(len([name for name in os.listdir(self.path)
+                              if name.endswith('.npz')]), 3)
+        self.assert_datasets_equal(dataset, self.test_dataset)
+
+    def test_cftime_store(self):
+        self.test_dataset.times = netCDF4.num2date(
+            np.arange(12) * 30, 'days since 2001-01-01', calendar='360_day')
+        self.test_dataset.save_store(self.path)
+        dataset = Dataset.open_store(self.path, mmap=False)
+        self.assertNotIsInstance(dataset.values, np.memmap)
+        self.assert_datasets_equal(dataset, self.test_dataset)
+
+    def test_gregorian_cftime_store(self):
+        self.test_dataset.times = np.array(
+            [cftime.DatetimeGregorian(2000, x, 1) for x in range(1, 13)])
+        self.test_dataset.save_store(self.path)
+        dataset = Dataset.open_store(self.path)
+        self.assert_datasets_equal(dataset, self.test_dataset)
+        self.assertEqual(dataset.times[0].year, 2000)
+        self.assertIsInstance(dataset.times[0], cftime.DatetimeGregorian)
+        self.assertFalse(dataset.times[0].has_year_zero)
+
+    def test_noleap_cftime_store(self):
+        self.test_dataset.times = netCDF4.num2date(
+            np.arange(12) * 31, 'days since 2001-01-01', calendar='noleap')
+        self.test_dataset.save_store(self.path)
+        dataset = Dataset.open_store(self.path)
+        self.assert_datasets_equal(dataset, self.test_dataset)
+        for time, expected in zip(dataset.times, self.test_dataset.times):
+            self.assertIs(type(time), type(expected))
+            self.assertEqual(time.has_year_zero, expected.has_year_zero)
+
+    def test_missing_store(self):
+        with self.assertRaises(ValueError):
+            Dataset.open_store(self.path)
+
+
+class TestTimeIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.time = np.array([dt.datetime(2000, x, 1) for x in range(1, 13)])
+        self.lat = np.array([10, 12, 14, 16, 18])
+        self.lon = np.array([100, 102, 104, 106, 108])
+        self.value = np.array(range(300)).reshape(12, 5, 5)
+        self.test_dataset = Dataset(self.lat, self.lon, self.time, self.value)
+
+    def test_fields(self):
+        time_index = self.test_dataset.time_index
+        np.testing.assert_array_equal(time_index.month, range(1, 13))
+        np.testing.assert_array_equal(time_index.year, [2000] * 12)
+        self.assertEqual(time_index.doy[2], 61)
+
+    def test_offsets_are_monotonic(self):
+        self.assertTrue((np.diff(self.test_dataset.time_index.offsets) > 0).all())
+
+    def test_months_in(self):
+        np.testing.assert_array_equal(
+            self.test_dataset.time_index.months_in([12, 1, 2]), [0, 1, 11])
+
+    def test_unsorted_boundaries(self):
+        time_index = TimeIndex(self.time[::-1])
+        self.assertEqual(time_index.start_index(), 11)
+        self.assertEqual(time_index.end_index(), 0)
+
+    def test_cache_reset_on_times_assignment(self):
+        time_index = self.test_dataset.time_index
+        self.assertIs(self.test_dataset.time_index, time_index)
+        self.test_dataset.times = np.array(
+            [dt.datetime(2001, x, 1) for x in range(1, 13)])
+        self.assertEqual(self.test_dataset.time_index.year[0], 2001)
+
+
 class TestBounds(unittest.TestCase):
 
     def setUp(self):
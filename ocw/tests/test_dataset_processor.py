@@ -19,9 +19,12 @@ import unittest
 import datetime
 import os
 
+from ocw import config
 from ocw import dataset_processor as dp
 from ocw import dataset as ds
 from ocw.data_source import local
+import cftime
+import netCDF4
 import numpy as np
 import numpy.ma as ma
 
@@ -272,6 +275,16 @@ class TestTemporalRebin(unittest.TestCase):
         np.testing.assert_array_equal(
             annual_dataset.times, self.ten_year_annual_times)
 
+    def test_rebin_in_chunks(self):
+        for resolution in ['full', 'annual', 'monthly', 'daily']:
+            expected = dp.temporal_rebin(
+                self.two_years_daily_dataset, resolution)
+            chunked = dp.temporal_rebin(
+                self.two_years_daily_dataset, resolution, time_chunk=100)
+            np.testing.assert_array_equal(chunked.times, expected.times)
+            np.testing.assert_array_almost_equal(chunked.values,
+                                                 expected.values)
+
     def test_monthly_to_full_rebin(self):
         full_dataset = dp.temporal_rebin(self.ten_year_monthly_dataset, "full")
         full_times = [datetime.datetime(2005, 1, 1)]
@@ -334,6 +347,30 @@ class TestTemporalRebin(unittest.TestCase):
             dp.temporal_rebin(self.two_years_daily_dataset, "days")
 
 
+class TestDtypePolicy(unittest.TestCase):
+
+    def tearDown(self):
+        config.set_dtype('float64')
+
+    def test_dataset_dtype_is_propagated(self):
+        dataset = ten_year_monthly_dataset()
+        dataset = ds.Dataset(dataset.lats, dataset.lons, dataset.times,
+                             dataset.values, dtype='float32')
+        annual_dataset = dp.temporal_rebin(dataset, 'annual')
+        self.assertEqual(annual_dataset.values.dtype, np.float32)
+        self.assertEqual(annual_dataset.dtype, np.float32)
+
+    def test_package_dtype(self):
+        config.set_dtype('float32')
+        annual_dataset = dp.temporal_rebin(ten_year_monthly_dataset(),
+                                           'annual')
+        self.assertEqual(annual_dataset.values.dtype, np.float32)
+
+    def test_invalid_package_dtype(self):
+        with self.assertRaises(ValueError):
+            config.set_dtype('int16')
+
+
 class TestRcmesSpatialRegrid(unittest.TestCase):
 
     def test_return_array_shape(self):
@@ -428,6 +465,60 @@ class TestNormalizeDatasetDatetimes(unittest.TestCase):
         # Check that all the days have been shifted to the first of the month
         self.assertTrue(all(x.hour == 0 for x in new_ds.times))
 
+    def test_hourly(self):
+        self.daily_dataset.times = np.array([
+            datetime.datetime(2001, 1, 1, hour, 30)
+            for hour in range(24)])
+        self.daily_dataset.values = self.daily_dataset.values[:24]
+        new_ds = dp.normalize_dataset_datetimes(self.daily_dataset, 'hourly')
+        self.assertTrue(all(x.minute == 0 for x in new_ds.times))
+        self.assertEqual([x.hour for x in new_ds.times], list(range(24)))
+
+    def test_yearly(self):
+        new_ds = dp.normalize_dataset_datetimes(self.monthly_dataset, 'yearly')
+        self.assertEqual(new_ds.times[13], datetime.datetime(2001, 1, 1))
+
+    def test_calendar_is_kept(self):
+        self.monthly_dataset.times = netCDF4.num2date(
+            np.arange(120) * 30 + 14, 'days since 2000-01-01',
+            calendar='noleap')
+        new_ds = dp.normalize_dataset_datetimes(
+            self.monthly_dataset, 'monthly')
+        self.assertEqual(new_ds.times[0].calendar, 'noleap')
+        self.assertTrue(all(x.day == 1 for x in new_ds.times))
+
+    def test_standard_cftimes_are_kept(self):
+        self.monthly_dataset.times = netCDF4.num2date(
+            np.arange(120) * 30 + 14.5, 'days since 2000-01-01',
+            calendar='standard', only_use_cftime_datetimes=True)
+        new_ds = dp.normalize_dataset_datetimes(
+            self.monthly_dataset, 'daily')
+        self.assertIsInstance(new_ds.times[0], cftime.DatetimeGregorian)
+        self.assertEqual(new_ds.times[0],
+                         cftime.DatetimeGregorian(2000, 1, 15))
+
+    def test_360_day_times_are_kept(self):
+        self.monthly_dataset.times = np.array([
+            cftime.Datetime360Day(year, month, 15)
+            for year in range(2000, 2010) for month in range(1, 13)])
+        new_ds = dp.normalize_dataset_datetimes(
+            self.monthly_dataset, 'monthly')
+        self.assertIsInstance(new_ds.times[0], cftime.Datetime360Day)
+        self.assertEqual(new_ds.times[13], cftime.Datetime360Day(2001, 2, 1))
+
+    def test_monthly_first_of_month_is_kept(self):
+        self.monthly_dataset.times = np.array([
+            datetime.datetime(year, month, 1 if month % 2 else 15, 12)
+            for year in range(2000, 2010) for month in range(1, 13)])
+        new_ds = dp.normalize_dataset_datetimes(
+            self.monthly_dataset, 'monthly')
+        self.assertEqual(new_ds.times[0], datetime.datetime(2000, 1, 1, 12))
+        self.assertEqual(new_ds.times[1], datetime.datetime(2000, 2, 1))
+
+    def test_invalid_timestep(self):
+        with self.assertRaises(ValueError):
+            dp.normalize_dataset_datetimes(self.monthly_dataset, 'weekly')
+
 
 class TestSubset(unittest.TestCase):
 
@@ -662,6 +753,101 @@ class TestNetCDFWrite(unittest.TestCase):
         np.testing.assert_array_equal(self.ds.times, new_ds.times)
         np.testing.assert_array_equal(self.ds.values, new_ds.values)
 
+    def test_file_write_options(self):
+        self.ds.values = self.ds.values * 1.23456
+        dp.write_netcdf(self.ds, self.file_name, dtype='f4',
+                        chunksizes=(12, 10, 20), complevel=6,
+                        least_significant_digit=2, time_chunk=7)
+        out_file = netCDF4.Dataset(self.file_name)
+        values = out_file.variables[self.ds.variable]
+        self.assertEqual(values.dtype, np.float32)
+        self.assertEqual(values.chunking(), [12, 10, 20])
+        filters = values.filters()
+        self.assertEqual(filters['complevel'], 6)
+        self.assertTrue(filters['shuffle'])
+        np.testing.assert_allclose(values[:], self.ds.values, atol=0.01)
+        out_file.close()
+
+    def test_invalid_chunksizes(self):
+        with self.assertRaises(ValueError):
+            dp.write_netcdf(self.ds, self.file_name, chunksizes=(12, 10))
+
+    def test_complevel_without_compression(self):
+        with self.assertRaises(ValueError):
+            dp.write_netcdf(self.ds, self.file_name, complevel=0)
+        dp.write_netcdf(self.ds, self.file_name, compress=False, complevel=0)
+        out_file = netCDF4.Dataset(self.file_name)
+        self.assertFalse(out_file.variables[self.ds.variable].filters()['zlib'])
+        out_file.close()
+
+
+class TestNetCDFWriteMultipleDatasets(unittest.TestCase):
+
+    def setUp(self):
+        self.ref = ten_year_monthly_dataset()
+        self.models = [ten_year_monthly_dataset() for _ in range(3)]
+        for imodel, model in enumerate(self.models):
+            model.values = model.values * imodel
+        self.model_names = ['a', 'b', 'c']
+        self.file_name = 'test_multiple.nc'
+
+    def tearDown(self):
+        if os.path.isfile(self.file_name):
+            os.remove(self.file_name)
+
+    def test_separate_variables(self):
+        dp.write_netcdf_multiple_datasets_with_subregions(
+            self.ref, 'obs', self.models, self.model_names, self.file_name)
+        out_file = netCDF4.Dataset(self.file_name)
+        np.testing.assert_array_equal(out_file.variables['c'][:],
+                                      self.models[2].values)
+        np.testing.assert_array_equal(out_file.variables['obs'][:],
+                                      self.ref.values)
+        out_file.close()
+
+    def test_model_axis(self):
+        dp.write_netcdf_multiple_datasets_with_subregions(
+            self.ref, 'obs', (model for model in self.models),
+            self.model_names, self.file_name, model_axis=True)
+        out_file = netCDF4.Dataset(self.file_name)
+        values = out_file.variables['model_values']
+        self.assertEqual(values.shape, (3, 120, 90, 180))
+        self.assertEqual(values.chunking(), [1, 100, 90, 180])
+        self.assertEqual(list(out_file.variables['model_names'][:]),
+                         self.model_names)
+        np.testing.assert_array_equal(values[1], self.models[1].values)
+        out_file.close()
+
+    def test_missing_model_names(self):
+        with self.assertRaises(ValueError):
+            dp.write_netcdf_multiple_datasets_with_subregions(
+                self.ref, 'obs', self.models, self.model_names[:2],
+                self.file_name)
+
+    def test_file_closed_on_missing_models(self):
+        with self.assertRaises(ValueError):
+            dp.write_netcdf_multiple_datasets_with_subregions(
+                self.ref, 'obs', iter(self.models[:2]), self.model_names,
+                self.file_name, model_axis=True)
+        # The file can only be opened again once it has been closed.
+        netCDF4.Dataset(self.file_name, 'w').close()
+
+    def test_model_axis_units(self):
+        for model in self.models:
+            model.units = 'mm/day'
+        dp.write_netcdf_multiple_datasets_with_subregions(
+            self.ref, 'obs', self.models, self.model_names, self.file_name,
+            model_axis=True)
+        out_file = netCDF4.Dataset(self.file_name)
+        self.assertEqual(out_file.variables['model_values'].units, 'mm/day')
+        out_file.close()
+
+        self.models[1].units = 'kg m-2 s-1'
+        with self.assertRaises(ValueError):
+            dp.write_netcdf_multiple_datasets_with_subregions(
+                self.ref, 'obs', self.models, self.model_names,
+                self.file_name, model_axis=True)
+
 
 def ten_year_monthly_dataset(latlon2d=False):
     lats = np.array(range(-89, 90, 2))
@@ -0,0 +1,184 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Tests for the ESGF file search and downloads."""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import requests
+
+import ocw.data_source.esgf as esgf
+from ocw.esgf import download
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+FILES = {
+    '/pr_1.nc': os.urandom(3000),
+    '/pr_2.nc': os.urandom(5000),
+    '/pr_3.nc': os.urandom(100),
+}
+
+
+class TestDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FileServer(('127.0.0.1', 0), FileHandler)
+        self.server.daemon_threads = True
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.directory = tempfile.mkdtemp()
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def download(self, name, **kwargs):
+        return download.download(self.url + name, toDirectory=self.directory,
+                                 session=self.session, **kwargs)
+
+    def read(self, path):
+        with open(path, 'rb') as local_file:
+            return local_file.read()
+
+    def test_download(self):
+        path = self.download('/pr_1.nc', checksum=sha256('/pr_1.nc'))
+        self.assertEqual(path, os.path.join(self.directory, 'pr_1.nc'))
+        self.assertEqual(self.read(path), FILES['/pr_1.nc'])
+
+    def test_resume(self):
+        partial_path = os.path.join(self.directory, 'pr_2.nc.part')
+        with open(partial_path, 'wb') as partial_file:
+            partial_file.write(FILES['/pr_2.nc'][:1234])
+        path = self.download('/pr_2.nc', checksum=sha256('/pr_2.nc'))
+        self.assertEqual(self.read(path), FILES['/pr_2.nc'])
+        self.assertEqual(self.server.requests, [('/pr_2.nc', 'bytes=1234-')])
+        self.assertFalse(os.path.exists(partial_path))
+
+    def test_skip_verified_file(self):
+        self.download('/pr_1.nc', checksum=sha256('/pr_1.nc'))
+        self.download('/pr_1.nc', checksum=sha256('/pr_1.nc'))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_replace_corrupt_file(self):
+        with open(os.path.join(self.directory, 'pr_1.nc'), 'wb') as bad:
+            bad.write(b'corrupt')
+        path = self.download('/pr_1.nc', checksum=sha256('/pr_1.nc'))
+        self.assertEqual(self.read(path), FILES['/pr_1.nc'])
+
+    def test_checksum_mismatch(self):
+        with self.assertRaises(ValueError):
+            self.download('/pr_1.nc', checksum=sha256('/pr_2.nc'))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_download_files(self):
+        files = [(self.url + name, sha256(name), 'SHA256')
+                 for name in sorted(FILES)]
+        paths = download.download_files(files, toDirectory=self.directory,
+                                        nworkers=3, session=self.session)
+        self.assertEqual([self.read(path) for path in paths],
+                         [FILES[name] for name in sorted(FILES)])
+
+
+class TestFileDownloadData(unittest.TestCase):
+
+    def setUp(self):
+        self.get = esgf.requests.get
+        esgf.requests.get = lambda url: FakeResponse(SEARCH_RESPONSE)
+
+    def tearDown(self):
+        esgf.requests.get = self.get
+
+    def test_checksums(self):
+        download_data = esgf._get_file_download_data('foo', 'pr')
+        self.assertEqual(download_data, [
+            ('http://esgf/pr_1.nc', 'pr', 'abc', 'MD5'),
+            ('http://esgf/pr_2.nc', 'pr', None, 'SHA256')])
+
+
+class FileServer(ThreadingMixIn, HTTPServer):
+    pass
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    # Serves FILES, with support for "bytes=<start>-" Range requests.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        content = FILES[self.path]
+        file_range = self.headers.get('Range')
+        self.server.requests.append((self.path, file_range))
+        if file_range:
+            start = int(file_range.split('=')[1].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(content) - 1, len(content)))
+            content = content[start:]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeResponse(object):
+
+    def __init__(self, content):
+        self.content = content
+
+
+SEARCH_RESPONSE = b'''<?xml version="1.0" encoding="UTF-8"?>
+<response><result name="response" numFound="2" start="0">
+<doc>
+<arr name="checksum"><str>abc</str></arr>
+<arr name="checksum_type"><str>MD5</str></arr>
+<arr name="url"><str>http://esgf/pr_1.nc|application/netcdf|HTTPServer</str></arr>
+<arr name="variable"><str>pr</str></arr>
+</doc>
+<doc>
+<arr name="url"><str>http://esgf/pr_2.nc|application/netcdf|HTTPServer</str></arr>
+<arr name="variable"><str>pr</str></arr>
+</doc>
+</result></response>
+'''
+
+
+def sha256(name):
+    return hashlib.sha256(FILES[name]).hexdigest()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,8 +21,11 @@ import unittest
 import numpy as np
 import datetime as dt
 from ocw.dataset import Dataset, Bounds
+import ocw.evaluation as evaluation
 from ocw.evaluation import Evaluation
 from ocw.metrics import Bias, TemporalStdDev
+from ocw.metrics import BinaryStatistics, PatternCorrelation, RMSError
+from ocw.result_cache import ResultCache
 
 
 class TestEvaluation(unittest.TestCase):
@@ -182,6 +185,125 @@ class TestEvaluation(unittest.TestCase):
         self.assertTrue(len(bias_eval.results) == 2)
         self.assertTrue(bias_eval.results[0].shape[0] == 3)
 
+    def test_shared_statistics(self):
+        target = Dataset(self.test_dataset.lats, self.test_dataset.lons,
+                         self.test_dataset.times,
+                         np.sqrt(self.test_dataset.values), self.other_var)
+        metrics = [RMSError(), Bias(), PatternCorrelation(time_chunk=5)]
+        new_eval = Evaluation(self.test_dataset, [target], metrics)
+        calls = []
+        from_datasets = BinaryStatistics.from_datasets
+
+        def count_calls(*args, **kwargs):
+            calls.append(kwargs)
+            return from_datasets(*args, **kwargs)
+        BinaryStatistics.from_datasets = staticmethod(count_calls)
+        try:
+            new_eval.run()
+        finally:
+            BinaryStatistics.from_datasets = from_datasets
+        self.assertEqual(calls, [{'time_chunk': 5}])
+        for metric, result in zip(metrics, new_eval.results):
+            np.testing.assert_almost_equal(
+                result[0], metric.run(self.test_dataset, target))
+
+    def test_batched_targets(self):
+        random = np.random.RandomState(1)
+        targets = [Dataset(self.test_dataset.lats, self.test_dataset.lons,
+                           self.test_dataset.times,
+                           self.test_dataset.values + random.rand(12, 5, 5),
+                           self.other_var) for _ in range(3)]
+        metrics = [Bias(), RMSError(), PatternCorrelation()]
+        new_eval = Evaluation(self.test_dataset, targets, metrics)
+        new_eval.run()
+        for metric, results in zip(metrics, new_eval.results):
+            self.assertEqual(len(results), 3)
+            for result, target in zip(results, targets):
+                np.testing.assert_almost_equal(
+                    result, metric.run(self.test_dataset, target))
+
+    def test_batches_within_memory_budget(self):
+        random = np.random.RandomState(1)
+        targets = [Dataset(self.test_dataset.lats, self.test_dataset.lons,
+                           self.test_dataset.times,
+                           self.test_dataset.values + random.rand(12, 5, 5),
+                           self.other_var) for _ in range(3)]
+        metrics = [RMSError(), PatternCorrelation()]
+        new_eval = Evaluation(self.test_dataset, targets, metrics)
+        calls = []
+        from_datasets = BinaryStatistics.from_datasets
+
+        def count_calls(ref_dataset, target_dataset, **kwargs):
+            calls.append((len(target_dataset) if isinstance(
+                target_dataset, list) else 1, kwargs['time_chunk']))
+            return from_datasets(ref_dataset, target_dataset, **kwargs)
+        BinaryStatistics.from_datasets = staticmethod(count_calls)
+        max_batch_bytes = evaluation.MAX_BATCH_BYTES
+        # Three 5 x 5 float64 datasets of a time at once.
+        evaluation.MAX_BATCH_BYTES = 3 * evaluation._BATCH_COPIES * 25 * 8
+        try:
+            new_eval.run()
+        finally:
+            BinaryStatistics.from_datasets = from_datasets
+            evaluation.MAX_BATCH_BYTES = max_batch_bytes
+        self.assertEqual(calls, [(2, 1), (1, 1)])
+        for metric, results in zip(metrics, new_eval.results):
+            for result, target in zip(results, targets):
+                np.testing.assert_almost_equal(
+                    result, metric.run(self.test_dataset, target))
+
+    def test_result_cache(self):
+        CountingBias.runs = []
+        target = Dataset(self.test_dataset.lats, self.test_dataset.lons,
+                         self.test_dataset.times,
+                         np.sqrt(self.test_dataset.values), self.other_var)
+        cache = ResultCache()
+        first_eval = Evaluation(self.test_dataset, [target],
+                                [CountingBias(), TemporalStdDev()],
+                                result_cache=cache)
+        first_eval.run()
+        self.assertEqual(len(CountingBias.runs), 1)
+
+        # Only the added metric is run.
+        new_eval = Evaluation(self.test_dataset, [target],
+                              [CountingBias(), RMSError(), TemporalStdDev()],
+                              result_cache=cache)
+        new_eval.run()
+        self.assertEqual(len(CountingBias.runs), 1)
+        self.assertEqual(len(cache), 4)
+        np.testing.assert_array_equal(new_eval.results[0],
+                                      first_eval.results[0])
+        np.testing.assert_almost_equal(new_eval.results[1][0],
+                                       RMSError().run(self.test_dataset,
+                                                      target))
+        np.testing.assert_array_equal(new_eval.unary_results[0],
+                                      first_eval.unary_results[0])
+
+        # Changed datasets are run again.
+        target.values = target.values + 1
+        new_eval.run()
+        self.assertEqual(len(CountingBias.runs), 2)
+        np.testing.assert_array_equal(
+            new_eval.results[0][0],
+            Bias().run(self.test_dataset, target))
+
+    def test_result_cache_in_place_change(self):
+        target = Dataset(self.test_dataset.lats, self.test_dataset.lons,
+                         self.test_dataset.times,
+                         np.sqrt(self.test_dataset.values), self.other_var)
+        new_eval = Evaluation(self.test_dataset, [target],
+                              [Bias(), TemporalStdDev()],
+                              result_cache=ResultCache())
+        new_eval.run()
+
+        target.values[:] += 1
+        new_eval.run()
+        np.testing.assert_array_equal(
+            new_eval.results[0][0],
+            Bias().run(self.test_dataset, target))
+        np.testing.assert_array_equal(
+            new_eval.unary_results[0][1], TemporalStdDev().run(target))
+
     def test_unary_result_shape(self):
         new_eval = Evaluation(
             self.test_dataset,
@@ -252,5 +374,15 @@ class TestEvaluation(unittest.TestCase):
         self.assertTrue(new_eval.unary_results[0][0].shape[0] == 3)
 
 
+class CountingBias(Bias):
+    # Bias which records its runs in a class attribute, so that the
+    # instances have the parameters of Bias.
+    runs = []
+
+    def run(self, ref_dataset, target_dataset):
+        CountingBias.runs.append(target_dataset)
+        return super(CountingBias, self).run(ref_dataset, target_dataset)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -25,6 +25,9 @@ except ImportError:
 import datetime
 import unittest
 import os
+import shutil
+import tempfile
+import h5py
 import netCDF4
 import numpy as np
 
@@ -317,6 +320,136 @@ class TestGetNetcdfVariableNames(unittest.TestCase):
                                                        "tasmax")
 
 
+class TestLoadGPMIMERGFiles(unittest.TestCase):
+    """Tests for load_GPM_IMERG_files method."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Prepare a directory of GPM files once to use for all tests."""
+        cls.file_path = tempfile.mkdtemp()
+        cls.values = create_GPM_files(cls.file_path, 3)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Remove the no longer needed testing files at the end of the tests."""
+        shutil.rmtree(cls.file_path)
+
+    def test_load_all_files(self):
+        dataset = local.load_GPM_IMERG_files(
+            file_path=self.file_path + '/', filename_pattern=['*.HDF5'])
+        self.assertEqual(dataset.values.shape, (3, 4, 6))
+        np.testing.assert_array_equal(dataset.values, self.values)
+        self.assertTrue(dataset.values.mask[:, 0, 0].all())
+        self.assertEqual(dataset.times[1], datetime.datetime(2015, 1, 1, 0, 30))
+
+    def test_load_spatial_window(self):
+        dataset = local.load_GPM_IMERG_files(
+            file_path=self.file_path + '/', filename_pattern=['*.HDF5'],
+            spatial_window=(-5, 5, -15, 5), nworkers=2)
+        np.testing.assert_array_equal(dataset.lats[:, 0], [-5, 5])
+        np.testing.assert_array_equal(dataset.lons[0, :], [-15, -5, 5])
+        np.testing.assert_array_equal(dataset.values,
+                                      self.values[:, 1:3, 1:4])
+
+    def test_empty_spatial_window(self):
+        with self.assertRaises(ValueError):
+            local.load_GPM_IMERG_files(
+                file_path=self.file_path + '/', filename_pattern=['*.HDF5'],
+                spatial_window=(1, 2, 1, 2))
+
+
+class TestLoadWRF2dFilesRAIN(unittest.TestCase):
+    """Tests for load_WRF_2d_files_RAIN method."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Prepare a directory of WRF files once to use for all tests."""
+        cls.file_path = tempfile.mkdtemp()
+        create_WRF_files(cls.file_path)
+        cls.dataset = local.load_WRF_2d_files_RAIN(
+            file_path=cls.file_path + '/', filename_pattern=['wrfout*'])
+
+    @classmethod
+    def tearDownClass(cls):
+        """Remove the no longer needed testing files at the end of the tests."""
+        shutil.rmtree(cls.file_path)
+
+    def test_spin_up_day_removed(self):
+        expected_times = [datetime.datetime(year, 1, 2, hour)
+                          for year in [2001, 2002] for hour in range(24)]
+        np.testing.assert_array_equal(self.dataset.times, expected_times)
+
+    def test_hourly_rates(self):
+        self.assertEqual(self.dataset.values.shape, (48, 3, 4))
+        np.testing.assert_array_equal(self.dataset.values[:24], 1.)
+        np.testing.assert_array_equal(self.dataset.values[24:], 2.)
+
+    def test_spin_up_follows_file_length(self):
+        file_path = tempfile.mkdtemp()
+        try:
+            create_WRF_files(file_path, nt_file=12)
+            dataset = local.load_WRF_2d_files_RAIN(
+                file_path=file_path + '/', filename_pattern=['wrfout*'])
+        finally:
+            shutil.rmtree(file_path)
+        expected_times = [datetime.datetime(year, 1, 2, hour)
+                          for year in [2001, 2002] for hour in range(12)]
+        np.testing.assert_array_equal(dataset.times, expected_times)
+        np.testing.assert_array_equal(dataset.values[:12], 1.)
+        np.testing.assert_array_equal(dataset.values[12:], 2.)
+
+
+def create_WRF_files(file_path, nt_file=24):
+    """Create WRF output like files with two days for each of two years.
+
+    Each file holds nt_file hours. The precipitation accumulates by 1 mm
+    every hour in 2001 and by 2 mm every hour in 2002.
+    """
+    for year in [2001, 2002]:
+        for day in [1, 2]:
+            start = datetime.datetime(year, 1, day)
+            file_name = os.path.join(
+                file_path, start.strftime('wrfout_d01_%Y-%m-%d_%H:%M:%S'))
+            netcdf_file = netCDF4.Dataset(file_name, 'w')
+            netcdf_file.createDimension('Time', nt_file)
+            netcdf_file.createDimension('south_north', 3)
+            netcdf_file.createDimension('west_east', 4)
+            dims = ('Time', 'south_north', 'west_east')
+            lons, lats = np.meshgrid(np.arange(4.), np.arange(3.))
+            netcdf_file.createVariable('XLAT', 'f4', dims)[:] = lats
+            netcdf_file.createVariable('XLONG', 'f4', dims)[:] = lons
+            hours = np.arange(nt_file) + nt_file * (day - 1.)
+            accumulation = (year - 2000) * hours[:, None, None] * \
+                np.ones((nt_file, 3, 4))
+            netcdf_file.createVariable('RAINC', 'f4', dims)[:] = \
+                accumulation / 2
+            netcdf_file.createVariable('RAINNC', 'f4', dims)[:] = \
+                accumulation / 2
+            netcdf_file.close()
+
+
+def create_GPM_files(file_path, nfile):
+    """Create GPM IMERG like HDF5 files with a (lon, lat) grid for testing."""
+    lats = np.array([-15., -5., 5., 15.])
+    lons = np.array([-25., -15., -5., 5., 15., 25.])
+    values = np.arange(nfile * 24, dtype='f4').reshape(nfile, 4, 6)
+    values[:, 0, 0] = -9999.9
+    for ifile in range(nfile):
+        start = datetime.datetime(2015, 1, 1) + \
+            datetime.timedelta(minutes=30 * ifile)
+        end = start + datetime.timedelta(minutes=29, seconds=59)
+        file_name = '3B-HHR.MS.MRG.3IMERG.{}-S{}-E{}.{:04d}.V05B.HDF5'.format(
+            start.strftime('%Y%m%d'), start.strftime('%H%M%S'),
+            end.strftime('%H%M%S'), 30 * ifile)
+        hdf_file = h5py.File(os.path.join(file_path, file_name), 'w')
+        grid = hdf_file.create_group('Grid')
+        grid['lat'] = lats
+        grid['lon'] = lons
+        grid['precipitationCal'] = values[ifile].T
+        hdf_file.close()
+    return np.ma.masked_less(values, 0.)
+
+
 def create_netcdf_file():
     """Create a temporary netCDF file with data used for testing."""
     # To create the temporary netCDF file
@@ -26,6 +26,7 @@ import ocw.metrics as metrics
 import numpy as np
 import numpy.ma as ma
 import numpy.testing as npt
+from scipy import stats
 
 
 class TestBias(unittest.TestCase):
@@ -136,6 +137,180 @@ class TestSpatialPatternTaylorDiagram(unittest.TestCase):
             self.ref_dataset, self.tar_dataset), ma.array([0.4, 1.0]))
 
 
+class TestBinaryStatistics(unittest.TestCase):
+    '''Test the metrics.BinaryStatistics accumulator.'''
+
+    def setUp(self):
+        random = np.random.RandomState(3)
+        self.ref_values = ma.array(280 + random.rand(24, 4, 5),
+                                   mask=random.rand(24, 4, 5) < 0.1)
+        self.target_values = ma.array(
+            self.ref_values + random.rand(24, 4, 5),
+            mask=random.rand(24, 4, 5) < 0.1)
+        times = np.array([dt.datetime(2000 + x // 12, x % 12 + 1, 1)
+                          for x in range(24)])
+        self.ref_dataset = Dataset(np.arange(4.), np.arange(5.), times,
+                                   self.ref_values, 'ref')
+        self.target_dataset = Dataset(np.arange(4.), np.arange(5.), times,
+                                      self.target_values, 'target')
+        valid = ~(self.ref_values.mask | self.target_values.mask)
+        self.ref_valid = ma.array(self.ref_values, mask=~valid)
+        self.target_valid = ma.array(self.target_values, mask=~valid)
+
+    def test_statistics(self):
+        statistics = metrics.BinaryStatistics.from_datasets(
+            self.ref_dataset, self.target_dataset)
+        npt.assert_almost_equal(
+            statistics.temporal_mean_bias(),
+            metrics.calc_bias(self.target_valid, self.ref_valid, True))
+        npt.assert_almost_equal(
+            statistics.rmse(),
+            metrics.calc_rmse(self.target_valid, self.ref_valid))
+        npt.assert_almost_equal(
+            statistics.stddev_ratio(),
+            metrics.calc_stddev_ratio(self.target_valid, self.ref_valid))
+        npt.assert_almost_equal(
+            statistics.pattern_correlation(),
+            metrics.calc_correlation(self.target_valid, self.ref_valid))
+
+    def test_result_dtype(self):
+        self.ref_dataset.dtype = 'float32'
+        statistics = metrics.BinaryStatistics.from_datasets(
+            self.ref_dataset, self.target_dataset)
+        self.assertEqual(statistics.temporal_mean_bias().dtype, np.float32)
+        self.assertEqual(statistics.rmse().dtype, np.float32)
+        self.assertEqual(
+            metrics.SpatialPatternTaylorDiagram().from_statistics(
+                statistics).dtype, np.float32)
+        batched = metrics.BinaryStatistics.from_datasets(
+            self.ref_dataset, [self.target_dataset, self.target_dataset])
+        self.assertEqual(batched.pattern_correlation().dtype, np.float32)
+
+    def test_chunked_statistics(self):
+        statistics = metrics.BinaryStatistics.from_datasets(
+            self.ref_dataset, self.target_dataset)
+        chunked = metrics.BinaryStatistics.from_datasets(
+            self.ref_dataset, self.target_dataset, time_chunk=5)
+        npt.assert_almost_equal(chunked.temporal_mean_bias(),
+                                statistics.temporal_mean_bias())
+        for name in ['rmse', 'stddev_ratio', 'pattern_correlation']:
+            npt.assert_almost_equal(getattr(chunked, name)(),
+                                    getattr(statistics, name)())
+
+    def test_empty_statistics(self):
+        statistics = metrics.BinaryStatistics()
+        self.assertIs(statistics.rmse(), ma.masked)
+        self.assertIs(statistics.pattern_correlation(), ma.masked)
+
+
+class TestAccumulators(unittest.TestCase):
+    '''Test calculating the metrics from blocks of times.'''
+
+    def setUp(self):
+        random = np.random.RandomState(4)
+        times = np.array([dt.datetime(2000 + x // 12, x % 12 + 1, 1)
+                          for x in range(30)])
+        self.ref_dataset = Dataset(
+            np.arange(3.), np.arange(4.), times,
+            ma.array(random.rand(30, 3, 4), mask=random.rand(30, 3, 4) < 0.1),
+            'ref')
+        self.target_dataset = Dataset(
+            np.arange(3.), np.arange(4.), times,
+            ma.array(random.rand(30, 3, 4), mask=random.rand(30, 3, 4) < 0.1),
+            'target')
+        self.binary_metrics = [
+            metrics.Bias(), metrics.AbsoluteBias(),
+            metrics.SpatialPatternTaylorDiagram(), metrics.StdDevRatio(),
+            metrics.PatternCorrelation(), metrics.TemporalMeanBias(),
+            metrics.RMSError(), metrics.TemporalCorrelation(),
+            metrics.TemporalCorrelation(p_values=True,
+                                        effective_sample_size=True)]
+
+    def assert_results_equal(self, result, expected):
+        if isinstance(expected, tuple):
+            for result_part, expected_part in zip(result, expected):
+                self.assert_results_equal(result_part, expected_part)
+        else:
+            npt.assert_array_almost_equal(result, expected)
+            npt.assert_array_equal(ma.getmaskarray(result),
+                                   ma.getmaskarray(expected))
+
+    def test_run_in_chunks(self):
+        datasets = [self.ref_dataset, self.target_dataset]
+        for metric in self.binary_metrics:
+            self.assert_results_equal(metric.run_in_chunks(datasets, 7),
+                                      metric.run(*datasets))
+        metric = metrics.TemporalStdDev()
+        self.assert_results_equal(
+            metric.run_in_chunks([self.target_dataset], 7),
+            metric.run(self.target_dataset))
+
+    def test_merge(self):
+        ref_values = self.ref_dataset.values
+        target_values = self.target_dataset.values
+        for metric in self.binary_metrics:
+            first = metric.update(metric.init(), ref_values[:11],
+                                  target_values[:11])
+            second = metric.update(metric.init(), ref_values[11:],
+                                   target_values[11:])
+            self.assert_results_equal(
+                metric.finalize(metric.merge(first, second)),
+                metric.run(self.ref_dataset, self.target_dataset))
+
+    def test_unsupported_metric(self):
+        class Custom(metrics.UnaryMetric):
+            def run(self, target_dataset):
+                return target_dataset.values
+        with self.assertRaises(NotImplementedError):
+            Custom().run_in_chunks([self.target_dataset], 7)
+
+
+class TestRunModels(unittest.TestCase):
+    '''Test running the metrics for several targets at once.'''
+
+    def setUp(self):
+        random = np.random.RandomState(7)
+        times = np.array([dt.datetime(2000 + x // 12, x % 12 + 1, 1)
+                          for x in range(24)])
+
+        def dataset(name):
+            return Dataset(np.arange(3.), np.arange(4.), times,
+                           ma.array(random.rand(24, 3, 4),
+                                    mask=random.rand(24, 3, 4) < 0.1), name)
+        self.ref_dataset = dataset('ref')
+        self.target_datasets = [dataset('model{}'.format(i))
+                                for i in range(3)]
+
+    def test_run_models(self):
+        for metric in [metrics.Bias(), metrics.AbsoluteBias(),
+                       metrics.SpatialPatternTaylorDiagram(),
+                       metrics.StdDevRatio(time_chunk=5),
+                       metrics.PatternCorrelation(),
+                       metrics.TemporalMeanBias(), metrics.RMSError(),
+                       metrics.TemporalCorrelation(p_values=True)]:
+            results = metric.run_models(self.ref_dataset,
+                                        self.target_datasets)
+            stacked_results = metric.run_models(
+                self.ref_dataset,
+                ma.stack([target.values for target in self.target_datasets]))
+            self.assertEqual(len(results), 3)
+            for result, stacked_result, target in zip(
+                    results, stacked_results, self.target_datasets):
+                expected = metric.run(self.ref_dataset, target)
+                npt.assert_array_almost_equal(result, expected)
+                npt.assert_array_almost_equal(stacked_result, expected)
+
+    def test_unsupported_stacked_values(self):
+        class Custom(metrics.BinaryMetric):
+            def run(self, ref_dataset, target_dataset):
+                return target_dataset.values - ref_dataset.values
+        metric = Custom()
+        self.assertEqual(len(metric.run_models(self.ref_dataset,
+                                               self.target_datasets)), 3)
+        with self.assertRaises(ValueError):
+            metric.run_models(self.ref_dataset, ma.zeros((3, 24, 3, 4)))
+
+
 class TestTemporalStdDev(unittest.TestCase):
     '''Test the metrics.TemporalStdDev metric.'''
 
@@ -162,6 +337,12 @@ class TestTemporalStdDev(unittest.TestCase):
         npt.assert_almost_equal(self.temporal_std_dev.run(
             self.target_dataset), expected_result)
 
+    def test_function_run_in_chunks(self):
+        '''Test TemporalStdDev reading the target dataset in chunks.'''
+        temporal_std_dev = metrics.TemporalStdDev(time_chunk=5)
+        npt.assert_almost_equal(temporal_std_dev.run(self.target_dataset),
+                                self.temporal_std_dev.run(self.target_dataset))
+
 
 class TestStdDevRatio(unittest.TestCase):
     '''Test the metrics.StdDevRatio metric'''
@@ -190,6 +371,16 @@ class TestStdDevRatio(unittest.TestCase):
         self.assertTrue(self.std_dev_ratio.run(
             self.ref_dataset, self.tar_dataset), 0.4)
 
+    def test_jointly_valid_values(self):
+        # Only the times at which both datasets are valid are used.
+        self.tar_dataset.values = ma.masked_greater(self.tar_dataset.values,
+                                                    298)
+        valid = ~ma.getmaskarray(self.tar_dataset.values)
+        npt.assert_almost_equal(
+            self.std_dev_ratio.run(self.ref_dataset, self.tar_dataset),
+            np.std(self.tar_dataset.values[valid], ddof=1) /
+            np.std(self.ref_dataset.values[valid], ddof=1))
+
 
 class TestPatternCorrelation(unittest.TestCase):
     '''Test the metrics.PatternCorrelation metric'''
@@ -272,6 +463,40 @@ class TestTemporalCorrelation(unittest.TestCase):
         tc = self.metric.run(self.ref_dataset, self.tgt_dataset_dec)
         np.testing.assert_array_equal(tc, expected_tc)
 
+    def test_masked_values(self):
+        random = np.random.RandomState(1)
+        reference = ma.array(random.rand(40, 3, 4),
+                             mask=random.rand(40, 3, 4) < 0.2)
+        target = ma.array(reference + random.rand(40, 3, 4),
+                          mask=random.rand(40, 3, 4) < 0.2)
+        target[:, 0, 0] = 1.
+        tc = metrics.calc_temporal_correlation(target, reference)
+        self.assertTrue(tc.mask[0, 0])
+        for i in range(3):
+            for j in range(4):
+                if (i, j) != (0, 0):
+                    npt.assert_almost_equal(tc[i, j], metrics.calc_correlation(
+                        target[:, i, j], reference[:, i, j]))
+
+    def test_p_values(self):
+        self.metric = metrics.TemporalCorrelation(p_values=True,
+                                                  effective_sample_size=True)
+        random = np.random.RandomState(2)
+        self.tgt_dataset_inc.values = self.ref_values + \
+            100 * random.rand(12, 5, 5)
+        tc, p_values, sample_size = self.metric.run(self.ref_dataset,
+                                                    self.tgt_dataset_inc)
+        self.assertEqual(p_values.shape, (5, 5))
+        self.assertTrue(((p_values >= 0) & (p_values <= 1)).all())
+        self.assertTrue(((sample_size >= 2) & (sample_size <= 12)).all())
+
+        tc, p_values = metrics.calc_temporal_correlation(
+            self.tgt_dataset_inc.values, self.ref_values, p_values=True)
+        expected = stats.pearsonr(self.tgt_dataset_inc.values[:, 1, 2],
+                                  self.ref_values[:, 1, 2])
+        npt.assert_almost_equal(tc[1, 2], expected[0])
+        npt.assert_almost_equal(p_values[1, 2], expected[1])
+
 
 class TestTemporalMeanBias(unittest.TestCase):
     '''Test the metrics.TemporalMeanBias metric.'''
@@ -314,6 +539,16 @@ class TestTemporalMeanBias(unittest.TestCase):
         np.testing.assert_array_equal(self.mean_bias.run(
             self.target_dataset, self.reference_dataset), expected_result)
 
+    def test_function_run_in_chunks(self):
+        '''
+        Test mean bias function reading the datasets in chunks.
+        '''
+        mean_bias = metrics.TemporalMeanBias(time_chunk=5)
+        expected_result = np.zeros((5, 5))
+        expected_result.fill(-300)
+        np.testing.assert_array_equal(mean_bias.run(
+            self.target_dataset, self.reference_dataset), expected_result)
+
 
 class TestRMSError(unittest.TestCase):
     '''Test the metrics.RMSError metric.'''
@@ -350,6 +585,188 @@ class TestRMSError(unittest.TestCase):
         result = self.metric.run(self.ref_dataset, self.tgt_dataset)
         self.assertEqual(result, 2.0)
 
+    def test_function_run_in_chunks(self):
+        metric = metrics.RMSError(time_chunk=5)
+        result = metric.run(self.ref_dataset, self.tgt_dataset)
+        self.assertEqual(result, 2.0)
+
+    def test_mismatched_times_in_chunks(self):
+        metric = metrics.RMSError(time_chunk=5)
+        with self.assertRaises(ValueError):
+            metric.run(self.ref_dataset, next(self.tgt_dataset.iter_chunks(5)))
+
+
+class TestJointHistogram(unittest.TestCase):
+    '''Test the metrics.calc_joint_histogram function.'''
+
+    def setUp(self):
+        random = np.random.RandomState(5)
+        self.data1 = ma.array(random.gamma(1., 5., (10, 6, 7)),
+                              mask=random.rand(10, 6, 7) < 0.1)
+        self.data2 = ma.array(random.gamma(1., 2., (10, 6, 7)),
+                              mask=random.rand(10, 6, 7) < 0.1)
+        self.data1[0, 0, 0] = 20.
+        self.bins1 = [0.5, 1., 2., 5., 10., 20.]
+        self.bins2 = [0.1, 0.2, 0.5, 1., 2., 5., 10.]
+
+    def test_histogram(self):
+        valid = ~(self.data1.mask | self.data2.mask)
+        expected = np.histogram2d(self.data1.data[valid],
+                                  self.data2.data[valid],
+                                  bins=[self.bins1, self.bins2])[0]
+        histogram = metrics.calc_joint_histogram(
+            self.data1, self.data2, self.bins1, self.bins2)
+        npt.assert_array_equal(histogram, expected)
+
+    def test_histogram_in_chunks(self):
+        histogram = None
+        for start in range(0, 10, 3):
+            histogram = metrics.calc_joint_histogram(
+                self.data1[start:start + 3], self.data2[start:start + 3],
+                self.bins1, self.bins2, histogram=histogram)
+        npt.assert_array_equal(histogram, metrics.calc_joint_histogram(
+            self.data1, self.data2, self.bins1, self.bins2))
+
+    def test_decreasing_bins(self):
+        with self.assertRaises(ValueError):
+            metrics.calc_joint_histogram(self.data1, self.data2,
+                                         self.bins1[::-1], self.bins2)
+
+    def test_histogram_overlap(self):
+        hist1 = np.array([[1., 2.], [3., 0.]])
+        hist2 = np.array([[2., 1.], [1., 4.]])
+        self.assertEqual(metrics.calc_histogram_overlap(hist1, hist2), 3.)
+        with self.assertRaises(ValueError):
+            metrics.calc_histogram_overlap(hist1, hist2[0])
+
+
+class TestExtremes(unittest.TestCase):
+    '''Test the ETCCDI extremes metrics.'''
+
+    def setUp(self):
+        random = np.random.RandomState(6)
+        values = random.gamma(0.5, 4., (40, 3, 4))
+        values[values < 1.5] = 0.
+        self.values = ma.array(values, mask=random.rand(40, 3, 4) < 0.05)
+        self.values[:, 2, 3] = ma.masked
+        # 22 days of 1999 and 18 days of 2000
+        times = np.array([dt.datetime(1999, 12, 10) + dt.timedelta(days=x)
+                          for x in range(40)])
+        self.dataset = Dataset(np.arange(3.), np.arange(4.), times,
+                               self.values, 'pr')
+        self.years = [slice(0, 22), slice(22, 40)]
+
+    def expected(self, function, values=None):
+        if values is None:
+            return ma.stack([self.expected(function, self.values[year])
+                             for year in self.years])
+        expected = ma.masked_all((3, 4))
+        for i in range(3):
+            for j in range(4):
+                if values[:, i, j].count():
+                    expected[i, j] = function(values[:, i, j])
+        return expected
+
+    def assert_metric(self, metric, expected):
+        self.assertEqual(metric.run(self.dataset).shape, (2, 3, 4))
+        npt.assert_array_almost_equal(metric.run(self.dataset), expected)
+        npt.assert_array_equal(metric.run(self.dataset).mask, expected.mask)
+        for time_chunk in [1, 3, 7]:
+            npt.assert_array_almost_equal(
+                metric.run_in_chunks([self.dataset], time_chunk), expected)
+
+    def test_rx5day(self):
+        def rx5day(series):
+            sums = [series[t:t + 5].sum() for t in range(len(series) - 4)
+                    if not ma.is_masked(series[t:t + 5])]
+            return max(sums) if sums else ma.masked
+        self.assert_metric(metrics.Rx5day(), self.expected(rx5day))
+        self.assert_metric(metrics.Rx1day(), self.expected(ma.max))
+
+    def test_consecutive_days(self):
+        def longest(days):
+            run = longest_run = 0
+            for day in days:
+                run = run + 1 if day else 0
+                longest_run = max(longest_run, run)
+            return longest_run
+        self.assert_metric(metrics.CDD(), self.expected(
+            lambda series: longest((series < 1.).filled(False))))
+        self.assert_metric(metrics.CWD(), self.expected(
+            lambda series: longest((series >= 1.).filled(False))))
+
+    def test_r95p(self):
+        threshold = metrics.calc_wet_day_percentile(self.values[:20])
+        threshold = threshold.filled(np.inf)
+        values = self.values.filled(0)
+        expected = ma.stack([ma.array(
+            np.where((values[year] >= 1.) & (values[year] > threshold),
+                     values[year], 0.).sum(axis=0),
+            mask=self.values.mask[year].all(axis=0)) for year in self.years])
+        self.assert_metric(metrics.R95p(threshold=threshold), expected)
+
+        # Without a threshold the whole dataset is the base period.
+        threshold = metrics.calc_wet_day_percentile(self.values)
+        npt.assert_array_almost_equal(
+            metrics.R95p().run(self.dataset),
+            metrics.R95p(threshold=threshold.filled(np.inf)).run(
+                self.dataset))
+        with self.assertRaises(ValueError):
+            metrics.R95p().run_in_chunks([self.dataset], 7)
+
+    def test_wet_day_percentile(self):
+        percentile = metrics.calc_wet_day_percentile(self.values, 90.)
+        expected = self.expected(lambda series: np.percentile(
+            series.compressed()[series.compressed() >= 1.], 90), self.values)
+        npt.assert_array_almost_equal(percentile, expected)
+
+
+class TestWetSpellAnalysis(unittest.TestCase):
+    '''Test the metrics.wet_spell_analysis function.'''
+
+    def setUp(self):
+        self.values = ma.zeros((12, 2, 2))
+        # Two spells in the first year of the first grid point, and one cut
+        # by the start of the second year
+        self.values[1:3, 0, 0] = [1., 3.]
+        self.values[4, 0, 0] = 2.
+        self.values[6:8, 0, 0] = 5.
+        # A spell with a masked value and one cut by the end of the year
+        self.values[2:4, 1, 1] = 1.
+        self.values[3, 1, 1] = ma.masked
+        self.values[9:12, 1, 1] = 1.
+        # A spell in the second year
+        self.values[8:10, 0, 1] = [0.5, 4.]
+
+    def test_spells(self):
+        duration, peak, total = metrics.wet_spell_analysis(
+            self.values, threshold=0.1, nyear=2, dt=0.5)
+        npt.assert_array_equal(duration, [1., 0.5, 1.])
+        npt.assert_array_equal(peak, [3., 2., 4.])
+        npt.assert_array_equal(total, [4., 2., 4.5])
+
+    def test_summary(self):
+        duration, peak, total, fields = metrics.wet_spell_analysis(
+            self.values, nyear=2, summary=True)
+        npt.assert_array_equal(fields['count'], [[2, 1], [0, 0]])
+        npt.assert_array_equal(fields['mean_duration'].mask,
+                               [[False, False], [True, True]])
+        self.assertEqual(fields['mean_duration'][0, 0], 4.5)
+        self.assertEqual(fields['max_peak'][0, 0], 3.)
+        self.assertEqual(fields['mean_total'][0, 1], 4.5)
+
+
+class TestBuiltInMetrics(unittest.TestCase):
+    '''Test the metrics.built_in_metrics function.'''
+
+    def test_base_classes_left_out(self):
+        built_in_metrics = metrics.built_in_metrics(metrics.Metric)
+        self.assertIn(metrics.Rx5day, built_in_metrics)
+        self.assertIn(metrics.RMSError, built_in_metrics)
+        for base in [metrics.UnaryMetric, metrics.StatisticsMetric,
+                     metrics.RxNday, metrics.ConsecutiveDays]:
+            self.assertNotIn(base, built_in_metrics)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -17,11 +17,22 @@
 
 import unittest
 import datetime
+import io
 import numpy as np
 import pickle
 import os
+import threading
 import ocw.data_source.rcmed as rcmed
 
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlsplit
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlsplit
+
 
 class CustomAssertions:
     # Custom Assertions to handle Numpy Arrays
@@ -191,6 +202,202 @@ class test_rcmed(unittest.TestCase, CustomAssertions):
         self.assertEquals(ds.origin['dataset_id'], self.dataset_id)
         self.assertEquals(ds.origin['parameter_id'], self.parameter_id)
 
+    def test_parse_in_small_blocks(self):
+        rcmed.urlopen = self.return_text
+        read_size = rcmed.READ_SIZE
+        rcmed.READ_SIZE = 1000
+        try:
+            ds = rcmed.parameter_dataset(self.dataset_id,
+                                         self.parameter_id,
+                                         self.min_lat,
+                                         self.max_lat,
+                                         self.min_lon,
+                                         self.max_lon,
+                                         self.start_time,
+                                         self.end_time)
+        finally:
+            rcmed.READ_SIZE = read_size
+        np.testing.assert_array_equal(ds.values, self.values[0])
+
+    def test_unordered_rows(self):
+        with open(os.path.join(self.file_path,
+                               "parameter_dataset_text.txt"), 'rb') as text:
+            header, data = text.read().split(b'data: \r\n')
+        rows = data.split(b'\r\n')[:-1]
+        rows = rows[::-1]
+        # Reverse the rows and drop the first longitude
+        rows = [row for row in rows if b',1.5,' not in row]
+        text = header + b'data: \r\n' + b'\r\n'.join(rows) + b'\r\n'
+        rcmed.urlopen = lambda url: io.BytesIO(text)
+        lats, lons, times, values = rcmed._get_data('url')
+        unique_values = rcmed._make_unique(lats, lons, times)
+        values = rcmed._reshape_values(values, unique_values,
+                                       (lats, lons, times))
+        self.assert1DArraysEqual(unique_values[1], self.lons[1:])
+        np.testing.assert_array_equal(values, self.values[0, :, :, 1:])
+
+    def test_long_fields(self):
+        data = (b'50.5,1.5,0,2002-08-31 00:00:00.000000,'
+                b'1.000000000000000000000000000000e5\r\n')
+        arrays, num_rows = rcmed._parse_rows(data, rcmed._allocate_rows(1), 0)
+        self.assertEqual(num_rows, 1)
+        self.assertEqual(arrays[3][0], 1e5)
+        self.assertEqual(arrays[2][0], b'2002-08-31 00:00:00.000000')
+
+    def test_missing_data_section(self):
+        rcmed.urlopen = lambda url: io.BytesIO(b'meta: \r\n')
+        with self.assertRaises(ValueError):
+            rcmed._get_data('url')
+
+
+class TestCoalesceData(unittest.TestCase):
+
+    def setUp(self):
+        self.server = RCMEDServer(('127.0.0.1', 0), RCMEDHandler)
+        self.server.daemon_threads = True
+        self.server.requests = []
+        self.server.connections = 0
+        self.server.failed = set()
+        self.server.invalid = set()
+        self.server.first_year = 1990
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.saved = (rcmed.URL, rcmed.urlopen, rcmed.RETRY_BACKOFF,
+                      rcmed.WINDOW_ROWS)
+        rcmed.URL = 'http://127.0.0.1:{}/query.php?'.format(
+            self.server.server_address[1])
+        rcmed.urlopen = rcmed._pooled_urlopen
+        rcmed.RETRY_BACKOFF = 0
+        # 5 years of 6 monthly rows per month give 2 year windows.
+        rcmed.WINDOW_ROWS = 150
+
+    def tearDown(self):
+        rcmed.URL, rcmed.urlopen, rcmed.RETRY_BACKOFF, rcmed.WINDOW_ROWS = \
+            self.saved
+        self.server.shutdown()
+        self.server.server_close()
+
+    def coalesce(self):
+        return rcmed._coalesce_data(1, 2, 0, 1, 0, 2,
+                                    datetime.datetime(1990, 1, 1),
+                                    datetime.datetime(2009, 12, 1),
+                                    'monthly', nworkers=2)
+
+    def test_windows(self):
+        lats, lons, times, values = self.coalesce()
+        self.assertEqual(len(values), 20 * 12 * 6)
+        self.assertEqual(len(np.unique(times)), 20 * 12)
+        self.assertEqual(len(self.server.requests), 9)
+        self.assertTrue(any(start.startswith('2009')
+                            for start in self.server.requests))
+        unique_values = rcmed._make_unique(lats, lons, times)
+        grid = rcmed._reshape_values(values, unique_values,
+                                     (lats, lons, times))
+        np.testing.assert_array_equal(grid[:, 1, 2],
+                                      [year * 100 + month
+                                       for year in range(1990, 2010)
+                                       for month in range(1, 13)])
+
+    def test_window_growth_is_capped(self):
+        rcmed.WINDOW_ROWS = 10 ** 6
+        lats, lons, times, values = self.coalesce()
+        self.assertEqual(len(values), 20 * 12 * 6)
+        self.assertEqual(sorted(self.server.requests),
+                         ['19900101T0000Z', '19950101T0000Z',
+                          '20050101T0000Z'])
+
+    def test_empty_first_window(self):
+        self.server.first_year = 1996
+        lats, lons, times, values = self.coalesce()
+        self.assertEqual(len(values), 14 * 12 * 6)
+        self.assertEqual(sorted(self.server.requests),
+                         ['19900101T0000Z', '19950101T0000Z',
+                          '20000101T0000Z', '20050101T0000Z'])
+
+    def test_connections_are_reused(self):
+        self.coalesce()
+        self.assertLessEqual(self.server.connections, 3)
+
+    def test_failed_queries_are_retried(self):
+        self.server.failed.add('19950101T0000Z')
+        lats, lons, times, values = self.coalesce()
+        self.assertEqual(len(values), 20 * 12 * 6)
+        self.assertEqual(self.server.requests.count('19950101T0000Z'), 2)
+
+    def test_invalid_responses_are_not_retried(self):
+        self.server.invalid.add('19950101T0000Z')
+        with self.assertRaises(ValueError):
+            self.coalesce()
+        self.assertEqual(self.server.requests.count('19950101T0000Z'), 1)
+
+    def test_connection_is_reused_after_reading(self):
+        url = rcmed.URL + 'timeStart=19900101T0000Z&timeEnd=19901201T0000Z'
+        key = ('http', urlsplit(url).netloc)
+        response = rcmed._pooled_urlopen(url)
+        self.assertNotIn(key, rcmed._connections.pool)
+        response.read()
+        self.assertIn(key, rcmed._connections.pool)
+
+        # An unread response closes its connection.
+        rcmed._pooled_urlopen(url).close()
+        self.assertNotIn(key, rcmed._connections.pool)
+        self.assertEqual(self.server.connections, 1)
+
+
+class RCMEDServer(ThreadingMixIn, HTTPServer):
+    pass
+
+
+class RCMEDHandler(BaseHTTPRequestHandler):
+    # Monthly values of year * 100 + month on a 2 x 3 grid, like RCMED.
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        start = query['timeStart'][0]
+        end = query['timeEnd'][0]
+        self.server.requests.append(start)
+        if start in self.server.failed:
+            self.server.failed.remove(start)
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if start in self.server.invalid:
+            body = b'meta: \r\n'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        rows = []
+        for year in range(max(int(start[:4]), self.server.first_year),
+                          int(end[:4]) + 1):
+            for month in range(1, 13):
+                if not start[:6] <= '{}{:02d}'.format(year, month) <= end[:6]:
+                    continue
+                for lat in [0.5, 1.5]:
+                    for lon in [0.5, 1.5, 2.5]:
+                        rows.append('{},{},0,{}-{:02d}-01 00:00:00,{}'.format(
+                            lat, lon, year, month, year * 100 + month))
+        body = 'meta: \r\ndata: \r\n' + ''.join(
+            row + '\r\n' for row in rows)
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
 
 def _force_bytes(s, encoding='utf-8'):
     if hasattr(s, 'encode'):
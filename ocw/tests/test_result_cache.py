@@ -0,0 +1,145 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""Tests for result_cache.py, a cache of metric results."""
+
+import datetime as dt
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import numpy.ma as ma
+
+from ocw.dataset import Bounds, Dataset
+from ocw.metrics import Bias, Rx5day, StdDevRatio, TemporalCorrelation
+from ocw.result_cache import ResultCache, result_key
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_and_put(self):
+        cache = ResultCache()
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('a', 0), 0)
+        cache.put('a', ma.array([1., 2.], mask=[False, True]))
+        result = cache.get('a')
+        np.testing.assert_array_equal(result.mask, [False, True])
+        self.assertEqual(len(cache), 1)
+
+    def test_eviction(self):
+        cache = ResultCache(max_entries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        # 'a' was used last, so 'b' is evicted.
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_disk_tier(self):
+        cache = ResultCache(max_entries=1, directory=self.directory)
+        cache.put('a', ma.array([1., 2.], mask=[False, True]))
+        cache.put('b', 2)
+        # 'a' is evicted from memory but still on disk.
+        result = cache.get('a')
+        np.testing.assert_array_equal(result.mask, [False, True])
+
+        other_cache = ResultCache(directory=self.directory)
+        self.assertEqual(other_cache.get('b'), 2)
+        other_cache.clear()
+        self.assertEqual(len(other_cache), 0)
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertIsNone(ResultCache(directory=self.directory).get('a'))
+
+    def test_unreadable_result(self):
+        cache = ResultCache(directory=self.directory)
+        with open(os.path.join(self.directory, 'a.pickle'), 'wb') as bad:
+            bad.write(b'corrupt')
+        self.assertIsNone(cache.get('a'))
+
+    def test_invalid_max_entries(self):
+        with self.assertRaises(ValueError):
+            ResultCache(max_entries=-1)
+
+
+class TestResultKey(unittest.TestCase):
+
+    def setUp(self):
+        lats = np.arange(3.)
+        lons = np.arange(4.)
+        times = np.array([dt.datetime(2000, month, 1)
+                          for month in range(1, 13)])
+        values = np.arange(144.).reshape(12, 3, 4)
+        self.ref = Dataset(lats, lons, times, values, 'pr')
+        self.target = Dataset(lats, lons, times, values + 1, 'pr')
+        self.same_target = Dataset(lats, lons, times, values + 1, 'pr',
+                                   name='copy')
+
+    def key(self, metric, subregion=None):
+        return result_key(metric, [self.ref.fingerprint(),
+                                   self.target.fingerprint()], subregion)
+
+    def test_metric_parameters(self):
+        self.assertEqual(self.key(TemporalCorrelation()),
+                         self.key(TemporalCorrelation()))
+        self.assertNotEqual(self.key(TemporalCorrelation()),
+                            self.key(TemporalCorrelation(p_values=True)))
+        self.assertNotEqual(self.key(Rx5day()), self.key(Bias()))
+        # The time chunks don't change the result.
+        self.assertEqual(self.key(StdDevRatio()),
+                         self.key(StdDevRatio(time_chunk=4)))
+
+    def test_dataset_contents(self):
+        self.assertEqual(
+            self.key(Bias()),
+            result_key(Bias(), [self.ref.fingerprint(),
+                                self.same_target.fingerprint()]))
+        self.assertNotEqual(
+            self.key(Bias()),
+            result_key(Bias(), [self.target.fingerprint(),
+                                self.ref.fingerprint()]))
+        self.target.values = self.target.values * 2
+        self.assertNotEqual(
+            self.key(Bias()),
+            result_key(Bias(), [self.ref.fingerprint(),
+                                self.same_target.fingerprint()]))
+
+    def test_subregion(self):
+        subregion = Bounds(lat_min=0, lat_max=1, lon_min=0, lon_max=2)
+        self.assertNotEqual(self.key(Bias()), self.key(Bias(), subregion))
+        self.assertEqual(
+            self.key(Bias(), subregion),
+            self.key(Bias(), Bounds(lat_min=0, lat_max=1,
+                                    lon_min=0, lon_max=2)))
+        self.assertNotEqual(
+            self.key(Bias(), subregion),
+            self.key(Bias(), Bounds(lat_min=0, lat_max=2,
+                                    lon_min=0, lon_max=2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
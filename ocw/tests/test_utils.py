@@ -64,6 +64,59 @@ class TestDecodeTimes(unittest.TestCase):
         self.assertEqual(new_times[-1], end_time)
 
 
+class TestDecodeTimeFields(unittest.TestCase):
+
+    def test_months_since(self):
+        fields = utils.decode_time_fields(np.arange(14), 'months since 1950-01-31',
+                                          'standard')
+        self.assertEqual(fields['year'][-1], 1951)
+        self.assertEqual(fields['month'][-1], 2)
+        # The day of the month is clipped to the length of February
+        self.assertEqual(fields['day'][1], 28)
+
+    def test_360_day_calendar(self):
+        fields = utils.decode_time_fields(np.array([0., 59.5, 360.]),
+                                          'days since 2000-01-01', '360_day')
+        np.testing.assert_array_equal(fields['year'], [2000, 2000, 2001])
+        np.testing.assert_array_equal(fields['month'], [1, 2, 1])
+        np.testing.assert_array_equal(fields['day'], [1, 30, 1])
+        np.testing.assert_array_equal(fields['hour'], [0, 12, 0])
+
+    def test_noleap_calendar(self):
+        fields = utils.decode_time_fields(np.array([58., 59.]),
+                                          'days since 2000-01-01', 'noleap')
+        self.assertEqual(fields['calendar'], '365_day')
+        np.testing.assert_array_equal(fields['month'], [2, 3])
+        np.testing.assert_array_equal(fields['day'], [28, 1])
+
+    def test_standard_calendar(self):
+        fields = utils.decode_time_fields(np.array([0., 36.]),
+                                          'hours since 2000-02-28 12:00:00')
+        np.testing.assert_array_equal(fields['day'], [28, 1])
+        np.testing.assert_array_equal(fields['hour'], [12, 0])
+
+    def test_unsupported_calendar(self):
+        fields = utils.decode_time_fields(np.arange(3), 'days since 2000-01-01',
+                                          'julian')
+        self.assertIsNone(fields)
+
+    def test_fields_to_datetimes(self):
+        fields = utils.decode_time_fields(np.array([0., 1.]),
+                                          'days since 2000-01-01 06:00:00')
+        times = utils.time_fields_to_datetimes(fields)
+        self.assertEqual(times[1], datetime.datetime(2000, 1, 2, 6))
+        self.assertTrue(all([type(x) is datetime.datetime for x in times]))
+
+    def test_numeric_decode(self):
+        netcdf = netCDF4.Dataset(os.path.join(
+            os.path.dirname(os.path.realpath(__file__)),
+            'lat_lon_time_daily.nc'), mode='r')
+        fields = utils.decode_time_values(netcdf, 'time', as_datetimes=False)
+        self.assertEqual(fields['year'][0], 1951)
+        self.assertEqual(fields['month'][0], 4)
+        self.assertEqual(fields['day'][0], 14)
+
+
 class TestTimeUnitsParse(unittest.TestCase):
 
     def test_valid_parse(self):
@@ -290,6 +343,11 @@ class TestCalcTemporalMean(unittest.TestCase):
         result = utils.calc_temporal_mean(self.test_dataset)
         np.testing.assert_array_equal(result, mean_values)
 
+    def test_returned_mean_in_chunks(self):
+        result = utils.calc_temporal_mean(self.test_dataset, time_chunk=4)
+        np.testing.assert_array_equal(
+            result, utils.calc_temporal_mean(self.test_dataset))
+
 
 class TestCalcAreaWeightedSpatialAverage(unittest.TestCase):
 
@@ -401,6 +459,12 @@ class TestCalcClimatologyMonthly(unittest.TestCase):
         np.testing.assert_array_equal(actual_result, expected_result)
         np.testing.assert_array_equal(actual_times, expected_times)
 
+    def test_calc_climatology_monthly_in_chunks(self):
+        expected_result = np.ones(300).reshape(12, 5, 5)
+        actual_result, _ = utils.calc_climatology_monthly(self.dataset,
+                                                          time_chunk=5)
+        np.testing.assert_array_equal(actual_result, expected_result)
+
     def test_invalid_time_shape(self):
         flat_array = np.array(range(350))
         self.dataset.values = flat_array.reshape(14, 5, 5)
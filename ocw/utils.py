@@ -31,14 +31,55 @@ import scipy.interpolate as interpolate
 import scipy.stats as stats
 from scipy.ndimage import map_coordinates
 
+import ocw.config as config
 
-def decode_time_values(dataset, time_var_name):
+
+# Number of seconds in each of the time units which can be decoded with
+# plain integer arithmetic.
+_TIME_UNIT_SECONDS = {
+    'seconds': 1,
+    'minutes': 60,
+    'hours': 3600,
+    'days': 86400,
+}
+
+# Month lengths of the fixed-length model calendars.
+_FIXED_CALENDAR_MONTH_DAYS = {
+    '360_day': [30] * 12,
+    '365_day': [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31],
+    '366_day': [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31],
+}
+
+_CALENDAR_ALIASES = {
+    'noleap': '365_day',
+    'all_leap': '366_day',
+    'gregorian': 'standard',
+}
+
+# Calendars which are represented with python datetime objects.
+_REAL_CALENDARS = ['standard', 'proleptic_gregorian']
+
+# First date of the Gregorian calendar. The 'standard' calendar switches to
+# the Julian calendar before this date.
+_GREGORIAN_START = np.datetime64('1582-10-15', 's')
+
+
+def decode_time_values(dataset, time_var_name, as_datetimes=True):
     ''' Decode NetCDF time values into Python datetime objects.
 
+    The decoding is done with vectorized integer arithmetic for the
+    'months since' units and for the standard, proleptic_gregorian, 360_day,
+    365_day and 366_day calendars. Other cases fall back to
+    :func:`netCDF4.num2date`.
+
     :param dataset: The dataset from which time values should be extracted.
     :type dataset: netCDF4.Dataset
     :param time_var_name: The name of the time variable in dataset.
     :type time_var_name: :mod:`string`
+    :param as_datetimes: (Optional) If False, the compact numeric time fields
+        returned by :func:`decode_time_fields` are returned instead of the
+        datetime objects.
+    :type as_datetimes: :class:`bool`
 
     :returns: The list of converted datetime values.
 
@@ -47,33 +88,322 @@ def decode_time_values(dataset, time_var_name):
         be found in the dataset.
     '''
     time_data = dataset.variables[time_var_name]
-    time_format = time_data.units
-    if time_format[-1].lower() == 'z':
-        time_format = time_format[:-1]
-    if time_format[-3:].lower() == 'utc':
-        time_format = time_format[:-3]
+    time_format = _strip_time_zone(time_data.units)
+    times_calendar = getattr(time_data, 'calendar', 'standard')
+
+    time_fields = decode_time_fields(time_data[:], time_format, times_calendar)
+    if time_fields is None:
+        if not as_datetimes:
+            err = "Unable to decode {} with the {} calendar numerically".format(
+                time_format, times_calendar)
+            raise ValueError(err)
+
+        return num2date(time_data[:], units=time_format,
+                        calendar=times_calendar)
+
+    if not as_datetimes:
+        return time_fields
+
+    return time_fields_to_datetimes(time_fields)
+
+
+def decode_time_fields(time_values, time_format, calendar='standard'):
+    ''' Decode numeric time values into arrays of date and time fields.
+
+    :param time_values: The raw time values of a NetCDF time variable.
+    :type time_values: :class:`numpy.ndarray`
+    :param time_format: The time data units string of the form
+        '<units> since <base time date>'
+    :type time_format: :mod:`string`
+    :param calendar: (Optional) The CF calendar of the time values.
+    :type calendar: :mod:`string`
+
+    :returns: A dictionary with integer arrays for the 'year', 'month', 'day',
+        'hour', 'minute' and 'second' keys and the normalized 'calendar' name,
+        or None if the values can't be decoded with integer arithmetic.
+        Times are resolved to the nearest second.
 
+    :raises ValueError: If the time units or the base time couldn't be parsed.
+    '''
+    calendar = _normalize_calendar(calendar)
     time_units = parse_time_units(time_format)
+    time_base = parse_time_base(time_format)
+    time_values = np.asarray(ma.filled(time_values, 0))
 
-    times = []
     if time_units == 'months':
-        # datetime.timedelta doesn't support a 'months' option. To remedy
-        # this, a month == 30 days for our purposes.
-        time_base = parse_time_base(time_format)
-        for time_val in time_data:
-            times.append(time_base + relativedelta(months=int(time_val)))
+        # A month offset keeps the day of the month of the base time, clipped
+        # to the length of the resulting month.
+        total_months = (time_base.year * 12 + time_base.month - 1 +
+                        time_values.astype(np.int64))
+        years = total_months // 12
+        months = total_months % 12 + 1
+        days = np.minimum(time_base.day, _days_in_month(years, months,
+                                                        calendar))
+        return _make_time_fields(years, months, days,
+                                 np.full(years.shape, time_base.hour),
+                                 np.full(years.shape, time_base.minute),
+                                 np.full(years.shape, time_base.second),
+                                 calendar)
+
+    if time_units not in _TIME_UNIT_SECONDS:
+        return None
+
+    offsets = np.rint(time_values * _TIME_UNIT_SECONDS[time_units])
+    offsets = offsets.astype(np.int64)
+
+    if calendar in _FIXED_CALENDAR_MONTH_DAYS:
+        base_fields = _make_time_fields(time_base.year, time_base.month,
+                                        time_base.day, time_base.hour,
+                                        time_base.minute, time_base.second,
+                                        calendar)
+        return _calendar_seconds_to_time_fields(
+            time_fields_to_offsets(base_fields) + offsets, calendar)
+    elif calendar in _REAL_CALENDARS:
+        datetimes = np.datetime64(time_base, 's') + offsets.astype(
+            'timedelta64[s]')
+        if (calendar == 'standard' and datetimes.size and
+                datetimes.min() < _GREGORIAN_START):
+            return None
+
+        return _datetime64_to_time_fields(datetimes, calendar)
+
+    return None
+
+
+def datetimes_to_time_fields(times):
+    ''' Split an array of datetime objects into arrays of time fields.
+
+    :param times: Python datetime, numpy datetime64 or cftime objects.
+    :type times: :class:`numpy.ndarray`
+
+    :returns: Time fields in the format returned by :func:`decode_time_fields`.
+    :rtype: :class:`dict`
+    '''
+    times = np.asarray(times)
+    if times.dtype.kind == 'M':
+        return _datetime64_to_time_fields(times.astype('datetime64[s]'),
+                                          'standard')
+
+    calendar = 'standard'
+    if times.size and not isinstance(times.item(0), dt.date):
+        calendar = _normalize_calendar(
+            getattr(times.item(0), 'calendar', 'standard') or 'standard')
+
+    if calendar in _FIXED_CALENDAR_MONTH_DAYS:
+        seconds = date2num(times, units='seconds since 0001-01-01 00:00:00',
+                           calendar=calendar)
+        return _calendar_seconds_to_time_fields(
+            np.rint(seconds).astype(np.int64), calendar)
+
+    if calendar in _REAL_CALENDARS:
+        if calendar == 'standard' and times.size and not isinstance(
+                times.item(0), dt.date):
+            seconds = date2num(times, units='seconds since 1970-01-01 00:00:00',
+                               calendar=calendar)
+            datetimes = np.rint(seconds).astype('datetime64[s]')
+        else:
+            datetimes = times.astype('datetime64[s]')
+
+        if not datetimes.size or datetimes.min() >= _GREGORIAN_START:
+            return _datetime64_to_time_fields(datetimes, calendar)
+
+    return _make_time_fields(*[[getattr(t, name) for t in times]
+                               for name in _TIME_FIELD_NAMES],
+                             calendar=calendar)
+
+
+def time_fields_to_datetimes(time_fields):
+    ''' Create datetime objects from decoded time fields.
+
+    Dates in the standard and proleptic_gregorian calendars (or any other
+    calendar decoded from 'months since' units) are converted to
+    :class:`datetime.datetime` objects. The 360_day calendar is also converted
+    to :class:`datetime.datetime` objects as long as every date exists in the
+    Gregorian calendar. All other dates become calendar aware cftime objects.
+
+    :param time_fields: Time fields as returned by :func:`decode_time_fields`.
+    :type time_fields: :class:`dict`
+
+    :returns: An array of datetime objects.
+    :rtype: :class:`numpy.ndarray`
+    '''
+    calendar = time_fields['calendar']
+    years = time_fields['year']
+    months = time_fields['month']
+    days = time_fields['day']
+
+    gregorian_dates = calendar not in _FIXED_CALENDAR_MONTH_DAYS
+    if calendar == '360_day':
+        gregorian_dates = np.all(
+            days <= _days_in_month(years, months, 'standard'))
+
+    if not gregorian_dates:
+        return num2date(time_fields_to_offsets(time_fields),
+                        units='seconds since 0001-01-01 00:00:00',
+                        calendar=calendar)
+
+    dates = ((years - 1970) * 12 + months - 1).astype('datetime64[M]')
+    dates = dates.astype('datetime64[s]')
+    dates = (dates + ((days - 1) * 86400 + time_fields['hour'] * 3600 +
+                      time_fields['minute'] * 60 +
+                      time_fields['second']).astype('timedelta64[s]'))
+    return dates.astype('datetime64[us]').astype(object)
+
+
+def time_fields_to_offsets(time_fields):
+    ''' Count the seconds since 0001-01-01 00:00:00 of decoded time fields.
+
+    The offsets are calculated in the calendar of the time fields, so they
+    increase monotonically with the dates they represent.
+
+    :param time_fields: Time fields as returned by :func:`decode_time_fields`.
+    :type time_fields: :class:`dict`
+
+    :returns: The time offsets in seconds.
+    :rtype: :class:`numpy.ndarray` of int64
+    '''
+    years = time_fields['year']
+    if time_fields['calendar'] in _FIXED_CALENDAR_MONTH_DAYS:
+        month_starts = _month_starts(time_fields['calendar'])
+        total_days = ((years - 1) * month_starts[-1] +
+                      month_starts[time_fields['month'] - 1] +
+                      time_fields['day'] - 1)
     else:
-        try:
-            times_calendar = time_data.calendar
-        except:
-            times_calendar = 'standard'
+        # Days since 0001-01-01 in the proleptic Gregorian calendar
+        prev_years = years - 1
+        total_days = (prev_years * 365 + prev_years // 4 -
+                      prev_years // 100 + prev_years // 400 +
+                      calc_day_of_year(time_fields) - 1)
 
-        times = num2date(
-            time_data[:], units=time_format, calendar=times_calendar)
-        if times_calendar == '360_day':
-            for it, t in enumerate(times):
-                times[it] = dt.datetime.strptime(str(t), '%Y-%m-%d 00:00:00')
-    return times
+    return (total_days * 86400 + time_fields['hour'] * 3600 +
+            time_fields['minute'] * 60 + time_fields['second'])
+
+
+def offsets_to_time_fields(offsets, calendar):
+    ''' Split seconds since 0001-01-01 00:00:00 into time fields.
+
+    This is the inverse of :func:`time_fields_to_offsets`.
+
+    :param offsets: The time offsets in seconds.
+    :type offsets: :class:`numpy.ndarray`
+
+    :param calendar: The CF calendar of the offsets.
+    :type calendar: :mod:`string`
+
+    :returns: Time fields in the format returned by :func:`decode_time_fields`.
+    :rtype: :class:`dict`
+    '''
+    offsets = np.asarray(offsets, dtype=np.int64)
+    calendar = _normalize_calendar(calendar)
+    if calendar in _FIXED_CALENDAR_MONTH_DAYS:
+        return _calendar_seconds_to_time_fields(offsets, calendar)
+
+    datetimes = (np.datetime64('0001-01-01T00:00:00', 's') +
+                 offsets.astype('timedelta64[s]'))
+    return _datetime64_to_time_fields(datetimes, calendar)
+
+
+def calc_day_of_year(time_fields):
+    ''' Calculate the day of the year (starting at 1) of decoded time fields.
+
+    :param time_fields: Time fields as returned by :func:`decode_time_fields`.
+    :type time_fields: :class:`dict`
+
+    :returns: The day of the year of each time.
+    :rtype: :class:`numpy.ndarray` of int64
+    '''
+    calendar = time_fields['calendar']
+    months = time_fields['month']
+    if calendar in _FIXED_CALENDAR_MONTH_DAYS:
+        return _month_starts(calendar)[months - 1] + time_fields['day']
+
+    years = time_fields['year']
+    return (_month_starts('365_day')[months - 1] + time_fields['day'] +
+            ((months > 2) & _is_leap_year(years)))
+
+
+_TIME_FIELD_NAMES = ['year', 'month', 'day', 'hour', 'minute', 'second']
+
+
+def _make_time_fields(years, months, days, hours, minutes, seconds,
+                      calendar):
+    ''' Bundle decoded time arrays into a time fields dictionary. '''
+    return {
+        'year': np.asarray(years, dtype=np.int64),
+        'month': np.asarray(months, dtype=np.int64),
+        'day': np.asarray(days, dtype=np.int64),
+        'hour': np.asarray(hours, dtype=np.int64),
+        'minute': np.asarray(minutes, dtype=np.int64),
+        'second': np.asarray(seconds, dtype=np.int64),
+        'calendar': calendar
+    }
+
+
+def _datetime64_to_time_fields(datetimes, calendar):
+    ''' Split numpy datetime64 values into time fields. '''
+    month_starts = datetimes.astype('datetime64[M]')
+    dates = datetimes.astype('datetime64[D]')
+    years = month_starts.astype('datetime64[Y]').astype(np.int64) + 1970
+    months = month_starts.astype(np.int64) % 12 + 1
+    days = (dates - month_starts).astype(np.int64) + 1
+    hours, day_seconds = np.divmod((datetimes - dates).astype(np.int64), 3600)
+    minutes, seconds = np.divmod(day_seconds, 60)
+    return _make_time_fields(years, months, days, hours, minutes, seconds,
+                             calendar)
+
+
+def _calendar_seconds_to_time_fields(seconds, calendar):
+    ''' Split seconds since 0001-01-01 of a fixed-length calendar into time
+    fields.
+    '''
+    month_starts = _month_starts(calendar)
+    total_days, day_seconds = np.divmod(seconds, 86400)
+    years, day_of_year = np.divmod(total_days, month_starts[-1])
+    months = np.searchsorted(month_starts, day_of_year, side='right')
+    days = day_of_year - month_starts[months - 1] + 1
+    hours, day_seconds = np.divmod(day_seconds, 3600)
+    minutes, seconds = np.divmod(day_seconds, 60)
+    return _make_time_fields(years + 1, months, days, hours, minutes, seconds,
+                             calendar)
+
+
+def _month_starts(calendar):
+    ''' Day of the year on which each month of a calendar starts, counting
+    from 0, followed by the length of the year.
+    '''
+    month_days = _FIXED_CALENDAR_MONTH_DAYS[calendar]
+    return np.concatenate(([0], np.cumsum(month_days)))
+
+
+def _is_leap_year(years):
+    ''' Check for leap years in the proleptic Gregorian calendar. '''
+    return ((years % 4 == 0) & (years % 100 != 0)) | (years % 400 == 0)
+
+
+def _days_in_month(years, months, calendar):
+    ''' Calculate the number of days of each (year, month) pair. '''
+    if calendar in _FIXED_CALENDAR_MONTH_DAYS:
+        month_days = np.array(_FIXED_CALENDAR_MONTH_DAYS[calendar])
+        return month_days[np.asarray(months) - 1]
+
+    month_days = np.array(_FIXED_CALENDAR_MONTH_DAYS['365_day'])
+    month_days = month_days[np.asarray(months) - 1]
+    return month_days + ((months == 2) & _is_leap_year(years))
+
+
+def _normalize_calendar(calendar):
+    ''' Map a CF calendar name onto its canonical name. '''
+    calendar = calendar.lower()
+    return _CALENDAR_ALIASES.get(calendar, calendar)
+
+
+def _strip_time_zone(time_format):
+    ''' Remove a trailing 'z' or 'utc' marker from a time units string. '''
+    if time_format[-1].lower() == 'z':
+        time_format = time_format[:-1]
+    if time_format[-3:].lower() == 'utc':
+        time_format = time_format[:-3]
+    return time_format
 
 
 def parse_time_units(time_format):
@@ -289,17 +619,70 @@ def reshape_monthly_to_annually(dataset):
     return values
 
 
-def calc_temporal_mean(dataset):
+def calc_temporal_mean(dataset, time_chunk=None):
     ''' Calculate temporal mean of dataset's values
 
     :param dataset: OCW Dataset whose first dimension is time
     :type dataset: :class:`dataset.Dataset`
 
+    :param time_chunk: (Optional) Read the values in blocks of this many
+        times instead of all at once.
+    :type time_chunk: :class:`int`
+
     :returns: Mean values averaged for the first dimension (time)
     '''
+    if time_chunk is not None:
+        groups = np.zeros(len(dataset.times), dtype=int)
+        return calc_group_means(dataset, groups, 1, time_chunk)[0]
     return ma.mean(dataset.values, axis=0)
 
 
+def calc_group_means(dataset, groups, num_groups, time_chunk=None):
+    ''' Average the values of a dataset over groups of times
+
+    The values are read in blocks of time_chunk times, so only one block of
+    the values and the running sums of each group are held in memory at a
+    time. Sums are accumulated in double precision. Groups without any
+    valid values are masked.
+
+    :param dataset: OCW Dataset whose first dimension is time
+    :type dataset: :class:`dataset.Dataset`
+
+    :param groups: The group number, in [0, num_groups), of each time.
+    :type groups: :class:`numpy.ndarray`
+
+    :param num_groups: The number of groups.
+    :type num_groups: :class:`int`
+
+    :param time_chunk: (Optional) The number of times in each block. All
+        times are read at once by default.
+    :type time_chunk: :class:`int`
+
+    :returns: The mean values of each group, of shape
+        (num_groups,) + dataset.values.shape[1:]
+    :rtype: :class:`numpy.ma.core.MaskedArray`
+    '''
+    groups = np.asarray(groups)
+    if time_chunk is None:
+        time_chunk = max(len(dataset.times), 1)
+
+    shape = (num_groups,) + tuple(dataset.values.shape[1:])
+    sums = np.zeros(shape, dtype=np.float64)
+    counts = np.zeros(shape, dtype=np.int64)
+    for time_slice in dataset._time_slices(time_chunk):
+        values = ma.asarray(dataset.values[time_slice])
+        valid = ~ma.getmaskarray(values)
+        values = values.filled(0)
+        chunk_groups = groups[time_slice]
+        for group in np.unique(chunk_groups):
+            index = chunk_groups == group
+            sums[group] += values[index].sum(axis=0, dtype=np.float64)
+            counts[group] += valid[index].sum(axis=0)
+
+    means = sums / np.maximum(counts, 1)
+    return ma.array(means, mask=counts == 0).astype(config.get_dtype(dataset))
+
+
 def calc_climatology_year(dataset):
     ''' Calculate climatology of dataset's values for each year
 
@@ -329,7 +712,7 @@ def calc_climatology_year(dataset):
     return annually_mean, total_mean
 
 
-def calc_climatology_monthly(dataset):
+def calc_climatology_monthly(dataset, time_chunk=None):
     ''' Calculate monthly mean values for a dataset.
     Follow COARDS climo stats calculation, the year can be given as 0
     but the min year allowed in Python is 1
@@ -339,6 +722,10 @@ def calc_climatology_monthly(dataset):
         divisible by 12
     :type dataset: :class:`dataset.Dataset`
 
+    :param time_chunk: (Optional) Read the values in blocks of this many
+        times instead of all at once.
+    :type time_chunk: :class:`int`
+
     :returns: Mean values for each month of the year of shape
               (12, num_lats, num_lons) and times array of datetime objects
               of length 12
@@ -353,7 +740,11 @@ def calc_climatology_monthly(dataset):
         )
         raise ValueError(error)
     else:
-        values = reshape_monthly_to_annually(dataset).mean(axis=0)
+        if time_chunk is not None:
+            groups = np.arange(len(dataset.times)) % 12
+            values = calc_group_means(dataset, groups, 12, time_chunk)
+        else:
+            values = reshape_monthly_to_annually(dataset).mean(axis=0)
 
         # A year can commence from any month
         first_month = dataset.times[0].month
@@ -403,11 +794,11 @@ def adjust_model_years_for_climatology_calculation(dataset_array):
     slc = trim_dataset(dataset_array[0])
     obs_times = dataset_array[0].times[slc]
     for idata, dataset in enumerate(dataset_array[1:]):
-        year_diff = obs_times[-1].year - dataset.times[-1].year    
-        nt = dataset.times.size
-        for it in np.arange(nt):
-            dataset.times[it] = dataset.times[it].replace(year = dataset.times[it].year + year_diff)
-    return dataset_array                              
+        year_diff = obs_times[-1].year - dataset.times[-1].year
+        # Reassign the times so the dataset's cached TimeIndex is reset
+        dataset.times = np.array([t.replace(year=t.year + year_diff)
+                                  for t in dataset.times])
+    return dataset_array
 
 def trim_dataset(dataset):
     ''' Trim datasets such that first and last year of data have all 12 months
@@ -449,9 +840,11 @@ def calc_subregion_area_mean_and_std(dataset_array, subregions):
     mask_array = dataset_array[0].values[0, :].mask
     # dataset0.values.shsape[0]: length of the time dimension
     # spatial average
-    t_series = ma.zeros([ndata, dataset0.values.shape[0], len(subregions)])
+    t_series = ma.zeros([ndata, dataset0.values.shape[0], len(subregions)],
+                        dtype=config.get_dtype(dataset0))
     # spatial standard deviation
-    spatial_std = ma.zeros([ndata, dataset0.values.shape[0], len(subregions)])
+    spatial_std = ma.zeros([ndata, dataset0.values.shape[0], len(subregions)],
+                           dtype=config.get_dtype(dataset0))
 
     for iregion, subregion in enumerate(subregions):
         lat_min, lat_max, lon_min, lon_max = subregion[1]
@@ -460,9 +853,11 @@ def calc_subregion_area_mean_and_std(dataset_array, subregions):
         subregion_array[y_index, x_index] = iregion + 1
         for idata in np.arange(ndata):
             t_series[idata, :, iregion] = ma.mean(dataset_array[idata].values[
-                                                  :, y_index, x_index], axis=1)
+                                                  :, y_index, x_index], axis=1,
+                                                  dtype=np.float64)
             spatial_std[idata, :, iregion] = ma.std(
-                dataset_array[idata].values[:, y_index, x_index], axis=1)
+                dataset_array[idata].values[:, y_index, x_index], axis=1,
+                dtype=np.float64)
     subregion_array = ma.array(subregion_array, mask=mask_array)
     return t_series, spatial_std, subregion_array
 
@@ -483,7 +878,7 @@ def calc_area_weighted_spatial_average(dataset, area_weight=False):
     weights = np.cos(lats * np.pi / 180.)
 
     nt, ny, nx = dataset.values.shape
-    spatial_average = ma.zeros(nt)
+    spatial_average = ma.zeros(nt, dtype=config.get_dtype(dataset))
     for it in np.arange(nt):
         if area_weight:
             spatial_average[it] = ma.average(
@@ -628,10 +1023,12 @@ def regrid_spatial_mask(target_lon, target_lat, mask_lon, mask_lat, mask_var,
         return mask_out | mask_outside
 
 
-def propagate_spatial_mask_over_time(data_array, mask):
+def propagate_spatial_mask_over_time(data_array, mask, dtype=None):
     if data_array.ndim == 3 and mask.ndim == 2:
         nt = data_array.shape[0]
-        new_data_array = ma.zeros(data_array.shape)
+        if dtype is None:
+            dtype = config.get_dtype()
+        new_data_array = ma.zeros(data_array.shape, dtype=dtype)
         if isinstance(data_array.mask, bool):
             new_mask = mask
             for it in np.arange(nt):
@@ -731,12 +1128,13 @@ def calculate_daily_climatology(dataset):
     :rtype: 3d masked numpy array.shape (number of unique days, y, x)
     '''
 
-    days = [d.month * 100. + d.day for d in dataset.times]
+    days = dataset.time_index.month * 100 + dataset.time_index.day
     days_sorted = np.unique(days)
     ndays = days_sorted.size
     nt, ny, nx = dataset.values.shape
-    values_clim = ma.zeros([ndays, ny, nx])
+    values_clim = ma.zeros([ndays, ny, nx], dtype=config.get_dtype(dataset))
     for iday, day in enumerate(days_sorted):
         t_index = np.where(days == day)[0]
-        values_clim[iday, :] = ma.mean(dataset.values[t_index, :], axis=0)
+        values_clim[iday, :] = ma.mean(dataset.values[t_index, :], axis=0,
+                                       dtype=np.float64)
     return values_clim
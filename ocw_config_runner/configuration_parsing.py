@@ -139,18 +139,22 @@ def _config_is_well_formed(config_data):
 
 def _contains_unary_metrics(config_metric_data):
     """"""
-    unarys = [cls.__name__ for cls in metrics.UnaryMetric.__subclasses__()]
+    unarys = [cls.__name__
+              for cls in metrics.built_in_metrics(metrics.UnaryMetric)]
     return any(metric in unarys for metric in config_metric_data)
 
 def _contains_binary_metrics(config_metric_data):
     """"""
-    binarys = [cls.__name__ for cls in metrics.BinaryMetric.__subclasses__()]
+    binarys = [cls.__name__
+               for cls in metrics.built_in_metrics(metrics.BinaryMetric)]
     return any(metric in binarys for metric in config_metric_data)
 
 def _fetch_built_in_metrics():
     """"""
-    unarys = [cls.__name__ for cls in metrics.UnaryMetric.__subclasses__()]
-    binarys = [cls.__name__ for cls in metrics.BinaryMetric.__subclasses__()]
+    unarys = [cls.__name__
+              for cls in metrics.built_in_metrics(metrics.UnaryMetric)]
+    binarys = [cls.__name__
+               for cls in metrics.built_in_metrics(metrics.BinaryMetric)]
     return unarys + binarys
 
 def _valid_dataset_config_data(dataset_config_data):
@@ -157,6 +157,12 @@ def generate_evaluation_information(evaluation):
 
         eval_config['subset'] = _calc_subset_config(datasets)
 
+    if evaluation.result_cache is not None:
+        eval_config['result_cache'] = {
+            'directory': evaluation.result_cache.directory,
+            'max_entries': evaluation.result_cache.max_entries
+        }
+
     return eval_config
 
 def generate_subregion_information(evaluation):
@@ -21,6 +21,7 @@ import logging
 
 from ocw.dataset import Bounds
 from ocw.evaluation import Evaluation
+from ocw.result_cache import ResultCache
 import ocw.dataset_processor as dsp
 import ocw.data_source.local as local
 import ocw.data_source.rcmed as rcmed
@@ -66,7 +67,14 @@ def generate_evaluation_from_config(config_data):
     if 'subregions' in config_data:
         subregions = [_load_subregion(s) for s in config_data['subregions']]
 
-    return Evaluation(reference, targets, eval_metrics, subregions=subregions)
+    # Load the result cache (if present)
+    result_cache = None
+    evaluation_config = config_data.get('evaluation') or {}
+    if 'result_cache' in evaluation_config:
+        result_cache = ResultCache(**(evaluation_config['result_cache'] or {}))
+
+    return Evaluation(reference, targets, eval_metrics, subregions=subregions,
+                      result_cache=result_cache)
 
 def _load_dataset(dataset_config_data):
     """"""
@@ -19,6 +19,7 @@ from mock import patch
 import unittest
 
 import ocw_config_runner.configuration_parsing as parser
+import ocw_config_runner.evaluation_creation as eval_create
 import ocw.metrics as metrics
 
 import yaml
@@ -391,6 +392,15 @@ class MetricFetchTest(unittest.TestCase):
         ret = parser._contains_unary_metrics(self.binary_conf['metrics'])
         self.assertFalse(ret)
 
+    def test_built_in_metrics_can_be_built(self):
+        built_in_metrics = parser._fetch_built_in_metrics()
+        self.assertIn('Rx5day', built_in_metrics)
+        for name in ['StatisticsMetric', 'RxNday', 'ConsecutiveDays']:
+            self.assertNotIn(name, built_in_metrics)
+        for name in built_in_metrics:
+            self.assertIsInstance(eval_create._load_metric(name)(),
+                                  metrics.Metric)
+
 
 class InvalidDatasetConfig(unittest.TestCase):
     @classmethod